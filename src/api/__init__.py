@@ -1 +0,0 @@
-from . import router
\ No newline at end of file
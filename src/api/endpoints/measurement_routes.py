@@ -1,36 +1,85 @@
-from fastapi import APIRouter, HTTPException
-from typing import List, Annotated
+from fastapi import APIRouter, HTTPException, Query
+from typing import List, Annotated, Optional
 import logging
 
 from fastapi.params import Depends
+from pydantic_mongo.errors import PaginationError
 
-from api.models.measurement import RestMeasurement
+from api.models.measurement import RestMeasurement, RestMeasurementPage, RestMeasurementSummary
 from database.engine import DataContext, get_db
-from services.auth_service import get_token_header, HttpObjectId
-from services.mapper_service import map_measurement_db_to_rest_measurement
+from database.pagination import page_cursor
+from database.schemas.user_db import UserDbModel
+from services.auth_service import get_current_user, get_token_header, HttpObjectId
+from services.impulse_response_service import delete_impulse_responses, find_impulse_response, migrate_measurement
+from services.mapper_service import (
+    map_measurement_db_to_rest_measurement,
+    map_measurement_summary_db_to_rest_measurement_summary,
+)
 
 router = APIRouter()
 
 logger = logging.getLogger("uvicorn.info")
 
-@router.get("/", response_model=List[RestMeasurement], tags=["measurements"])
+@router.get("/", response_model=RestMeasurementPage, tags=["measurements"])
 async def get_measurements(
+        token: Annotated[str, Depends(get_token_header)],
+        data_context: Annotated[DataContext, Depends(get_db)],
+        limit: Annotated[int, Query(ge=1, le=100)] = 50,
+        after: Optional[str] = None,
+) -> RestMeasurementPage:
+    """
+    Get a summary of the measurements of the calling user without their values, most recently updated first.
+    Further pages are requested with the nextCursor of the previous page as after.
+    """
+    try:
+        measurements_db = await data_context.measurements.find_summary_page(token, limit + 1, after)
+    except PaginationError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    measurements: List[RestMeasurementSummary] = []
+    for measurement_db in measurements_db[:limit]:
+        measurements.append(map_measurement_summary_db_to_rest_measurement_summary(measurement_db, token))
+    next_cursor = None
+    if len(measurements_db) > limit:
+        next_cursor = page_cursor(measurements_db[limit - 1].updated_at, measurements_db[limit - 1].id)
+    return RestMeasurementPage(items=measurements, nextCursor=next_cursor)
+
+@router.get("/{measurement_id}", response_model=RestMeasurement, tags=["measurements"])
+async def get_measurement(
+        measurement_id: str,
         token: Annotated[str, Depends(get_token_header)],
         data_context: Annotated[DataContext, Depends(get_db)]
-) -> List[RestMeasurement]:
+) -> RestMeasurement:
     """
-    Get all measurements for the calling user.
+    Get the values of a measurement.
+    The impulse responses are only referenced by irId and fetched from the ir endpoint.
     """
-    user = await data_context.users.find_one_by_id(HttpObjectId(token))
-    if not user:
-        raise HTTPException(status_code=401, detail="Unauthorized")
+    measurement_db = await data_context.measurements.find_one_by_id(HttpObjectId(measurement_id))
+    if not measurement_db:
+        raise HTTPException(status_code=404, detail="Measurement not found")
 
-    measurement_ids = [HttpObjectId(s) for s in user.measurements]
-    measurements_db = await data_context.measurements.find_by({'_id': {'$in': measurement_ids}})
-    measurements: List[RestMeasurement] = []
-    for measurement_db in measurements_db:
-        measurements.append(map_measurement_db_to_rest_measurement(measurement_db, token))
-    return measurements
+    measurement_db = await migrate_measurement(measurement_db, data_context)
+    return map_measurement_db_to_rest_measurement(measurement_db, token)
+
+@router.get("/{measurement_id}/ir/{ir_id}", response_model=List[float], tags=["measurements"])
+async def get_measurement_impulse_response(
+        measurement_id: str,
+        ir_id: str,
+        token: Annotated[str, Depends(get_token_header)],
+        data_context: Annotated[DataContext, Depends(get_db)]
+) -> List[float]:
+    """
+    Get one impulse response of a measurement.
+    """
+    measurement_db = await data_context.measurements.find_one_by_id(HttpObjectId(measurement_id))
+    if not measurement_db:
+        raise HTTPException(status_code=404, detail="Measurement not found")
+
+    measurement_db = await migrate_measurement(measurement_db, data_context)
+    ir = await find_impulse_response(measurement_db.values, ir_id, data_context)
+    if ir is None:
+        raise HTTPException(status_code=404, detail="Impulse response not found")
+    return ir
 
 @router.delete("/{measurement_id}", tags=["measurements"])
 async def delete_measurement(
@@ -47,11 +96,12 @@ async def delete_measurement(
     if measurement.ownerToken != token:
         raise HTTPException(status_code=401, detail="Unauthorized")
     await data_context.measurements.delete_by_id(measurement.id)
+    await delete_impulse_responses(measurement.values, data_context)
 
 @router.get("/imported/{measurement_id}", tags=["measurement"])
 async def import_measurement(
         measurement_id: str,
-        token: Annotated[str, Depends(get_token_header)],
+        user_db: Annotated[UserDbModel, Depends(get_current_user)],
         data_context: Annotated[DataContext, Depends(get_db)],
 ) -> RestMeasurement | None:
     """
@@ -62,27 +112,28 @@ async def import_measurement(
     if not measurement_db:
         raise HTTPException(status_code=404, detail="Measurement not found")
 
-    user_db = await data_context.users.find_one_by_id(HttpObjectId(token))
-    assert user_db is not None
+    token = str(user_db.id)
     if measurement_id not in user_db.measurements:
         user_db.measurements.append(str(measurement_db.id))
         await data_context.users.save(user_db)
+    await data_context.measurements.get_collection().update_one({"_id": measurement_db.id}, {"$addToSet": {"members": token}})
 
+    measurement_db = await migrate_measurement(measurement_db, data_context)
     return map_measurement_db_to_rest_measurement(measurement_db, token)
 
 @router.delete("/imported/{measurement_id}", tags=["measurement"])
 async def remove_imported_measurement(
         measurement_id: str,
-        token: Annotated[str, Depends(get_token_header)],
+        user_db: Annotated[UserDbModel, Depends(get_current_user)],
         data_context: Annotated[DataContext, Depends(get_db)],
 ) -> None:
     """
     Removes a measurement from the current user's history.
     """
 
-    user_db = await data_context.users.find_one_by_id(HttpObjectId(token))
-    assert user_db is not None
+    token = str(user_db.id)
 
     if measurement_id in user_db.measurements:
         user_db.measurements.remove(str(measurement_id))
-        await data_context.users.save(user_db)
\ No newline at end of file
+        await data_context.users.save(user_db)
+        await data_context.measurements.get_collection().update_one({"_id": HttpObjectId(measurement_id)}, {"$pull": {"members": token}})
\ No newline at end of file
@@ -1,52 +1,62 @@
 import logging
 from datetime import datetime
 
-from fastapi import APIRouter, HTTPException
-from typing import List, Annotated
+from fastapi import APIRouter, HTTPException, Query
+from typing import List, Annotated, Optional
 
 from fastapi.params import Depends
+from pydantic_mongo.errors import PaginationError
 from rich.measure import Measurement
 
 from api.models.post_models import UpdateRoom, CreateRoom, UpdateScene
-from api.models.room import Room
+from api.models.room import Room, RoomPage
 from api.models.room_scene import RestRoomScene
-from api.models.simulation import Simulation
+from api.models.simulation import Simulation, SimulationJob
 from database.engine import DataContext, get_db
+from database.pagination import page_cursor
 from database.schemas.measurement_db import MeasurementDbModel
 from database.schemas.room_db import RoomDbModel
-from services.auth_service import get_token_header, HttpObjectId
+from database.schemas.user_db import UserDbModel
+from services.auth_service import get_current_user, get_token_header, HttpObjectId
+from services.executor_service import ExecutorBusyError
+from services.impulse_response_service import delete_impulse_responses, find_impulse_response, migrate_room
 from services.mapper_service import (
     map_room_db_to_room,
+    map_room_summary_db_to_room,
     map_room_db_to_rest_room_scene,
     map_update_scene_to_room_db,
     map_room_db_to_simulation,
 )
-from services.simulation_service import simulate_room
+from services.simulation_job_service import find_simulation_job, start_simulation_job
+from services.room_acoustics_service import SimulationQuality
+from services.simulation_service import simulate_and_store_room
 
 logger = logging.getLogger("uvicorn.info")
 
 router = APIRouter()
 
 
-@router.get("/", response_model=List[Room], tags=["room"])
+@router.get("/", response_model=RoomPage, tags=["room"])
 async def get_rooms(
     token: Annotated[str, Depends(get_token_header)],
     data_context: Annotated[DataContext, Depends(get_db)],
-) -> List[Room]:
+    limit: Annotated[int, Query(ge=1, le=100)] = 50,
+    after: Optional[str] = None,
+) -> RoomPage:
     """
-    Get general info about all rooms of the calling user.
+    Get general info about the rooms of the calling user, most recently updated first.
+    Further pages are requested with the nextCursor of the previous page as after.
     """
-    user = await data_context.users.find_one_by_id(HttpObjectId(token))
-    if not user:
-        raise HTTPException(status_code=401, detail="Unauthorized")
-
-    room_ids = [HttpObjectId(s) for s in user.rooms]
-    rooms_db = await data_context.rooms.find_by({"_id": {"$in": room_ids}})
-    rooms: List[Room] = []
-    for room_db in rooms_db:
-        rooms.append(map_room_db_to_room(room_db, token))
+    try:
+        rooms_db = await data_context.rooms.find_summary_page(token, limit + 1, after)
+    except PaginationError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
-    return list(rooms) if rooms else []
+    rooms = [map_room_summary_db_to_room(room_db, token) for room_db in rooms_db[:limit]]
+    next_cursor = None
+    if len(rooms_db) > limit:
+        next_cursor = page_cursor(rooms_db[limit - 1].updated_at, rooms_db[limit - 1].id)
+    return RoomPage(items=rooms, nextCursor=next_cursor)
 
 
 @router.delete("/{room_id}", tags=["room"])
@@ -64,24 +74,23 @@ async def delete_room(
     if not room.ownerToken == token:
         raise HTTPException(status_code=401, detail="Unauthorized")
     await data_context.rooms.delete_by_id(room.id)
+    await delete_impulse_responses(room.simulation, data_context)
 
 
 @router.post("/", tags=["room"])
 async def create_room(
     body: CreateRoom,
-    token: Annotated[str, Depends(get_token_header)],
+    user: Annotated[UserDbModel, Depends(get_current_user)],
     data_context: Annotated[DataContext, Depends(get_db)],
 ) -> Room | None:
     """
     Create a new room with a scene.
     """
+    token = str(user.id)
     room_db: RoomDbModel = RoomDbModel(
-        name=body.name, ownerToken=token, room=body.scene
+        name=body.name, ownerToken=token, room=body.scene, members=[token]
     )
     await data_context.rooms.save(room_db)
-    user = await data_context.users.find_one_by_id(HttpObjectId(token))
-    if not user:
-        raise HTTPException(status_code=401, detail="Unauthorized")
     user.rooms.append(str(room_db.id))
     await data_context.users.save(user)
 
@@ -113,41 +122,41 @@ async def update_room(
 @router.get("/imported/{room_id}", tags=["room"])
 async def import_room(
     room_id: str,
-    token: Annotated[str, Depends(get_token_header)],
+    user_db: Annotated[UserDbModel, Depends(get_current_user)],
     data_context: Annotated[DataContext, Depends(get_db)],
 ) -> Room | None:
     """
     Get a certain room based on its ID.
     Adds the room to the current user's history.
     """
-    room_db = await data_context.rooms.find_one_by_id(HttpObjectId(room_id))
+    room_db = await data_context.rooms.find_summary_by_id(HttpObjectId(room_id))
     if not room_db:
         raise HTTPException(status_code=404, detail="Room not found")
 
-    user_db = await data_context.users.find_one_by_id(HttpObjectId(token))
-    assert user_db is not None
+    token = str(user_db.id)
     if room_id not in user_db.rooms:
         user_db.rooms.append(str(room_db.id))
         await data_context.users.save(user_db)
+    await data_context.rooms.get_collection().update_one({"_id": room_db.id}, {"$addToSet": {"members": token}})
 
-    return map_room_db_to_room(room_db, token)
+    return map_room_summary_db_to_room(room_db, token)
 
 
 @router.delete("/imported/{room_id}", tags=["room"])
 async def remove_imported_room(
     room_id: str,
-    token: Annotated[str, Depends(get_token_header)],
+    user_db: Annotated[UserDbModel, Depends(get_current_user)],
     data_context: Annotated[DataContext, Depends(get_db)],
 ) -> None:
     """
     Remove a room from the current user's history.
     """
 
-    user_db = await data_context.users.find_one_by_id(HttpObjectId(token))
-    assert user_db is not None
+    token = str(user_db.id)
     if room_id in user_db.rooms:
         user_db.rooms.remove(str(room_id))
         await data_context.users.save(user_db)
+        await data_context.rooms.get_collection().update_one({"_id": HttpObjectId(room_id)}, {"$pull": {"members": token}})
 
 
 @router.get("/{room_id}/scene", response_model=RestRoomScene, tags=["scene"])
@@ -181,6 +190,9 @@ async def update_room_scene(
     if not room_db.ownerToken == token:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
+    # The cached result stays valid for its scene hash, only the room no longer matches it
+    room_db.simulation_hash = None
+
     room_db = map_update_scene_to_room_db(room_db, scene)
     room_db.updated_at = datetime.now()
     await data_context.rooms.save(room_db)
@@ -194,33 +206,95 @@ async def get_simulation_result(
 ) -> Simulation | None:
     """
     Get the existing simulation result of a room.
+    The impulse responses are only referenced by irId and fetched from the ir endpoint.
     """
     room_db = await data_context.rooms.find_one_by_id(HttpObjectId(room_id))
     if not room_db or not room_db.simulation:
         raise HTTPException(status_code=404, detail="Room not found")
 
+    room_db = await migrate_room(room_db, data_context)
     return map_room_db_to_simulation(room_db)
 
 
+@router.get(
+    "/{room_id}/simulation/result/ir/{ir_id}", response_model=List[float], tags=["simulation"]
+)
+async def get_simulation_impulse_response(
+    room_id: str,
+    ir_id: str,
+    token: Annotated[str, Depends(get_token_header)],
+    data_context: Annotated[DataContext, Depends(get_db)],
+) -> List[float]:
+    """
+    Get one impulse response of the simulation result of a room.
+    """
+    room_db = await data_context.rooms.find_one_by_id(HttpObjectId(room_id))
+    if not room_db or not room_db.simulation:
+        raise HTTPException(status_code=404, detail="Room not found")
+
+    room_db = await migrate_room(room_db, data_context)
+    ir = await find_impulse_response(room_db.simulation, ir_id, data_context)
+    if ir is None:
+        raise HTTPException(status_code=404, detail="Impulse response not found")
+    return ir
+
+
 @router.get("/{room_id}/simulation", tags=["simulation"])
 async def do_simulation(
     room_id: str,
     token: Annotated[str, Depends(get_token_header)],
     data_context: Annotated[DataContext, Depends(get_db)],
+    quality: SimulationQuality = "standard",
 ) -> Simulation | None:
+    """
+    Simulate the room and store the result.
+    quality selects the simulation profile: draft for interactive editing, high for final reports.
+    Unlike the stored result, the response carries the impulse responses, next to the irId they are stored under.
+    """
     room_scene: RestRoomScene | None = await get_room_scene(room_id, data_context)
     if room_scene is None:
         raise HTTPException(status_code=404, detail="Room scene not found")
-    result = await simulate_room(room_scene, data_context)
-    if result is None:
-        raise HTTPException(status_code=400, detail="Room simulation failed")
+    try:
+        return await simulate_and_store_room(room_scene, data_context, quality)
+    except ExecutorBusyError:
+        raise HTTPException(status_code=503, detail="Too many simulations running, try again later")
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail="Room simulation timed out")
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Room not found")
 
 
+@router.post("/{room_id}/simulation", status_code=202, tags=["simulation"])
+async def start_simulation(
+    room_id: str,
+    token: Annotated[str, Depends(get_token_header)],
+    data_context: Annotated[DataContext, Depends(get_db)],
+    quality: SimulationQuality = "standard",
+) -> SimulationJob:
+    """
+    Enqueue a simulation of the room and return the job without waiting for it.
+    The result is stored like with GET /{room_id}/simulation and announced with a simulation_done socket event.
+    """
+    room_scene: RestRoomScene | None = await get_room_scene(room_id, data_context)
+    if room_scene is None:
+        raise HTTPException(status_code=404, detail="Room scene not found")
 
-    room = await data_context.rooms.find_one_by_id(HttpObjectId(room_id))
-    if not room:
-        raise HTTPException(status_code=404, detail="Room not found")
-    room.simulation = result.values
-    await data_context.rooms.save(room)
+    return await start_simulation_job(room_scene, token, data_context, quality)
+
+
+@router.get("/{room_id}/simulation/jobs/{job_id}", tags=["simulation"])
+async def get_simulation_job(
+    room_id: str,
+    job_id: str,
+    token: Annotated[str, Depends(get_token_header)],
+    data_context: Annotated[DataContext, Depends(get_db)],
+) -> SimulationJob:
+    """
+    Get the status of a simulation job.
+    Only the user who started the job can query it.
+    """
+    job = await find_simulation_job(job_id, token, data_context)
+    if job is None or job.roomId != room_id:
+        raise HTTPException(status_code=404, detail="Simulation job not found")
 
-    return result
+    return job
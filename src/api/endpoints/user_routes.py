@@ -1,15 +1,15 @@
 import logging
 from datetime import datetime
-from bson.errors import InvalidId
 from fastapi import APIRouter, HTTPException
-from typing import Annotated
+from typing import Annotated, Any, List
 
+from bson import ObjectId
 from fastapi.params import Depends
 
 from api.models.post_models import PostUserIds, CreatedUser
 from database.engine import DataContext, get_db
 from database.schemas.user_db import UserDbModel
-from services.auth_service import get_token_header, HttpObjectId
+from services.auth_service import get_current_user, invalidate_token, HttpObjectId
 
 logger = logging.getLogger("uvicorn.info")
 router = APIRouter()
@@ -35,7 +35,7 @@ async def register_user(
 @router.put("/migrate", tags=["user"])
 async def migrate_user(
         body: PostUserIds,
-        token: Annotated[str, Depends(get_token_header)],
+        old_user: Annotated[UserDbModel, Depends(get_current_user)],
         data_context: Annotated[DataContext, Depends(get_db)]
 ) -> None:
     """
@@ -43,35 +43,38 @@ async def migrate_user(
     Changes ownership of all rooms and measurements.
     Deletes the migrated-from user.
     """
-    old_user = await data_context.users.find_one_by_id(HttpObjectId(token))
-    if old_user is None:
-        raise HTTPException(status_code=404, detail="User not found")
-    try:
-        new_user = await data_context.users.find_one_by_id(HttpObjectId(body.token))
-    except InvalidId:
-        raise HTTPException(status_code=400, detail="Bad Request")
+    old_user_id = str(old_user.id)
+    new_user_id = HttpObjectId(body.token)
+    if str(new_user_id) == old_user_id:
+        raise HTTPException(status_code=400, detail="Cannot migrate a user to itself")
 
-    if new_user is None or old_user is None:
+    # Every step can be repeated, a migration that was interrupted is completed by running it again
+    # as the old user is only deleted at the end
+    merged = await data_context.users.get_collection().update_one(
+        {"_id": new_user_id},
+        {
+            "$addToSet": {
+                "rooms": {"$each": old_user.rooms},
+                "measurements": {"$each": old_user.measurements},
+            },
+            "$set": {"updated_at": datetime.now()},
+        },
+    )
+    if merged.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
 
-    for room in old_user.rooms:
-        if not room in new_user.rooms:
-            new_user.rooms.append(room)
-        room_db = await data_context.rooms.find_one_by_id(HttpObjectId(room))
-        assert room_db is not None
-        if room_db.ownerToken == str(old_user.id):
-            room_db.ownerToken = body.token
-        await data_context.rooms.save(room_db)
+    for collection, history in (
+        (data_context.rooms.get_collection(), old_user.rooms),
+        (data_context.measurements.get_collection(), old_user.measurements),
+    ):
+        # Only documents in the history of the old user change hands
+        ids = [ObjectId(document_id) for document_id in history if ObjectId.is_valid(document_id)]
+        await collection.update_many({"_id": {"$in": ids}, "ownerToken": old_user_id}, {"$set": {"ownerToken": str(new_user_id)}})
+        await collection.update_many({"members": old_user_id}, migrate_members(old_user_id, str(new_user_id)))
 
-    for measurement in old_user.measurements:
-        if not measurement in new_user.measurements:
-            new_user.measurements.append(measurement)
-        measurement_db = await data_context.measurements.find_one_by_id(HttpObjectId(measurement))
-        assert measurement_db is not None
-        if measurement_db.ownerToken == str(old_user.id):
-            measurement_db.ownerToken = body.token
-        await data_context.measurements.save(measurement_db)
-
-    new_user.updated_at = datetime.now()
-    await data_context.users.save(new_user)
     await data_context.users.delete(old_user)
+    invalidate_token(old_user_id)
+
+def migrate_members(old_user_id: str, new_user_id: str) -> List[dict[str, Any]]:
+    """Update pipeline that replaces the old user by the new one in members, who is kept only once"""
+    return [{"$set": {"members": {"$setUnion": [{"$setDifference": ["$members", [old_user_id]]}, [new_user_id]]}}}]
@@ -1,5 +1,5 @@
 from pydantic import Field, BaseModel
-from typing import List
+from typing import List, Optional
 
 from models import AcousticParameters
 
@@ -8,4 +8,14 @@ class RestMeasurement(BaseModel):
     name: str = Field(..., title="Measurement name", description="Name of the measurement")
     createdAt: str = Field(..., title="Created at", description="Timestamp when the measurement was created")
     isOwner: bool = Field(..., title="Is owner", description="Whether the user is the owner of the measurement or not")
-    values: List[List[AcousticParameters]] = Field(..., title="Acoustic parameters", description="List of acoustic parameters for the measurement")
\ No newline at end of file
+    values: List[List[AcousticParameters]] = Field(..., title="Acoustic parameters", description="List of acoustic parameters for the measurement, the impulse responses are fetched separately by irId")
+
+class RestMeasurementSummary(BaseModel):
+    id: str = Field(..., title="Measurement ID", description="Unique identifier for the measurement")
+    name: str = Field(..., title="Measurement name", description="Name of the measurement")
+    createdAt: str = Field(..., title="Created at", description="Timestamp when the measurement was created")
+    isOwner: bool = Field(..., title="Is owner", description="Whether the user is the owner of the measurement or not")
+
+class RestMeasurementPage(BaseModel):
+    items: List[RestMeasurementSummary] = Field(..., title="Measurements", description="Measurements of this page, most recently updated first")
+    nextCursor: Optional[str] = Field(default=None, title="Next cursor", description="Cursor of the next page, None on the last page")
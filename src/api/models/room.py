@@ -1,3 +1,5 @@
+from typing import List, Optional
+
 from pydantic import BaseModel, Field
 
 class Room(BaseModel):
@@ -5,4 +7,8 @@ class Room(BaseModel):
     name: str = Field(..., title="Room name", description="Name of the room")
     hasSimulation: bool = Field(..., title="Has simulation", description="Whether the room has existing simulation data or not")
     isOwner: bool = Field(..., title="Is owner", description="Whether the user is the owner of the room or not")
-    lastUpdatedAt: str = Field(..., title="Last updated at", description="Last time the room was updated")
\ No newline at end of file
+    lastUpdatedAt: str = Field(..., title="Last updated at", description="Last time the room was updated")
+
+class RoomPage(BaseModel):
+    items: List[Room] = Field(..., title="Rooms", description="Rooms of this page, most recently updated first")
+    nextCursor: Optional[str] = Field(default=None, title="Next cursor", description="Cursor of the next page, None on the last page")
@@ -1,8 +1,17 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Literal, Optional
 from models import AcousticParameters
 
 
 class Simulation(BaseModel):
     roomId: str = Field(..., title="Room ID", description="Id of the room the simulation belongs to")
-    values: List[List[AcousticParameters]] = Field(..., title="Acoustic parameters", description="List of Acoustic parameters")
\ No newline at end of file
+    values: List[List[AcousticParameters]] = Field(..., title="Acoustic parameters", description="List of Acoustic parameters, the impulse responses are fetched separately by irId")
+    quality: Optional[Literal["draft", "standard", "high"]] = Field(default=None, title="Quality", description="Simulation quality profile the values were computed with, missing for simulations stored before it was recorded")
+
+class SimulationJob(BaseModel):
+    jobId: str = Field(..., title="Job ID", description="Id of the simulation job")
+    roomId: str = Field(..., title="Room ID", description="Id of the room that is simulated")
+    quality: Literal["draft", "standard", "high"] = Field(..., title="Quality", description="Simulation quality profile")
+    status: Literal["queued", "running", "done", "failed"] = Field(..., title="Status", description="Current state of the simulation job")
+    error: Optional[str] = Field(default=None, title="Error", description="Reason why the simulation failed")
+    createdAt: str = Field(..., title="Created at", description="Timestamp when the job was created")
\ No newline at end of file
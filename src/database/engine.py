@@ -1,13 +1,18 @@
+from bson import ObjectId
 from dotenv import dotenv_values
 from typing import Generator
 from pymongo import AsyncMongoClient
 
 import logging
 
+from database.pagination import MEMBER_PAGE_INDEX
 from database.schemas.measurement_db import MeasurementRepository
 from database.schemas.room_db import RoomRepository
 from database.schemas.user_db import UserRepository
 from database.schemas.material_db import MaterialRepository
+from database.schemas.simulation_cache_db import SimulationCacheRepository
+from database.schemas.impulse_response_db import ImpulseResponseRepository
+from database.schemas.simulation_job_db import SimulationJobRepository
 
 
 class DataContext:
@@ -17,16 +22,52 @@ class DataContext:
         self.measurements = MeasurementRepository(database)
         self.users = UserRepository(database)
         self.materials = MaterialRepository(database)
+        self.simulation_cache = SimulationCacheRepository(database)
+        self.impulse_responses = ImpulseResponseRepository(database)
+        self.simulation_jobs = SimulationJobRepository(database)
 
     rooms: RoomRepository
     measurements: MeasurementRepository
     users: UserRepository
     materials: MaterialRepository
+    simulation_cache: SimulationCacheRepository
+    impulse_responses: ImpulseResponseRepository
+    simulation_jobs: SimulationJobRepository
+
+    async def create_indexes(self) -> None:
+        """Creates the indexes the queries rely on, existing indexes are left as they are"""
+        for repository in (self.rooms, self.measurements):
+            await repository.get_collection().create_index(MEMBER_PAGE_INDEX)
+            await repository.get_collection().create_index("ownerToken")
+        # Jobs are shared by every server worker and forgotten once they expire
+        await self.simulation_jobs.get_collection().create_index("expires_at", expireAfterSeconds=0)
+
+    async def backfill_members(self) -> None:
+        """
+        Fills the members of rooms and measurements saved before they had any from the histories of the users.
+        Does nothing once every document has members and can be repeated if it was interrupted.
+        """
+        rooms = self.rooms.get_collection()
+        measurements = self.measurements.get_collection()
+        missing = {"members": {"$exists": False}}
+        if not await rooms.find_one(missing) and not await measurements.find_one(missing):
+            return
+
+        logger.info("Filling room and measurement members from the user histories")
+        async for user in self.users.get_collection().find({}, {"rooms": 1, "measurements": 1}):
+            member = {"$addToSet": {"members": str(user["_id"])}}
+            room_ids = [ObjectId(room) for room in user.get("rooms", []) if ObjectId.is_valid(room)]
+            measurement_ids = [ObjectId(measurement) for measurement in user.get("measurements", []) if ObjectId.is_valid(measurement)]
+            await rooms.update_many({"_id": {"$in": room_ids}}, member)
+            await measurements.update_many({"_id": {"$in": measurement_ids}}, member)
+        await rooms.update_many(missing, {"$set": {"members": []}})
+        await measurements.update_many(missing, {"$set": {"members": []}})
 
 
 logger = logging.getLogger(__name__)
 
-connection_string = dotenv_values(".env")["DB_CONNECTION_STRING"] or ""
+# The client connects lazily, modules using the engine can be imported without a database
+connection_string = dotenv_values(".env").get("DB_CONNECTION_STRING") or "localhost:27017"
 
 uri = f"mongodb://{connection_string}"
 client: AsyncMongoClient = AsyncMongoClient(uri)  # type: ignore[type-arg]
@@ -0,0 +1,40 @@
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from bson import ObjectId
+from pydantic_mongo.errors import PaginationError
+from pydantic_mongo.pagination import decode_pagination_cursor, encode_pagination_cursor
+
+# Most recently updated first, the id orders documents updated at the same time
+PAGE_SORT: List[Tuple[str, int]] = [("updated_at", -1), ("_id", -1)]
+
+# Serves the history of a user in PAGE_SORT order without touching other documents
+MEMBER_PAGE_INDEX: List[Tuple[str, int]] = [("members", 1), *PAGE_SORT]
+
+
+def page_cursor(updated_at: datetime, document_id: ObjectId | None) -> str:
+    """Cursor that continues a page after the document with the given sort keys"""
+    return encode_pagination_cursor([updated_at, document_id])
+
+
+def keyset_query(query: dict[str, Any], after: Optional[str] = None) -> dict[str, Any]:
+    """
+    Restricts query to the documents that follow the cursor in PAGE_SORT order.
+    Raises a PaginationError for cursors not created by page_cursor.
+    """
+    if after is None:
+        return query
+
+    cursor = decode_pagination_cursor(after)
+    if len(cursor) != 2 or not isinstance(cursor[0], datetime) or not isinstance(cursor[1], ObjectId):
+        raise PaginationError("Invalid cursor")
+    updated_at, document_id = cursor
+    return {
+        "$and": [
+            query,
+            {"$or": [
+                {"updated_at": {"$lt": updated_at}},
+                {"updated_at": updated_at, "_id": {"$lt": document_id}},
+            ]},
+        ]
+    }
@@ -0,0 +1,32 @@
+import zlib
+from datetime import datetime
+from typing import Optional, List, Sequence
+
+import numpy as np
+from pydantic import BaseModel, Field
+from pydantic_mongo import PydanticObjectId, AsyncAbstractRepository
+
+class ImpulseResponseDbModel(BaseModel):
+    id: Optional[PydanticObjectId] = None
+    samples: bytes  # zlib compressed little endian float32, stored as BSON binary
+    length: int
+    sample_rate: Optional[int] = None  # None for impulse responses stored without it
+    created_at: datetime = Field(default_factory=datetime.now)
+    expires_at: Optional[datetime] = None  # only set for cached simulations, removed by a TTL index once passed
+
+    @classmethod
+    def from_samples(
+        cls, ir: Sequence[float], sample_rate: Optional[int] = None, expires_at: Optional[datetime] = None
+    ) -> "ImpulseResponseDbModel":
+        samples = np.asarray(ir, dtype="<f4")
+        return cls(
+            samples=zlib.compress(samples.tobytes()), length=len(samples), sample_rate=sample_rate, expires_at=expires_at
+        )
+
+    def to_samples(self) -> List[float]:
+        samples: List[float] = np.frombuffer(zlib.decompress(self.samples), dtype="<f4").tolist()
+        return samples
+
+class ImpulseResponseRepository(AsyncAbstractRepository[ImpulseResponseDbModel]):
+    class Meta:
+        collection_name = "impulse_responses"
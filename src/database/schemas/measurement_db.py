@@ -1,8 +1,9 @@
 from datetime import datetime
-from typing import Optional, List
+from typing import Any, Optional, List
 from pydantic import BaseModel, Field
 from pydantic_mongo import PydanticObjectId, AsyncAbstractRepository
 
+from database.pagination import PAGE_SORT, keyset_query
 from models import AcousticParameters
 
 class MeasurementDbModel(BaseModel):
@@ -10,9 +11,28 @@ class MeasurementDbModel(BaseModel):
     name: str
     ownerToken: str
     values: List[List[AcousticParameters]]
+    members: List[str] = Field(default_factory=list)  # users with the measurement in their history
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+class MeasurementSummaryDbModel(BaseModel):
+    """Projection of a measurement without its values"""
+    id: Optional[PydanticObjectId] = None
+    name: str
+    ownerToken: str
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
 
 class MeasurementRepository(AsyncAbstractRepository[MeasurementDbModel]):
     class Meta:
-        collection_name = "measurements"
\ No newline at end of file
+        collection_name = "measurements"
+
+    async def find_summary_page(self, member: str, limit: int, after: Optional[str] = None) -> List[MeasurementSummaryDbModel]:
+        """Up to limit measurements in the history of member that follow the cursor after, most recently updated first"""
+        return list(await self.find_by_with_output_type(
+            MeasurementSummaryDbModel,
+            keyset_query({"members": member}, after),
+            limit=limit,
+            sort=PAGE_SORT,
+            projection={"values": 0, "members": 0},
+        ))
@@ -1,8 +1,9 @@
 from datetime import datetime
-from typing import Optional, List
+from typing import Any, Literal, Optional, List
 from pydantic import BaseModel, Field
 from pydantic_mongo import PydanticObjectId, AsyncAbstractRepository
 
+from database.pagination import PAGE_SORT, keyset_query
 from models import AcousticParameters
 from models.scene import RoomScene
 
@@ -12,9 +13,43 @@ class RoomDbModel(BaseModel):
     ownerToken: str
     room: RoomScene
     simulation: Optional[List[List[AcousticParameters]] ] = None
+    simulation_hash: Optional[str] = None
+    simulation_quality: Optional[Literal["draft", "standard", "high"]] = None  # profile the simulation was computed with
+    members: List[str] = Field(default_factory=list)  # users with the room in their history
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
 
+class RoomSummaryDbModel(BaseModel):
+    """Projection of a room without its scene and simulation, only whether a simulation exists"""
+    id: Optional[PydanticObjectId] = None
+    name: str
+    ownerToken: str
+    has_simulation: bool = False
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+# Arrays compare greater than null, missing and null simulations do not
+ROOM_SUMMARY_PROJECTION: dict[str, Any] = {
+    "name": 1,
+    "ownerToken": 1,
+    "has_simulation": {"$gt": ["$simulation", None]},
+    "created_at": 1,
+    "updated_at": 1,
+}
+
 class RoomRepository(AsyncAbstractRepository[RoomDbModel]):
     class Meta:
-        collection_name = "rooms"
\ No newline at end of file
+        collection_name = "rooms"
+
+    async def find_summaries(self, query: dict[str, Any], limit: int = 0) -> List[RoomSummaryDbModel]:
+        # The projection computes a field, which find_by_with_output_type does not accept
+        cursor = self.get_collection().find(query, ROOM_SUMMARY_PROJECTION, sort=PAGE_SORT, limit=limit)
+        return [self.to_model_custom(RoomSummaryDbModel, document) async for document in cursor]
+
+    async def find_summary_by_id(self, room_id: Any) -> Optional[RoomSummaryDbModel]:
+        summaries = await self.find_summaries({"_id": room_id})
+        return summaries[0] if summaries else None
+
+    async def find_summary_page(self, member: str, limit: int, after: Optional[str] = None) -> List[RoomSummaryDbModel]:
+        """Up to limit rooms in the history of member that follow the cursor after, most recently updated first"""
+        return await self.find_summaries(keyset_query({"members": member}, after), limit)
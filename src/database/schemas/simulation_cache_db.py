@@ -0,0 +1,16 @@
+from datetime import datetime
+from typing import Optional, List
+from pydantic import BaseModel, Field
+from pydantic_mongo import PydanticObjectId, AsyncAbstractRepository
+
+from models import AcousticParameters
+
+class SimulationCacheDbModel(BaseModel):
+    id: Optional[PydanticObjectId] = None
+    scene_hash: str
+    values: List[List[AcousticParameters]]
+    created_at: datetime = Field(default_factory=datetime.now)
+
+class SimulationCacheRepository(AsyncAbstractRepository[SimulationCacheDbModel]):
+    class Meta:
+        collection_name = "simulation_cache"
@@ -0,0 +1,18 @@
+from datetime import datetime
+from typing import Literal, Optional
+from pydantic import BaseModel, Field
+from pydantic_mongo import PydanticObjectId, AsyncAbstractRepository
+
+class SimulationJobDbModel(BaseModel):
+    id: Optional[PydanticObjectId] = None
+    roomId: str
+    ownerToken: str  # only the user who started the job can query it
+    quality: Literal["draft", "standard", "high"]
+    status: Literal["queued", "running", "done", "failed"] = "queued"
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.now)
+    expires_at: datetime  # moved on with every status change, removed by a TTL index once passed
+
+class SimulationJobRepository(AsyncAbstractRepository[SimulationJobDbModel]):
+    class Meta:
+        collection_name = "simulation_jobs"
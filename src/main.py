@@ -1,19 +1,37 @@
 import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 
 from fastapi import FastAPI
 from api import router as api_router
 from fastapi.middleware.cors import CORSMiddleware
 
+from database.engine import data_context
+from services.analysis_service import warm_filter_banks
+from services.executor_service import analysis_executor, simulation_executor
+from services.simulation_cache_service import simulation_cache
 from sio.socketio_server import sio_app
 from dotenv import load_dotenv
 
 load_dotenv()
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    warm_filter_banks()
+    await data_context.create_indexes()
+    await simulation_cache.create_indexes(data_context)
+    await data_context.backfill_members()
+    yield
+    analysis_executor.shutdown()
+    simulation_executor.shutdown()
+
 app = FastAPI(
     title="Sonalyze API",
     description="This is the API for Sonalyze.",
     version="1.0.0",
     openapi_url="/openapi.json",
-    docs_url="/docs"
+    docs_url="/docs",
+    lifespan=lifespan
 )
 
 origins = [
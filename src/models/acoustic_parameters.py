@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 
 class AcousticParameters(BaseModel):
     rt60: List[float] = Field(..., title="RT60", description="RT60 values for different frequencies in seconds")
@@ -7,4 +7,8 @@ class AcousticParameters(BaseModel):
     c80: List[float] = Field(..., title="C80", description="C80 values for different frequencies in decibels")
     g: List[float] = Field(..., title="G", description="G values for different frequencies in decibels")
     d50: List[float] = Field(..., title="D50", description="D50 values for different frequencies in decibels")
-    ir: List[float] = Field(..., title="IR", description="Impulse response of the measurement")
\ No newline at end of file
+    ir: List[float] = Field(default_factory=list, title="IR", description="Impulse response of the measurement, empty while it is only referenced by irId")
+    sampleRate: Optional[int] = Field(default=None, title="Sample rate", description="Sample rate of the impulse response in Hz, None for results saved without it")
+    irId: Optional[str] = Field(default=None, title="IR id", description="Id of the stored impulse response in the impulse_responses collection")
+    micIndex: Optional[int] = Field(default=None, title="Microphone index", description="Index of the microphone the values were recorded with, None for results saved without it")
+    speakerIndex: Optional[int] = Field(default=None, title="Speaker index", description="Index of the speaker the values belong to, None for results saved without it")
@@ -0,0 +1,7 @@
+# Center frequencies in Hz shared by the analysis filter banks and the material coefficients.
+# Kept apart from the analysis service, so using them does not pull in scipy and soundfile
+
+THIRD_OCTAVE_BANDS = (100, 125, 160, 200, 250, 315, 400, 500, 630, 800, 1000, 1250, 1600, 2000, 2500, 3150, 4000, 5000)
+OCTAVE_BANDS = (63, 125, 250, 500, 1000, 2000, 4000, 8000)
+# Octave bands the material absorption coefficients are given for
+MATERIAL_BANDS = (125, 250, 500, 1000, 2000, 4000)
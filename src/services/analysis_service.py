@@ -5,238 +5,483 @@ import base64
 import io
 import soundfile as sf
 
-from scipy.fft import fft, ifft
-from scipy.signal import sosfilt, butter, chirp
-from scipy.stats import linregress
+from dataclasses import dataclass
+from functools import lru_cache
+from math import gcd
+from pathlib import Path
+from scipy.fft import fft, ifft, rfft, irfft, next_fast_len
+from scipy.signal import sosfilt, butter, chirp, resample_poly
 
-from typing import Any
+from typing import Any, Literal, Sequence
 from numpy.typing import NDArray
 from models import AcousticParameters
+from models.bands import MATERIAL_BANDS, OCTAVE_BANDS, THIRD_OCTAVE_BANDS
 
 logger = logging.getLogger("uvicorn.info")
 
-def create_in(sample_rate: int) -> Any:
-    """Creates logarithmitc sine sweep"""
-    duration = 5.0
-    t = np.linspace(0, duration, int(sample_rate * duration))
-    return chirp(t, f0=20, f1=20000, t1=duration, method="logarithmic")
-
-def decode_audio_data(recording_base64: str) -> tuple[NDArray[np.floating], int]:
-    """Decode base64 audio data to numpy array"""
-    audio_bytes = base64.b64decode(recording_base64)
-    audio_buffer = io.BytesIO(audio_bytes)
-    audio_data, sample_rate = sf.read(audio_buffer)
-    
-    if audio_data.ndim > 1:
-        audio_data = np.mean(audio_data, axis=1)
-    
-    return audio_data, sample_rate
+InverseFilter = Literal["reciprocal", "farina"]
+# Samples per block when downmixing and band filtering, keeps the temporary buffers small next to a whole recording
+BLOCK_SIZE = 65536
+Deconvolution = Literal["fft", "rfft"]
+# float32 keeps recordings, spectra and band signals in single precision, halving their memory
+Precision = Literal["float64", "float32"]
+# Streamed recordings arrive already decoded as little endian float32 mono samples with their sample rate.
+# Recordings spilled to disk are passed as the path of the file holding their bytes
+PcmRecording = tuple[bytes | Path, int]
+Recording = str | bytes | Path | PcmRecording
 
-def calculate_transfer_function(in_t: NDArray[np.floating], out_t: NDArray[np.floating]) -> Any:
-    """Calculates transferfunction from sine sweep and recorded sine sweep"""
-    min_len = min(len(in_t), len(out_t))
-    in_t = in_t[:min_len]
-    out_t = out_t[:min_len]
-    
-    in_f = fft(in_t)
-    out_f = fft(out_t)
-    
-    tf = out_f / in_f
+@dataclass(frozen=True)
+class SweepSettings:
+    """Describes the logarithmic sine sweep played by the speakers. Used as cache key"""
+    duration: float = 5.0
+    f0: float = 20
+    f1: float = 20000
+
+DEFAULT_SWEEP = SweepSettings()
+# Inverse spectra are complex128 over the whole sweep (several MB each). A handful covers the usual sample rates and inverse filters
+INVERSE_SPECTRUM_CACHE_SIZE = 4
+
+@lru_cache(maxsize=16)
+def create_in(sample_rate: int, sweep: SweepSettings = DEFAULT_SWEEP) -> NDArray[np.float64]:
+    """Creates logarithmitc sine sweep. Cached per sample rate and sweep, the returned array is read only"""
+    t = np.linspace(0, sweep.duration, int(sample_rate * sweep.duration))
+    sweep_signal: NDArray[np.float64] = chirp(t, f0=sweep.f0, f1=sweep.f1, t1=sweep.duration, method="logarithmic")
+    sweep_signal.flags.writeable = False
+    return sweep_signal
+
+@lru_cache(maxsize=INVERSE_SPECTRUM_CACHE_SIZE)
+def get_inverse_sweep_spectrum(sample_rate: int, length: int, sweep: SweepSettings = DEFAULT_SWEEP, inverse: InverseFilter = "reciprocal") -> NDArray[np.complex128]:
+    """Spectrum that deconvolves a recording of the given length by a single multiplication. Cached, the returned array is read only.
+    reciprocal: 1 / fft of the sweep, equal to dividing by the sweep spectrum.
+    farina: time reversed sweep with a 6db/octave amplitude envelope, normalised to unit gain inside the sweep band"""
+    sweep_signal = create_in(sample_rate, sweep)[:length]
+
+    spectrum: NDArray[np.complex128]
+    if inverse == "farina":
+        # Envelope follows the instantaneous sweep frequency (f / f1), so after reversal it falls by 6db/octave
+        t = np.arange(len(sweep_signal)) / sample_rate
+        envelope = np.exp((t - sweep.duration) * np.log(sweep.f1 / sweep.f0) / sweep.duration)
+        # Rolled by one sample so the deconvolved peak lands at index 0 like with the reciprocal spectrum
+        inverse_filter = np.roll((sweep_signal * envelope)[::-1], 1)
+        spectrum = fft(inverse_filter)
+
+        freqs = np.abs(np.fft.fftfreq(len(sweep_signal), 1 / sample_rate))
+        band = (freqs >= sweep.f0) & (freqs <= min(sweep.f1, sample_rate / 2))
+        spectrum /= np.median(np.abs(fft(sweep_signal)[band] * spectrum[band]))
+    else:
+        spectrum = 1 / fft(sweep_signal)
+
+    spectrum.flags.writeable = False
+    return spectrum
+
+def decode_audio_data(recording: Recording, precision: Precision = "float64") -> tuple[NDArray[np.floating], int]:
+    """Decode audio data to numpy array. Binary uploads are read as they are, strings are base64 decoded first.
+    Streamed PCM recordings are only reinterpreted (without a copy in float32), they were decoded while the chunks arrived.
+    Multichannel audio is downmixed in the requested precision"""
+    if isinstance(recording, tuple):
+        samples, pcm_rate = recording
+        pcm = samples.read_bytes() if isinstance(samples, Path) else samples
+        return np.frombuffer(pcm, dtype="<f4").astype(precision, copy=False), pcm_rate
+
+    if isinstance(recording, Path):
+        audio_bytes = recording.read_bytes()
+    else:
+        audio_bytes = base64.b64decode(recording) if isinstance(recording, str) else recording
+    with sf.SoundFile(io.BytesIO(audio_bytes)) as sound_file:
+        if sound_file.channels == 1:
+            return sound_file.read(dtype=precision), sound_file.samplerate
+
+        # Downmixed block by block into the mono buffer, the multichannel audio is never held as a whole
+        audio_data = np.zeros(sound_file.frames, dtype=precision)
+        block = np.empty((BLOCK_SIZE, sound_file.channels), dtype=precision)
+        position = 0
+        while (frames := len(samples := sound_file.read(BLOCK_SIZE, dtype=precision, out=block))) > 0:
+            mono = audio_data[position:position + frames]
+            for channel in range(sound_file.channels):
+                np.add(mono, samples[:, channel], out=mono)
+            position += frames
+        np.divide(audio_data, sound_file.channels, out=audio_data)
+        return audio_data[:position], sound_file.samplerate
+
+def resample_audio(audio_data: NDArray[np.floating], sample_rate: int, target_rate: int) -> NDArray[np.floating]:
+    """Resamples audio data to the target sample rate"""
+    if sample_rate == target_rate:
+        return audio_data
+    divisor = gcd(sample_rate, target_rate)
+    resampled: NDArray[np.floating] = resample_poly(audio_data, target_rate // divisor, sample_rate // divisor)
+    return resampled
+
+def calculate_transfer_function(out_t: NDArray[np.floating], sample_rate: int, sweep: SweepSettings = DEFAULT_SWEEP, inverse: InverseFilter = "reciprocal") -> Any:
+    """Calculates transferfunction from recorded sine sweep with one fft and the cached inverse sweep spectrum"""
+    min_len = min(len(create_in(sample_rate, sweep)), len(out_t))
+    out_f = fft(out_t[:min_len])
+
+    # In place, so a single precision recording keeps a single precision spectrum
+    return np.multiply(out_f, get_inverse_sweep_spectrum(sample_rate, min_len, sweep, inverse), out=out_f)
+
+@lru_cache(maxsize=INVERSE_SPECTRUM_CACHE_SIZE)
+def get_regularized_inverse_rfft(sample_rate: int, length: int, n_fft: int, sweep: SweepSettings = DEFAULT_SWEEP, regularization: float = 1e-6) -> NDArray[np.complex128]:
+    """Half spectrum inverse of the sweep zero padded to n_fft: conj(S) / (|S|^2 + eps) with eps relative to the peak power.
+    Bins where the sweep has no energy are damped instead of amplified. Cached, the returned array is read only"""
+    sweep_f = rfft(create_in(sample_rate, sweep)[:length], n_fft)
+    power = np.abs(sweep_f)**2
+
+    spectrum: NDArray[np.complex128] = np.conj(sweep_f) / (power + regularization * np.max(power))
+    spectrum.flags.writeable = False
+    return spectrum
+
+def calculate_impulse_response_rfft(out_t: NDArray[np.floating], sample_rate: int, sweep: SweepSettings = DEFAULT_SWEEP, regularization: float = 1e-6, workers: int | None = None) -> NDArray[np.floating]:
+    """Deconvolves the recorded sine sweep with real ffts zero padded to a fast length.
+    The padding makes the deconvolution linear instead of circular, the ir is cut to the analysed length"""
+    min_len = min(len(create_in(sample_rate, sweep)), len(out_t))
+    n_fft = next_fast_len(2 * min_len - 1, real=True)
+
+    out_f = rfft(out_t[:min_len], n_fft, workers=workers)
+    out_f *= get_regularized_inverse_rfft(sample_rate, min_len, n_fft, sweep, regularization)
+
+    ir: NDArray[np.floating] = irfft(out_f, n_fft, workers=workers)[:min_len]
+    return ir
 
-    return tf
+def calculate_impulse_response_linear(out_t: NDArray[np.floating], sample_rate: int, sweep: SweepSettings = DEFAULT_SWEEP, regularization: float = 1e-6, workers: int | None = None) -> NDArray[np.floating]:
+    """Deconvolves the whole recording instead of only the first sweep length.
+    Used for recordings holding several sweeps, every sweep turns into an ir at its own start time.
+    out_t may be a stack of equally long recordings (one per row), they are deconvolved in one batch"""
+    length = out_t.shape[-1]
+    sweep_len = len(create_in(sample_rate, sweep))
+    n_fft = next_fast_len(length + sweep_len - 1, real=True)
+
+    out_f = rfft(out_t, n_fft, axis=-1, workers=workers)
+    out_f *= get_regularized_inverse_rfft(sample_rate, sweep_len, n_fft, sweep, regularization)
+
+    ir: NDArray[np.floating] = irfft(out_f, n_fft, axis=-1, workers=workers)[..., :length]
+    return ir
+
+def stack_recordings(recorded_signals: list[NDArray[np.floating]]) -> NDArray[np.floating]:
+    """Stacks recordings into one row each, shorter ones are zero padded to the longest"""
+    stacked = np.zeros((len(recorded_signals), max(len(signal) for signal in recorded_signals)), dtype=np.result_type(*recorded_signals))
+    for row, signal in zip(stacked, recorded_signals):
+        row[:len(signal)] = signal
+    return stacked
+
+def find_common_onset(magnitude: NDArray[np.floating], offsets: list[int], gap: int, tolerance: int) -> int:
+    """Finds the delay of the direct sounds behind their offsets that all speakers share (playback latency and propagation).
+    The window of every speaker is normalized to its own peak before they are summed, so a quiet speaker weighs as much as a loud one"""
+    padded = np.concatenate([np.zeros(tolerance, dtype=magnitude.dtype), magnitude])
+    profile = np.zeros(gap)
+    for offset in offsets:
+        window = padded[offset:offset + gap]
+        peak = np.max(window) if window.size else 0
+        if peak > 0:
+            profile[:len(window)] += window / peak
+    if not np.any(profile > 0):
+        raise ValueError("Recording holds no sweep")
+    return int(np.flatnonzero(profile >= 0.1 * np.max(profile))[0]) - tolerance
+
+def separate_impulse_responses(ir: NDArray[np.floating], offsets: list[int], pre_delay: int) -> list[NDArray[np.floating]]:
+    """Cuts the ir of a recording holding several sweeps into one ir per speaker, speaker k started offsets[k] samples after speaker 0.
+    Every speaker's direct sound is searched within an eighth of the smallest start gap around its expected start, relative to the
+    peak of its own window, to tolerate playback jitter and speakers of different loudness. Each ir starts pre_delay samples before its direct sound"""
+    magnitude = np.abs(ir)
+    gap = int(np.min(np.diff(offsets))) if len(offsets) > 1 else len(ir)
+    tolerance = gap // 8
+    common_onset = find_common_onset(magnitude, offsets, gap, tolerance)
+
+    irs: list[NDArray[np.floating]] = []
+    for speaker, offset in enumerate(offsets):
+        expected = common_onset + offset
+        low, high = max(expected - tolerance, 0), min(expected + tolerance + 1, len(ir))
+        region = magnitude[low:high]
+        if region.size == 0 or np.max(region) == 0:
+            raise ValueError(f"Recording ends before the sweep of speaker {speaker}")
+
+        onset = low + int(np.flatnonzero(region >= 0.1 * np.max(region))[0])
+        start = max(onset - pre_delay, 0)
+        irs.append(ir[start:start + gap - 2 * tolerance])
+    return irs
+
+def find_impulse_response_bounds(ir: NDArray[np.floating], threshold: float) -> tuple[int, int] | None:
+    """Finds the last sample above threshold (end) and the last sample above threshold before the preceding quiet gap (start).
+    Returns None if no sample after the first one exceeds the threshold"""
+    above = np.abs(ir) > threshold
+
+    loud = np.flatnonzero(above[1:])
+    if loud.size == 0:
+        return None
+    end_idx = int(loud[-1]) + 1
+
+    quiet = np.flatnonzero(~above[1:end_idx])
+    if quiet.size == 0:
+        return 0, end_idx
+    gap_idx = int(quiet[-1]) + 1
+
+    loud_before_gap = np.flatnonzero(above[1:gap_idx])
+    start_idx = int(loud_before_gap[-1]) + 1 if loud_before_gap.size else 0
+
+    return start_idx, end_idx
 
 def extract_impulse_response(tf: NDArray[np.floating]) -> NDArray[np.floating] | Any:
     """Applies inverse fft to transfer function to get impulse response. Finds peaks at the end of ir and rolls them to the front"""
     ir = np.real(ifft(tf))
-    
+
+    return align_impulse_response(ir)
+
+def align_impulse_response(ir: NDArray[np.floating]) -> NDArray[np.floating] | Any:
+    """Finds peaks at the end of ir and rolls them to the front"""
     threshold = 0.00005 * np.max(np.abs(ir))
     
-    for i in range(len(ir) - 1, 0, -1):
-        if np.abs(ir[i]) > threshold:
-            end_idx = i
-            break
-    else:
+    bounds = find_impulse_response_bounds(ir, threshold)
+    if bounds is None:
         peak = np.argmax(np.abs(ir))
         return ir[peak:]
 
-    found_low = False
-    for i in range(end_idx - 1, 0, -1):
-        if np.abs(ir[i]) <= threshold:
-            found_low = True
-        elif found_low and np.abs(ir[i]) > threshold:
-            start_idx = i
-            break
-    else:
-        start_idx = 0
-
+    start_idx, _ = bounds
     roll_amount = -start_idx
     
     ir_rotated = np.roll(ir, roll_amount)
     
     return ir_rotated
 
-def get_octave_band_filters(fs: int) -> tuple[NDArray[np.floating], list[NDArray[np.floating]]]:
-    """Get bands from center frequencies from 1/3 octave and calculates bandpassfilter that will be applied later"""
-    center_freqs = np.array([
-        100, 125, 160, 200, 250, 315, 400, 500, 630, 800,
-        1000, 1250, 1600, 2000, 2500, 3150, 4000, 5000
-    ])
-    
-    center_freqs = center_freqs[center_freqs < fs/2]
-    
+COMMON_SAMPLE_RATES = (44100, 48000)
+# Bands analysed together, bounds the (bands x samples) intermediates of a long ir to a few bands
+BAND_CHUNK = 2
+
+@dataclass(frozen=True, eq=False)
+class FilterBank:
+    """Butterworth bandpass filters (second order sections) for a set of 1/fraction octave bands at one sample rate.
+    Frozen so one bank can be shared by every analysis. The sos arrays must not be modified,
+    they stay writeable only because sosfilt does not accept read only buffers"""
+    sample_rate: int
+    fraction: int
+    order: int
+    center_freqs: NDArray[np.integer]
+    filters: tuple[NDArray[np.floating], ...]
+
+@lru_cache(maxsize=32)
+def get_filter_bank(sample_rate: int, bands: tuple[int, ...] = THIRD_OCTAVE_BANDS, fraction: int = 3, order: int = 4) -> FilterBank:
+    """Designs the filter bank for the given bands once per (sample rate, bands, fraction, order).
+    Bands reaching up to the nyquist frequency are left out"""
+    half_bandwidth = 2**(1 / (2 * fraction))
+    center_freqs = np.array([fc for fc in bands if fc * half_bandwidth < sample_rate / 2], dtype=np.int64)
+    center_freqs.flags.writeable = False
+
     filters = []
-    
     for fc in center_freqs:
-        f1 = fc / (2**(1/6))
-        f2 = fc * (2**(1/6))
-        
-        sos = butter(4, [f1, f2], btype='band', fs=fs, output='sos')
-        filters.append(sos)
-    
-    return center_freqs, filters
-
-def calculate_energy_decay(ir_filtered: NDArray[np.floating], fs: int) -> tuple[NDArray[np.floating], NDArray[np.floating], dict[str, int]]:
-    """Calculates energy decay from ir and returns indices where the energy drops below -5db -10db -25db -35db """
-    ir_squared = ir_filtered**2
-    energy_decay = np.cumsum(ir_squared[::-1])[::-1]
-    energy_decay_db = 10 * np.log10(energy_decay / energy_decay[0] + 1e-12)
-    time_axis = np.arange(len(ir_filtered)) / fs
-    
-    indices = {
-        'idx_5db': int(np.argmax(energy_decay_db <= -5)),
-        'idx_10db': int(np.argmax(energy_decay_db <= -10)),
-        'idx_25db': int(np.argmax(energy_decay_db <= -25)),
-        'idx_35db': int(np.argmax(energy_decay_db <= -35))
+        filters.append(butter(order, [fc / half_bandwidth, fc * half_bandwidth], btype='band', fs=sample_rate, output='sos'))
+
+    return FilterBank(sample_rate, fraction, order, center_freqs, tuple(filters))
+
+def warm_filter_banks(sample_rates: tuple[int, ...] = COMMON_SAMPLE_RATES) -> None:
+    """Designs the third octave, octave and material filter banks for the usual sample rates ahead of the first analysis.
+    Called at startup and in every worker process, each process keeps its own cache"""
+    for sample_rate in sample_rates:
+        get_filter_bank(sample_rate)
+        get_filter_bank(sample_rate, OCTAVE_BANDS, fraction=1)
+        get_filter_bank(sample_rate, MATERIAL_BANDS, fraction=1)
+
+def get_octave_band_filters(fs: int) -> tuple[NDArray[np.integer], tuple[NDArray[np.floating], ...]]:
+    """Get bands from center frequencies from 1/3 octave and the bandpassfilters that will be applied later, from the cached filter bank"""
+    bank = get_filter_bank(fs)
+    return bank.center_freqs, bank.filters
+
+def filter_octave_bands(ir: NDArray[np.floating], filters: Sequence[NDArray[np.floating]]) -> NDArray[np.floating]:
+    """Applies every bandpass filter to the ir and returns the filtered signals stacked as (bands x samples).
+    The stack keeps the precision of a float32 ir. Each band is filtered in double precision block by block,
+    carrying the filter state over, so only a block and not the whole band is held in double precision"""
+    ir_filtered = np.empty((len(filters), len(ir)), dtype=np.float32 if ir.dtype == np.float32 else np.float64)
+    for band, sos in enumerate(filters):
+        state = np.zeros((len(sos), 2))
+        for start in range(0, len(ir), BLOCK_SIZE):
+            ir_filtered[band, start:start + BLOCK_SIZE], state = sosfilt(sos, ir[start:start + BLOCK_SIZE], zi=state)
+    return ir_filtered
+
+def calculate_energy_decay(band_energy: NDArray[np.floating], energy_decay_db: NDArray[np.floating]) -> dict[str, NDArray[np.intp]]:
+    """Integrates the energy of every band backwards in place, band_energy holds the energy decay afterwards.
+    Its level in db is written to energy_decay_db, returns per band indices where it drops below -5db -10db -25db -35db"""
+    reversed_energy = band_energy[:, ::-1]
+    np.cumsum(reversed_energy, axis=1, out=reversed_energy)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(band_energy, band_energy[:, :1], out=energy_decay_db)
+        energy_decay_db += 1e-12
+        np.log10(energy_decay_db, out=energy_decay_db)
+        energy_decay_db *= 10
+
+    return {
+        'idx_5db': np.argmax(energy_decay_db <= -5, axis=1),
+        'idx_10db': np.argmax(energy_decay_db <= -10, axis=1),
+        'idx_25db': np.argmax(energy_decay_db <= -25, axis=1),
+        'idx_35db': np.argmax(energy_decay_db <= -35, axis=1)
     }
-    
-    return energy_decay_db, time_axis, indices
 
-def calculate_rt60(ir_filtered: NDArray[np.floating], fs: int) -> Any | float:
+def calculate_decay_prefix_sums(energy_decay_db: NDArray[np.floating]) -> NDArray[np.float64]:
+    """Prefix sums of the energy decay (y) and of the decay weighted by its sample index (k * y), stacked as (2 x bands x samples + 1).
+    Built once and shared by every fit window"""
+    num_bands, length = energy_decay_db.shape
+    prefix = np.zeros((2, num_bands, length + 1))
+    np.cumsum(energy_decay_db, axis=1, out=prefix[0, :, 1:])
+    np.multiply(energy_decay_db, np.arange(length), out=prefix[1, :, 1:])
+    np.cumsum(prefix[1, :, 1:], axis=1, out=prefix[1, :, 1:])
+    return prefix
+
+def calculate_decay_slopes(prefix: NDArray[np.float64], start: NDArray[np.intp], end: NDArray[np.intp], fs: int) -> NDArray[np.floating]:
+    """Least squares slope in db/s of the energy decay between start and end (inclusive) for every band.
+    Uses the prefix sums so every band is fitted at once"""
+    rows = np.arange(prefix.shape[1])
+
+    count = (end - start + 1).astype(np.float64)
+    sum_y = prefix[0, rows, end + 1] - prefix[0, rows, start]
+    sum_ky = prefix[1, rows, end + 1] - prefix[1, rows, start]
+    mean_k = (start + end) / 2
+
+    slope_per_sample: NDArray[np.floating]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope_per_sample = (sum_ky - mean_k * sum_y) / (count * (count**2 - 1) / 12)
+    return slope_per_sample * fs
+
+def calculate_rt60(energy_decay_db: NDArray[np.floating], indices: dict[str, NDArray[np.intp]], fs: int) -> NDArray[np.floating]:
     """Calculates rt60 extrapolated from either rt30 or rt20 depending on what is available"""
-    energy_decay_db, time_axis, indices = calculate_energy_decay(ir_filtered, fs)
-    
-    if indices['idx_35db'] > indices['idx_5db'] and energy_decay_db[indices['idx_35db']] <= -35:
-        time_range = time_axis[indices['idx_5db']:indices['idx_35db']+1]
-        energy_range = energy_decay_db[indices['idx_5db']:indices['idx_35db']+1]
-        
-        if len(time_range) > 2:
-            slope, _, _, _, _ = linregress(time_range, energy_range)
-            if slope < 0:
-                rt30 = -30 / slope
-                return rt30 * 2
-    
-    if indices['idx_25db'] > indices['idx_5db'] and energy_decay_db[indices['idx_25db']] <= -25:
-        time_range = time_axis[indices['idx_5db']:indices['idx_25db']+1]
-        energy_range = energy_decay_db[indices['idx_5db']:indices['idx_25db']+1]
-        
-        if len(time_range) > 2:
-            slope, _, _, _, _ = linregress(time_range, energy_range)
-            if slope < 0:
-                rt20 = -20 / slope
-                return rt20 * 3
-    
-    return np.nan
+    rows = np.arange(energy_decay_db.shape[0])
+    rt60 = np.full(energy_decay_db.shape[0], np.nan)
+    # Only the decay up to the last fit index is summed, the tail behind the -35db point is never fitted
+    stop = max(int(np.max(indices[name])) for name in ('idx_5db', 'idx_25db', 'idx_35db')) + 1
+    prefix = calculate_decay_prefix_sums(energy_decay_db[:, :stop])
 
-def calculate_c50(ir_filtered: NDArray[np.floating], fs: int) -> Any | float:
-    """Calculates C50 clarity parameter. Used for speach clarity"""
-    ir_squared = ir_filtered**2
-    idx_50ms = min(int(0.05 * fs), len(ir_squared) - 1)
-    
-    if idx_50ms < len(ir_squared):
-        early_energy_50 = np.sum(ir_squared[:idx_50ms])
-        late_energy_50 = np.sum(ir_squared[idx_50ms:])
-        
-        if late_energy_50 > 0:
-            return 10 * np.log10(early_energy_50 / late_energy_50)
-    
-    return np.nan
+    for idx_end, level in (('idx_25db', -25), ('idx_35db', -35)):
+        start = indices['idx_5db']
+        end = indices[idx_end]
+        slopes = calculate_decay_slopes(prefix, start, end, fs)
+        valid = (end > start) & (energy_decay_db[rows, end] <= level) & (end - start + 1 > 2) & (slopes < 0)
+        # rt30 * 2 and rt20 * 3 both extrapolate the fitted slope to a 60db decay
+        rt60 = np.where(valid, -60 / np.where(valid, slopes, -1), rt60)
 
-def calculate_c80(ir_filtered: NDArray[np.floating], fs: int) -> Any | float:
-    """Calculates C50 clarity parameter. Used for music clarity"""
-    ir_squared = ir_filtered**2
-    idx_80ms = min(int(0.08 * fs), len(ir_squared) - 1)
-    
-    if idx_80ms < len(ir_squared):
-        early_energy_80 = np.sum(ir_squared[:idx_80ms])
-        late_energy_80 = np.sum(ir_squared[idx_80ms:])
-        
-        if late_energy_80 > 0:
-            return 10 * np.log10(early_energy_80 / late_energy_80)
-    
-    return np.nan
+    return rt60
+
+def limit_index(length: int, fs: int, limit: float) -> int:
+    """Sample index of the time limit, kept inside a signal of the given length"""
+    return min(int(limit * fs), length - 1)
+
+def calculate_early_energy(band_energy: NDArray[np.floating], fs: int, limit: float) -> NDArray[np.floating]:
+    """Energy of every band before the time limit"""
+    early_energy: NDArray[np.floating] = np.sum(band_energy[:, :limit_index(band_energy.shape[1], fs, limit)], axis=1)
+    return early_energy
 
-def calculate_d50(ir_filtered: NDArray[np.floating], fs: int) -> Any | float:
+def calculate_clarity(early_energy: NDArray[np.floating], energy_decay: NDArray[np.floating], fs: int, limit: float) -> NDArray[np.floating]:
+    """Calculates clarity (early to late energy ratio) for the given time limit. C50 is used for speech, C80 for music"""
+    late_energy = energy_decay[:, limit_index(energy_decay.shape[1], fs, limit)]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(late_energy > 0, 10 * np.log10(early_energy / late_energy), np.nan)
+
+def calculate_d50(early_energy_50: NDArray[np.floating], energy_decay: NDArray[np.floating]) -> NDArray[np.floating]:
     """Calculates definition d50"""
-    ir_squared = ir_filtered**2
-    idx_50ms = min(int(0.05 * fs), len(ir_squared) - 1)
-    total_energy = np.sum(ir_squared)
-    
-    if idx_50ms < len(ir_squared) and total_energy > 0:
-        early_energy_50 = np.sum(ir_squared[:idx_50ms])
-        return (early_energy_50 / total_energy) * 100
-    
-    return np.nan
+    total_energy = energy_decay[:, 0]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total_energy > 0, (early_energy_50 / total_energy) * 100, np.nan)
 
-def calculate_g_strength(ir_filtered: NDArray[np.floating], ir_total_energy: float, num_bands: int) -> Any | float:
+def calculate_g_strength(total_energy: NDArray[np.floating], ir_total_energy: float) -> NDArray[np.floating]:
     """Calculates strength g"""
-    ir_squared = ir_filtered**2
-    total_energy = np.sum(ir_squared)
-    
-    if total_energy > 0 and ir_total_energy > 0:
-        reference_energy = ir_total_energy / num_bands
-        return 10 * np.log10(total_energy / reference_energy)
-    
-    return np.nan
-
-def calculate_acoustic_parameters(ir: NDArray[np.floating], fs: int, center_freqs: NDArray[np.floating], filters: list[NDArray[np.floating]]) -> AcousticParameters:
-    """Applies bandpass filter to ir and collects all parameters for ever 1/3 octave band"""
-    rt60_values = []
-    c50_values = []
-    c80_values = []
-    g_values = []
-    d50_values = []
-    
-    ir_total_energy = np.sum(ir**2)
-    num_bands = len(center_freqs)
-    
-    for filter in filters:
-        ir_filtered = sosfilt(filter, ir)
-        
-        rt60 = calculate_rt60(ir_filtered, fs)
-        c50 = calculate_c50(ir_filtered, fs)
-        c80 = calculate_c80(ir_filtered, fs)
-        d50 = calculate_d50(ir_filtered, fs)
-        g = calculate_g_strength(ir_filtered, ir_total_energy, num_bands)
-        
-        rt60_values.append(rt60)
-        c50_values.append(c50)
-        c80_values.append(c80)
-        d50_values.append(d50)
-        g_values.append(g)
+    num_bands = len(total_energy)
+
+    if ir_total_energy <= 0:
+        return np.full(num_bands, np.nan)
+
+    reference_energy = ir_total_energy / num_bands
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total_energy > 0, 10 * np.log10(total_energy / reference_energy), np.nan)
 
+def calculate_band_parameters(ir: NDArray[np.floating], fs: int, filters: Sequence[NDArray[np.floating]]) -> dict[str, NDArray[np.floating]]:
+    """Applies all bandpass filters to ir and calculates rt60, c50, c80, g and d50 for every band.
+    The bands are analysed BAND_CHUNK at a time, so the (bands x samples) intermediates never hold more than a chunk.
+    They keep the precision of a float32 ir, only the prefix sums of the decay fit stay in double precision"""
+    ir_total_energy = float(np.dot(ir, ir))
+    chunk_size = min(BAND_CHUNK, len(filters))
+    energy_decay_db = np.empty((chunk_size, len(ir)), dtype=np.float32 if ir.dtype == np.float32 else np.float64)
+
+    rt60, c50, c80, d50, total_energy = [], [], [], [], []
+    for first in range(0, len(filters), chunk_size):
+        band_energy = filter_octave_bands(ir, filters[first:first + chunk_size])
+        np.square(band_energy, out=band_energy)
+        early_energy_50 = calculate_early_energy(band_energy, fs, 0.05)
+        early_energy_80 = calculate_early_energy(band_energy, fs, 0.08)
+
+        chunk_decay_db = energy_decay_db[:len(band_energy)]
+        indices = calculate_energy_decay(band_energy, chunk_decay_db)
+        rt60.append(calculate_rt60(chunk_decay_db, indices, fs))
+        c50.append(calculate_clarity(early_energy_50, band_energy, fs, 0.05))
+        c80.append(calculate_clarity(early_energy_80, band_energy, fs, 0.08))
+        d50.append(calculate_d50(early_energy_50, band_energy))
+        total_energy.append(band_energy[:, 0].copy())
+
+    return {
+        "rt60": np.concatenate(rt60),
+        "c50": np.concatenate(c50),
+        "c80": np.concatenate(c80),
+        "g": calculate_g_strength(np.concatenate(total_energy), ir_total_energy),
+        "d50": np.concatenate(d50),
+    }
+
+def calculate_acoustic_parameters(ir: NDArray[np.floating], fs: int, center_freqs: NDArray[np.number], filters: Sequence[NDArray[np.floating]]) -> AcousticParameters:
+    """Collects all parameters for every 1/3 octave band, the band buffers are freed before the ir is converted to a list"""
+    bands = calculate_band_parameters(ir, fs, filters)
     return AcousticParameters(
-        rt60=rt60_values,
-        c50=c50_values,
-        c80=c80_values,
-        g=g_values,
-        d50=d50_values,
-        ir=ir.tolist()
+        **{name: values.tolist() for name, values in bands.items()},
+        ir=ir.tolist(),
+        sampleRate=int(fs),
     )
 
-def analyze_acoustic_parameters(sweep_signal: NDArray[np.floating], recorded_signals_cycles: list[list[NDArray[np.floating]]], sample_rate: int) -> list[list[AcousticParameters]]:
-    """Returns results for every mic speaker configuration"""
+def analyze_acoustic_parameters(recorded_signals_cycles: list[list[NDArray[np.floating]]], sample_rate: int, sweep: SweepSettings = DEFAULT_SWEEP, inverse: InverseFilter = "reciprocal", deconvolution: Deconvolution = "fft", workers: int | None = None, speaker_offsets: list[float] | None = None, filter_bank: FilterBank | None = None) -> list[list[AcousticParameters]]:
+    """Returns results for every mic speaker configuration, per band of filter_bank (third octaves by default).
+    deconvolution selects the circular complex fft path (using inverse) or the padded, regularized rfft path (using workers).
+    With speaker_offsets every recording holds the sweeps of all speakers, speaker k started speaker_offsets[k] seconds after
+    speaker 0 (overlapping or one after another). The recordings of a cycle are then deconvolved in one batch and split per speaker.
+    A cycle holds one result per mic and speaker, ordered by mic and then speaker, each labelled with its micIndex and speakerIndex"""
     results = []
     
-    center_freqs, filters = get_octave_band_filters(sample_rate)
+    bank = filter_bank or get_filter_bank(sample_rate)
+    center_freqs, filters = bank.center_freqs, bank.filters
     for recorded_cycle in recorded_signals_cycles:
-        results_cycle = []
-        for recorded_signal in recorded_cycle:
-            tf = calculate_transfer_function(sweep_signal, recorded_signal)
-            
-            ir = extract_impulse_response(tf)
+        results_cycle: list[AcousticParameters] = []
+        if speaker_offsets is not None and recorded_cycle:
+            offsets = [round(offset * sample_rate) for offset in speaker_offsets]
+            irs = calculate_impulse_response_linear(stack_recordings(recorded_cycle), sample_rate, sweep, workers=workers)
+            for mic, ir in enumerate(irs):
+                speaker_irs = separate_impulse_responses(ir, offsets, pre_delay=sample_rate // 1000)
+                for speaker, speaker_ir in enumerate(speaker_irs):
+                    speaker_results = calculate_acoustic_parameters(speaker_ir, sample_rate, center_freqs, filters)
+                    speaker_results.micIndex, speaker_results.speakerIndex = mic, speaker
+                    results_cycle.append(speaker_results)
+            results.append(results_cycle)
+            continue
+
+        for mic, recorded_signal in enumerate(recorded_cycle):
+            if deconvolution == "rfft":
+                ir = align_impulse_response(calculate_impulse_response_rfft(recorded_signal, sample_rate, sweep, workers=workers))
+            else:
+                tf = calculate_transfer_function(recorded_signal, sample_rate, sweep, inverse)
+                ir = extract_impulse_response(tf)
             
             mic_results = calculate_acoustic_parameters(ir, sample_rate, center_freqs, filters)
-            
+            mic_results.micIndex, mic_results.speakerIndex = mic, 0
             results_cycle.append(mic_results)
         results.append(results_cycle)
-    return results
\ No newline at end of file
+    return results
+
+def analyze_recordings(recordings_cycles: list[list[Recording]], sweep: SweepSettings = DEFAULT_SWEEP, deconvolution: Deconvolution = "fft", speaker_offsets: list[float] | None = None, precision: Precision = "float64") -> list[list[AcousticParameters]]:
+    """Decodes and analyzes the (binary, base64 or streamed PCM) recordings of every cycle. Self contained so it can run in a worker process.
+    All recordings are analyzed at the rate of the first one, the sweep is generated to match it.
+    With precision float32 the whole chain from decoding to the band parameters runs in single precision"""
+    recorded_signals_cycles: list[list[NDArray[np.floating]]] = []
+    analysis_rate: int | None = None
+    for cycle in recordings_cycles:
+        recorded_signals: list[NDArray[np.floating]] = []
+        for recording in cycle:
+            audio_data, sample_rate = decode_audio_data(recording, precision)
+            if analysis_rate is None:
+                analysis_rate = sample_rate
+            recorded_signals.append(resample_audio(audio_data, sample_rate, analysis_rate))
+        recorded_signals_cycles.append(recorded_signals)
+
+    if analysis_rate is None:
+        return [[] for _ in recordings_cycles]
+
+    return analyze_acoustic_parameters(recorded_signals_cycles, analysis_rate, sweep, deconvolution=deconvolution, speaker_offsets=speaker_offsets)
@@ -1,4 +1,5 @@
 from bson import ObjectId
+from dotenv import dotenv_values
 from fastapi import HTTPException
 from typing import Annotated
 
@@ -7,25 +8,56 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import logging
 
 from database.engine import DataContext, get_db
+from database.schemas.user_db import UserDbModel
+from services.cache_service import LruCache
 
 logger = logging.getLogger("uvicorn.info")
 bearer_scheme = HTTPBearer()
 
+config = dotenv_values(".env")
+token_cache: LruCache[str, bool] = LruCache(
+    maxsize=int(config.get("AUTH_CACHE_SIZE") or 1024), ttl=float(config.get("AUTH_CACHE_TTL") or 60)
+)
+
 
 async def get_token_header(credentials: Annotated[HTTPAuthorizationCredentials,  Security(bearer_scheme)],
                            data_context: Annotated[DataContext, Depends(get_db)]) -> str:
     """
     Tries to get a token from Bearer Authorization header.
-    Validates the tokens existence in the database.
+    Validates the tokens existence in the database, tokens validated within AUTH_CACHE_TTL seconds are not looked up again.
+    """
+
+    token = credentials.credentials
+    if token_cache.get(token) is None:
+        await get_current_user(credentials, data_context)
+
+    return token
+
+
+async def get_current_user(credentials: Annotated[HTTPAuthorizationCredentials,  Security(bearer_scheme)],
+                           data_context: Annotated[DataContext, Depends(get_db)]) -> UserDbModel:
+    """
+    Resolves the user of the token from Bearer Authorization header, for endpoints that need the user document.
+    The user is always read from the database, so it can be changed and saved without overwriting newer changes.
     """
 
     token = credentials.credentials
 
     user = await data_context.users.find_one_by_id(HttpObjectId(token, HTTPException(status_code=401, detail="Unauthorized")))
     if not user:
+        token_cache.pop(token)
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    return token
+    token_cache.put(token, True)
+    return user
+
+
+def invalidate_token(token: str) -> None:
+    """
+    Has to be called when a user is deleted.
+    Other server processes keep accepting the token until their cache entry expires.
+    """
+    token_cache.pop(token)
 
 
 class HttpObjectId(ObjectId):
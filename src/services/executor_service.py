@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Awaitable, Callable, Literal, ParamSpec, TypeVar
+
+from dotenv import dotenv_values
+
+from services.analysis_service import warm_filter_banks
+
+logger = logging.getLogger("uvicorn.info")
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+ExecutorKind = Literal["process", "thread"]
+
+
+class ExecutorBusyError(RuntimeError):
+    """
+    Raised when a job is rejected because too many jobs are already waiting for the pool.
+    """
+
+
+class JobExecutor:
+    """
+    Runs blocking jobs outside the asyncio event loop on a process or thread pool.
+    At most max_pending jobs are handed to the pool at once, further jobs wait for a free slot (back-pressure).
+    If max_queued is set, jobs beyond that many waiting ones are rejected instead of queued.
+    If timeout is set, run gives up waiting after that many seconds.
+    initializer runs once in every worker before its first job, e.g. to warm caches.
+    """
+
+    def __init__(
+            self,
+            kind: ExecutorKind,
+            max_workers: int,
+            max_pending: int | None = None,
+            max_queued: int | None = None,
+            timeout: float | None = None,
+            initializer: Callable[[], None] | None = None) -> None:
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending or max_workers * 2
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.initializer = initializer
+        self._pool: Executor | None = None
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._queued = 0
+
+    @property
+    def pool(self) -> Executor:
+        """
+        The underlying pool, created on first use.
+        Processes are spawned instead of forked, forking the threaded server process is unsafe.
+        """
+        if self._pool is None:
+            if self.kind == "process":
+                self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"), initializer=self.initializer)
+            else:
+                self._pool = ThreadPoolExecutor(self.max_workers, initializer=self.initializer)
+            logger.info(f"Started {self.kind} pool with {self.max_workers} workers")
+        return self._pool
+
+    @property
+    def saturated(self) -> bool:
+        """
+        Whether every slot is taken and new jobs have to wait.
+        """
+        return self._slots.locked()
+
+    async def run(self, fn: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+        """
+        Runs fn on the pool once a slot is free and returns its result.
+        Raises TimeoutError if the executor has a timeout and the job, including its wait for a slot, exceeds it.
+        A timed out job that has already started keeps its slot until the pool is done with it.
+        """
+        return await self.run_and_notify(None, fn, *args, **kwargs)
+
+    async def run_and_notify(
+            self, on_start: Callable[[], Awaitable[None]] | None, fn: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+        """
+        Like run, on_start is awaited once the job got a slot and was handed to the pool.
+        """
+        async def start_and_wait() -> T:
+            future: asyncio.Future[T] = await self._start(partial(fn, *args, **kwargs))
+            if on_start is not None:
+                await on_start()
+            return await future
+
+        return await asyncio.wait_for(start_and_wait(), self.timeout)
+
+    async def _start(self, job: Callable[[], T]) -> asyncio.Future[T]:
+        loop = asyncio.get_running_loop()
+        if self.saturated and self.max_queued is not None and self._queued >= self.max_queued:
+            raise ExecutorBusyError(f"{self._queued} jobs are already waiting for the {self.kind} pool")
+
+        self._queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._queued -= 1
+        try:
+            pool_future = self.pool.submit(job)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is freed when the pool is done with the job, even if nobody awaits it anymore
+        pool_future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._slots.release))
+        return asyncio.wrap_future(pool_future)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+config = dotenv_values(".env")
+
+analysis_executor = JobExecutor(
+    kind="thread" if config.get("ANALYSIS_EXECUTOR") == "thread" else "process",
+    max_workers=int(config.get("ANALYSIS_WORKERS") or 2),
+    max_pending=int(config.get("ANALYSIS_MAX_PENDING") or 0) or None,
+    initializer=warm_filter_banks,
+)
+
+simulation_executor = JobExecutor(
+    kind="thread" if config.get("SIMULATION_EXECUTOR") == "thread" else "process",
+    max_workers=int(config.get("SIMULATION_WORKERS") or 2),
+    max_pending=int(config.get("SIMULATION_WORKERS") or 2),
+    max_queued=int(config.get("SIMULATION_MAX_QUEUED") or 8),
+    timeout=float(config.get("SIMULATION_TIMEOUT") or 120),
+    initializer=warm_filter_banks,
+)
@@ -10,6 +10,8 @@ from scipy.ndimage import gaussian_filter1d
 from typing import Any, cast
 from numpy.typing import NDArray
 
+from services.analysis_service import find_impulse_response_bounds
+
 
 # === Hilfsfunktionen ===
 
@@ -51,24 +53,11 @@ def extract_impulse_response_alt(
     ir = cast(NDArray[np.float64], ir)
     threshold = 1e-7 * np.max(np.abs(ir))  # Schwellenwert zur Begrenzung der Länge
 
-    # Ende der relevanten Impulsantwort finden
-    for i in range(len(ir) - 1, 0, -1):
-        if np.abs(ir[i]) > threshold:
-            end_idx = i
-            break
-    else:
+    # Anfang und Ende der relevanten Impulsantwort finden (gemeinsame, vektorisierte Suche)
+    bounds = find_impulse_response_bounds(ir, threshold)
+    if bounds is None:
         return ir[np.argmax(np.abs(ir)) :]  # Falls nichts gefunden wird
-
-    # Anfang finden, nachdem die Energie wieder unter den Schwellenwert fällt
-    found_low = False
-    for i in range(end_idx - 1, 0, -1):
-        if np.abs(ir[i]) <= threshold:
-            found_low = True
-        elif found_low and np.abs(ir[i]) > threshold:
-            start_idx = i
-            break
-    else:
-        start_idx = 0
+    start_idx, _ = bounds
 
     return np.roll(ir, -start_idx)  # Beginn der IR an den Anfang schieben
 
@@ -1,44 +1,131 @@
 from database.engine import DataContext
 from database.schemas.material_db import MaterialDbModel
 from pymongo.errors import PyMongoError
+import asyncio
+import difflib
 import logging
-import re
+import time
+from dotenv import dotenv_values
+from models.bands import MATERIAL_BANDS
 from models.material import MaterialAbsorptionResult
 
 logger = logging.getLogger("uvicorn.info")
 
+CENTER_FREQS = list(MATERIAL_BANDS)
 
-async def get_material_absorption(
-    name: str, db: DataContext
-) -> MaterialAbsorptionResult:
+
+def normalize_material_name(name: str) -> str:
+    # Groß-/Kleinschreibung und Leerzeichen spielen für die Suche keine Rolle
+    return " ".join(name.casefold().split())
+
+
+def map_material_db_to_absorption(material: MaterialDbModel) -> MaterialAbsorptionResult:
+    coeffs = [
+        getattr(material, "f125", 0.0),
+        getattr(material, "f250", 0.0),
+        getattr(material, "f500", 0.0),
+        getattr(material, "f1000", 0.0),
+        getattr(material, "f2000", 0.0),
+        getattr(material, "f4000", 0.0),
+    ]
+
+    return MaterialAbsorptionResult(
+        name=material.description,
+        coeffs=coeffs,
+        center_freqs=CENTER_FREQS,
+    )
+
+
+class MaterialIndex:
+    """
+    In-process index of the materials collection: normalized description -> absorption coefficients.
+    The whole collection is loaded with one query and reloaded once the ttl has passed or after invalidate.
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._materials: dict[str, MaterialAbsorptionResult] = {}
+        self._loaded_at: float | None = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def expired(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    async def refresh(self, db: DataContext) -> None:
+        materials = await db.materials.find_by({})
+        self._materials = {
+            normalize_material_name(material.description): map_material_db_to_absorption(material)
+            for material in materials
+        }
+        self._loaded_at = time.monotonic()
+        logger.info(f"Loaded {len(self._materials)} materials into the material index")
+
+    async def ensure_loaded(self, db: DataContext) -> None:
+        if not self.expired:
+            return
+        async with self._lock:
+            if self.expired:
+                await self.refresh(db)
+
+    def invalidate(self) -> None:
+        self._loaded_at = None
+
+    def lookup(self, name: str) -> MaterialAbsorptionResult | None:
+        """
+        Finds a material by exact name, then by prefix, then by substring (like the former regex search),
+        then by fuzzy match. Among several prefix or substring matches the shortest name wins.
+        A fuzzy match may stand for a different material than meant, it is logged as a warning.
+        """
+        key = normalize_material_name(name)
+        if key in self._materials:
+            return self._materials[key]
+
+        for matches in (
+            [d for d in self._materials if d.startswith(key)],
+            [d for d in self._materials if key in d],
+        ):
+            if matches:
+                return self._materials[min(matches, key=lambda d: (len(d), d))]
+
+        close = difflib.get_close_matches(key, self._materials, n=1, cutoff=0.8)
+        if not close:
+            return None
+        material = self._materials[close[0]]
+        logger.warning(f"Material '{name}' not found, using the similarly named '{material.name}'")
+        return material
+
+
+material_index = MaterialIndex(ttl=float(dotenv_values(".env").get("MATERIAL_INDEX_TTL") or 600))
+
+
+async def get_materials(
+    names: list[str], db: DataContext
+) -> list[MaterialAbsorptionResult]:
+    """
+    Resolves several materials at once. Needs at most one database query, none while the index is fresh.
+    """
     try:
-        # Suche Materialbeschreibung via Regex
-        material: MaterialDbModel | None = await db.materials.find_one_by(
-            {"description": {"$regex": re.escape(name), "$options": "i"}}
-        )
+        await material_index.ensure_loaded(db)
+    except PyMongoError as e:
+        raise RuntimeError(f"Datenbankfehler: {e}")
 
+    results = []
+    for name in names:
+        material = material_index.lookup(name)
         if not material:
             raise ValueError(f"Material '{name}' nicht gefunden.")
+        results.append(material)
+    return results
 
-        coeffs = [
-            getattr(material, "f125", 0.0),
-            getattr(material, "f250", 0.0),
-            getattr(material, "f500", 0.0),
-            getattr(material, "f1000", 0.0),
-            getattr(material, "f2000", 0.0),
-            getattr(material, "f4000", 0.0),
-        ]
-
-        return MaterialAbsorptionResult(
-            name=material.description,
-            coeffs=coeffs,
-            center_freqs=[125, 250, 500, 1000, 2000, 4000],
-        )
 
-    except PyMongoError as e:
-        raise RuntimeError(f"Datenbankfehler: {e}")
+async def get_material_absorption(
+    name: str, db: DataContext
+) -> MaterialAbsorptionResult:
+    return (await get_materials([name], db))[0]
 
 
 # How to use
 # from database.engine import data_context
 # material = await get_material_absorption("carpet", data_context)
+# walls = await get_materials(["carpet", "concrete"], data_context)
@@ -0,0 +1,137 @@
+from datetime import datetime
+from typing import Any, List
+
+from bson import ObjectId
+
+from database.engine import DataContext
+from database.schemas.impulse_response_db import ImpulseResponseDbModel
+from database.schemas.measurement_db import MeasurementDbModel
+from database.schemas.room_db import RoomDbModel
+from models import AcousticParameters
+
+# Impulse responses are kept out of the measurement, room and cache documents, which only reference them by irId.
+# Every document owns the impulse responses it references, they are deleted together with it.
+
+
+def has_inline_impulse_responses(values: List[List[AcousticParameters]]) -> bool:
+    return any(param.irId is None and param.ir for cycle in values for param in cycle)
+
+
+def inline_impulse_responses_query(field: str) -> dict[str, Any]:
+    """
+    Matches the documents has_inline_impulse_responses is true for, field holds the list of cycles.
+    """
+    # Parameters sit in the inner lists, which a dotted path does not reach
+    return {field: {"$elemMatch": {"$elemMatch": {"irId": None, "ir.0": {"$exists": True}}}}}
+
+
+async def store_impulse_responses(
+    values: List[List[AcousticParameters]], db: DataContext, expires_at: datetime | None = None
+) -> List[List[AcousticParameters]]:
+    """
+    Writes the impulse responses carried by values in one bulk insert and returns copies of values that only reference them.
+    Loaded values are written again, so the new document does not share impulse responses with the one they came from.
+    Impulse responses with expires_at are removed by the database after that time, for documents that expire as well.
+    """
+    inline = [param for cycle in values for param in cycle if param.ir]
+    impulse_responses = [ImpulseResponseDbModel.from_samples(param.ir, param.sampleRate, expires_at) for param in inline]
+    if impulse_responses:
+        await db.impulse_responses.save_many(impulse_responses)
+    ids = {id(param): str(impulse_response.id) for param, impulse_response in zip(inline, impulse_responses)}
+
+    return [
+        [
+            param.model_copy(update={"ir": [], "irId": ids[id(param)]}) if id(param) in ids else param
+            for param in cycle
+        ]
+        for cycle in values
+    ]
+
+
+async def load_impulse_responses(
+    values: List[List[AcousticParameters]], db: DataContext
+) -> List[List[AcousticParameters]]:
+    """
+    Returns copies of values with the referenced impulse responses filled in, all of them are fetched with one query.
+    """
+    ir_ids = [ObjectId(param.irId) for cycle in values for param in cycle if param.irId is not None]
+    if not ir_ids:
+        return values
+
+    impulse_responses = {
+        str(impulse_response.id): impulse_response
+        for impulse_response in await db.impulse_responses.find_by({"_id": {"$in": ir_ids}})
+    }
+
+    def fill(param: AcousticParameters) -> AcousticParameters:
+        if param.irId is None:
+            return param
+        impulse_response = impulse_responses.get(param.irId)
+        if impulse_response is None:
+            return param.model_copy(update={"ir": []})
+        return param.model_copy(update={
+            "ir": impulse_response.to_samples(),
+            "sampleRate": param.sampleRate or impulse_response.sample_rate,
+        })
+
+    return [[fill(param) for param in cycle] for cycle in values]
+
+
+async def delete_impulse_responses(values: List[List[AcousticParameters]] | None, db: DataContext) -> None:
+    ir_ids = [ObjectId(param.irId) for cycle in values or [] for param in cycle if param.irId is not None]
+    if ir_ids:
+        await db.impulse_responses.get_collection().delete_many({"_id": {"$in": ir_ids}})
+
+
+async def find_impulse_response(
+    values: List[List[AcousticParameters]] | None, ir_id: str, db: DataContext
+) -> List[float] | None:
+    """
+    Returns the samples of one impulse response, if values reference it.
+    """
+    if not ObjectId.is_valid(ir_id) or not any(param.irId == ir_id for cycle in values or [] for param in cycle):
+        return None
+    impulse_response = await db.impulse_responses.find_one_by_id(ObjectId(ir_id))
+    return impulse_response.to_samples() if impulse_response is not None else None
+
+
+async def migrate_measurement(measurement_db: MeasurementDbModel, db: DataContext) -> MeasurementDbModel:
+    """
+    Moves inline impulse responses of a measurement saved before they were stored separately out of the document.
+    Of concurrent migrations only the first is written, the others drop the impulse responses they stored and return it.
+    """
+    if not has_inline_impulse_responses(measurement_db.values):
+        return measurement_db
+
+    migrated = measurement_db.model_copy(update={"values": await store_impulse_responses(measurement_db.values, db)})
+    document = db.measurements.to_document(migrated)
+    document.pop("_id")
+    result = await db.measurements.get_collection().update_one(
+        {"_id": measurement_db.id, **inline_impulse_responses_query("values")}, {"$set": document}
+    )
+    if result.matched_count:
+        return migrated
+
+    await delete_impulse_responses(migrated.values, db)
+    return await db.measurements.find_one_by_id(measurement_db.id) or measurement_db
+
+
+async def migrate_room(room_db: RoomDbModel, db: DataContext) -> RoomDbModel:
+    """
+    Moves inline impulse responses of a room simulation saved before they were stored separately out of the document.
+    Of concurrent migrations only the first is written, the others drop the impulse responses they stored and return it.
+    """
+    if room_db.simulation is None or not has_inline_impulse_responses(room_db.simulation):
+        return room_db
+
+    migrated = room_db.model_copy(update={"simulation": await store_impulse_responses(room_db.simulation, db)})
+    document = db.rooms.to_document(migrated)
+    document.pop("_id")
+    result = await db.rooms.get_collection().update_one(
+        {"_id": room_db.id, **inline_impulse_responses_query("simulation")}, {"$set": document}
+    )
+    if result.matched_count:
+        return migrated
+
+    await delete_impulse_responses(migrated.simulation, db)
+    return await db.rooms.find_one_by_id(room_db.id) or room_db
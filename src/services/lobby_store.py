@@ -0,0 +1,309 @@
+import asyncio
+import importlib
+import json
+from typing import Any, Awaitable, Callable, Protocol
+
+from dotenv import dotenv_values
+
+from services.recording_service import RecordingBudget, recording_budget
+from sio.models import Lobby, RecordData
+
+LOBBY_TTL = 24 * 60 * 60  # seconds a lobby is kept in redis without being saved again
+MAX_PENDING_RECORDINGS = 16
+
+
+class LobbyStore(Protocol):
+    """
+    Lobby state shared by all server processes: the lobbies, which of them run a measurement
+    and the channels recordings are sent to the measurement controller through.
+    Lobbies are returned as copies, changes have to be saved to become visible.
+    Each channel holds one recording per socket, a newer recording of the same socket replaces the pending one.
+    At most max_pending sockets can have a pending recording, further ones are refused until the controller catches up.
+    """
+
+    async def get_lobby(self, lobby_id: str) -> Lobby | None: ...
+
+    async def save_lobby(self, lobby: Lobby) -> None: ...
+
+    async def update_lobby(self, lobby_id: str, update: Callable[[Lobby], None]) -> Lobby | None:
+        """
+        Applies update to the current lobby and saves it atomically, concurrent updates are never lost.
+        update may be called more than once if the lobby changed in between, it has to derive everything from the lobby it gets.
+        Returns the updated lobby or None if the lobby does not exist.
+        """
+
+    async def delete_lobby(self, lobby_id: str) -> None:
+        """Removes the lobby together with its running flag and pending recordings"""
+
+    async def set_running(self, lobby_id: str, running: bool) -> None: ...
+
+    async def is_running(self, lobby_id: str) -> bool: ...
+
+    async def put_recording(self, lobby_id: str, record: RecordData) -> bool:
+        """Returns False if the recording was refused, the pending recording of the socket is then kept"""
+
+    async def get_recording(self, lobby_id: str, timeout: float) -> RecordData | None:
+        """Waits for the next recording of the lobby, returns None if none arrives within timeout seconds"""
+
+    async def clear_recordings(self, lobby_id: str) -> None: ...
+
+
+class InMemoryLobbyStore:
+    """
+    Keeps the lobby state in this process, only usable with a single server process.
+    Pending recordings stay in memory, so they are accounted against the recording budget until the controller takes them.
+    """
+
+    def __init__(self, max_pending: int = MAX_PENDING_RECORDINGS, budget: RecordingBudget | None = None) -> None:
+        self.max_pending = max_pending
+        self.budget = budget
+        self._lobbies: dict[str, Lobby] = {}
+        self._running: set[str] = set()
+        self._recordings: dict[str, dict[str, RecordData]] = {}
+        self._arrived: dict[str, asyncio.Event] = {}
+
+    async def get_lobby(self, lobby_id: str) -> Lobby | None:
+        lobby = self._lobbies.get(lobby_id)
+        return lobby.model_copy(deep=True) if lobby is not None else None
+
+    async def save_lobby(self, lobby: Lobby) -> None:
+        self._lobbies[lobby.lobby_id] = lobby.model_copy(deep=True)
+
+    async def update_lobby(self, lobby_id: str, update: Callable[[Lobby], None]) -> Lobby | None:
+        # Nothing is awaited between reading and saving, so no other update can interleave
+        lobby = await self.get_lobby(lobby_id)
+        if lobby is None:
+            return None
+        update(lobby)
+        await self.save_lobby(lobby)
+        return lobby
+
+    async def delete_lobby(self, lobby_id: str) -> None:
+        self._lobbies.pop(lobby_id, None)
+        self._running.discard(lobby_id)
+        await self.clear_recordings(lobby_id)
+        self._arrived.pop(lobby_id, None)
+
+    async def set_running(self, lobby_id: str, running: bool) -> None:
+        if running:
+            self._running.add(lobby_id)
+        else:
+            self._running.discard(lobby_id)
+
+    async def is_running(self, lobby_id: str) -> bool:
+        return lobby_id in self._running
+
+    def _reserve(self, lobby_id: str, record: RecordData) -> bool:
+        return self.budget is None or self.budget.reserve(lobby_id, len(record.recording))
+
+    def _release(self, lobby_id: str, record: RecordData) -> None:
+        if self.budget is not None:
+            self.budget.release(lobby_id, len(record.recording))
+
+    async def put_recording(self, lobby_id: str, record: RecordData) -> bool:
+        channel = self._recordings.setdefault(lobby_id, {})
+        pending = channel.get(record.sid)
+        if pending is None and len(channel) >= self.max_pending:
+            return False
+
+        # The pending recording is released first, so replacing it only needs room for the difference
+        if pending is not None:
+            self._release(lobby_id, pending)
+        if not self._reserve(lobby_id, record):
+            if pending is not None:
+                self._reserve(lobby_id, pending)
+            return False
+
+        # Replacing keeps the place of the socket in the channel
+        channel[record.sid] = record
+        self._arrived.setdefault(lobby_id, asyncio.Event()).set()
+        return True
+
+    async def get_recording(self, lobby_id: str, timeout: float) -> RecordData | None:
+        arrived = self._arrived.setdefault(lobby_id, asyncio.Event())
+        try:
+            async with asyncio.timeout(timeout):
+                while not self._recordings.get(lobby_id):
+                    arrived.clear()
+                    await arrived.wait()
+        except TimeoutError:
+            return None
+
+        channel = self._recordings[lobby_id]
+        record = channel.pop(next(iter(channel)))
+        # The controller accounts for the recording itself once it holds it
+        self._release(lobby_id, record)
+        return record
+
+    async def clear_recordings(self, lobby_id: str) -> None:
+        for record in self._recordings.pop(lobby_id, {}).values():
+            self._release(lobby_id, record)
+
+
+class RedisPipeline(Protocol):
+    """
+    The part of redis.asyncio.client.Pipeline the lobby store uses.
+    Commands are executed immediately while keys are watched and queued after multi.
+    """
+
+    def get(self, name: str) -> Awaitable[bytes | None]: ...
+
+    def multi(self) -> None: ...
+
+    def set(self, name: str, value: bytes, ex: int | None = None) -> Any: ...
+
+    def hget(self, name: str, key: str) -> Any: ...
+
+    def hdel(self, name: str, *keys: str) -> Any: ...
+
+
+class RedisClient(Protocol):
+    """
+    The part of redis.asyncio.Redis the lobby store uses.
+    """
+
+    async def transaction(
+        self, func: Callable[[Any], Awaitable[Any]], *watches: str, value_from_callable: bool = False
+    ) -> Any:
+        """Calls func with a pipeline watching watches and executes it, both are repeated until no watched key changed in between"""
+
+    async def get(self, name: str) -> bytes | None: ...
+
+    async def set(self, name: str, value: bytes, ex: int | None = None) -> Any: ...
+
+    async def delete(self, *names: str) -> Any: ...
+
+    async def hset(self, name: str, key: str, value: bytes) -> int: ...
+
+    async def hdel(self, name: str, *keys: str) -> int: ...
+
+    async def rpush(self, name: str, *values: bytes) -> int: ...
+
+    async def lrem(self, name: str, count: int, value: bytes) -> int: ...
+
+    async def blpop(self, keys: list[str], timeout: float) -> tuple[bytes, bytes] | None: ...
+
+
+def encode_record(record: RecordData) -> bytes:
+    # A json header line followed by the recording as it is, binary recordings are flagged so they are not
+    # confused with legacy base64 strings. The header holds no raw newline, json escapes them
+    binary = isinstance(record.recording, bytes)
+    header = json.dumps({"sid": record.sid, "binary": binary, "sample_rate": record.sample_rate}).encode()
+    recording = record.recording if isinstance(record.recording, bytes) else record.recording.encode()
+    return b"\n".join((header, recording))
+
+
+def decode_record(data: bytes) -> RecordData:
+    header, _, recording = data.partition(b"\n")
+    fields = json.loads(header)
+    return RecordData(
+        sid=fields["sid"], recording=recording if fields["binary"] else recording.decode(), sample_rate=fields["sample_rate"]
+    )
+
+
+class RedisLobbyStore:
+    """
+    Keeps the lobby state in redis so every server process sees the same lobbies.
+    Recordings are kept in a redis hash per lobby by socket id, a list of socket ids gives the order
+    the measurement controller takes them in, whichever process it runs in.
+    """
+
+    def __init__(self, client: RedisClient, max_pending: int = MAX_PENDING_RECORDINGS) -> None:
+        self.client = client
+        self.max_pending = max_pending
+
+    async def get_lobby(self, lobby_id: str) -> Lobby | None:
+        data = await self.client.get(f"lobby:{lobby_id}")
+        return Lobby.model_validate_json(data) if data is not None else None
+
+    async def save_lobby(self, lobby: Lobby) -> None:
+        await self.client.set(f"lobby:{lobby.lobby_id}", lobby.model_dump_json().encode(), ex=LOBBY_TTL)
+
+    async def update_lobby(self, lobby_id: str, update: Callable[[Lobby], None]) -> Lobby | None:
+        key = f"lobby:{lobby_id}"
+
+        async def apply(pipe: RedisPipeline) -> Lobby | None:
+            data = await pipe.get(key)
+            if data is None:
+                return None
+            lobby = Lobby.model_validate_json(data)
+            update(lobby)
+            pipe.multi()
+            pipe.set(key, lobby.model_dump_json().encode(), ex=LOBBY_TTL)
+            return lobby
+
+        # WATCH/MULTI: the save fails and apply runs again if another process saved the lobby after it was read
+        lobby: Lobby | None = await self.client.transaction(apply, key, value_from_callable=True)
+        return lobby
+
+    async def delete_lobby(self, lobby_id: str) -> None:
+        await self.client.delete(
+            f"lobby:{lobby_id}", f"lobby:{lobby_id}:running", f"lobby:{lobby_id}:recordings", f"lobby:{lobby_id}:recording_order"
+        )
+
+    async def set_running(self, lobby_id: str, running: bool) -> None:
+        if running:
+            await self.client.set(f"lobby:{lobby_id}:running", b"1", ex=LOBBY_TTL)
+        else:
+            await self.client.delete(f"lobby:{lobby_id}:running")
+
+    async def is_running(self, lobby_id: str) -> bool:
+        return await self.client.get(f"lobby:{lobby_id}:running") is not None
+
+    async def put_recording(self, lobby_id: str, record: RecordData) -> bool:
+        records, order = f"lobby:{lobby_id}:recordings", f"lobby:{lobby_id}:recording_order"
+        if not await self.client.hset(records, record.sid, encode_record(record)):
+            # Replaced the pending recording of the socket, which keeps its place
+            return True
+        # Pushing first and taking the socket back keeps the bound without a separate length check that could race
+        if await self.client.rpush(order, record.sid.encode()) > self.max_pending:
+            await self.client.lrem(order, -1, record.sid.encode())
+            await self.client.hdel(records, record.sid)
+            return False
+        return True
+
+    async def get_recording(self, lobby_id: str, timeout: float) -> RecordData | None:
+        records, order = f"lobby:{lobby_id}:recordings", f"lobby:{lobby_id}:recording_order"
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (remaining := deadline - loop.time()) > 0:
+            popped = await self.client.blpop([order], remaining)
+            if popped is None:
+                return None
+            sid = popped[1].decode()
+
+            async def take(pipe: RedisPipeline) -> None:
+                pipe.multi()
+                pipe.hget(records, sid)
+                pipe.hdel(records, sid)
+
+            # Reading and removing in one transaction, a replacement arriving in between is not lost
+            data, _ = await self.client.transaction(take)
+            # A refused recording can leave its socket in the order for a moment
+            if data is not None:
+                return decode_record(data)
+        return None
+
+    async def clear_recordings(self, lobby_id: str) -> None:
+        await self.client.delete(f"lobby:{lobby_id}:recordings", f"lobby:{lobby_id}:recording_order")
+
+
+def create_lobby_store(redis_url: str | None, max_pending: int = MAX_PENDING_RECORDINGS) -> LobbyStore:
+    """
+    Uses redis if a url is configured, the redis package is only needed then.
+    """
+    if not redis_url:
+        return InMemoryLobbyStore(max_pending, recording_budget)
+
+    try:
+        redis = importlib.import_module("redis.asyncio")
+    except ImportError as e:
+        raise RuntimeError("REDIS_URL is set but the redis package is not installed") from e
+    return RedisLobbyStore(redis.from_url(redis_url), max_pending)
+
+
+config = dotenv_values(".env")
+
+REDIS_URL = config.get("REDIS_URL") or None
+
+lobby_store = create_lobby_store(REDIS_URL, int(config.get("LOBBY_MAX_PENDING_RECORDINGS") or MAX_PENDING_RECORDINGS))
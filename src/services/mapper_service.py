@@ -1,10 +1,11 @@
-from api.models.measurement import RestMeasurement
+from api.models.measurement import RestMeasurement, RestMeasurementSummary
 from api.models.post_models import CreateRoom, UpdateScene
 from api.models.room import Room
 from api.models.room_scene import RestRoomScene
-from api.models.simulation import Simulation
-from database.schemas.measurement_db import MeasurementDbModel
-from database.schemas.room_db import RoomDbModel
+from api.models.simulation import Simulation, SimulationJob
+from database.schemas.measurement_db import MeasurementDbModel, MeasurementSummaryDbModel
+from database.schemas.room_db import RoomDbModel, RoomSummaryDbModel
+from database.schemas.simulation_job_db import SimulationJobDbModel
 
 
 def map_room_db_to_room(room_db: RoomDbModel, token: str) -> Room:
@@ -20,6 +21,19 @@ def map_room_db_to_room(room_db: RoomDbModel, token: str) -> Room:
     )
 
 
+def map_room_summary_db_to_room(room_db: RoomSummaryDbModel, token: str) -> Room:
+    """
+    Maps a projected room without scene and simulation to a Room API model.
+    """
+    return Room(
+        id=str(room_db.id),
+        name=room_db.name,
+        isOwner=(room_db.ownerToken == token),
+        hasSimulation=room_db.has_simulation,
+        lastUpdatedAt=room_db.updated_at.isoformat()
+    )
+
+
 def map_create_room_to_room_db(body: CreateRoom, token: str) -> RoomDbModel:
     """
     Maps a CreateRoom request to a new RoomDbModel for persistence.
@@ -63,7 +77,8 @@ def map_room_db_to_simulation(room_db: RoomDbModel) -> Simulation:
     """
     return Simulation(
         roomId=str(room_db.id),
-        values=room_db.simulation or []
+        values=room_db.simulation or [],
+        quality=room_db.simulation_quality
     )
 
 def map_measurement_db_to_rest_measurement(measurement_db: MeasurementDbModel, token: str ) -> RestMeasurement:
@@ -77,3 +92,27 @@ def map_measurement_db_to_rest_measurement(measurement_db: MeasurementDbModel, t
         createdAt=measurement_db.created_at.isoformat(),
         name=measurement_db.name
     )
+
+def map_measurement_summary_db_to_rest_measurement_summary(measurement_db: MeasurementSummaryDbModel, token: str) -> RestMeasurementSummary:
+    """
+    Maps a projected measurement without values to the Measurement summary API model.
+    """
+    return RestMeasurementSummary(
+        id=str(measurement_db.id),
+        isOwner=measurement_db.ownerToken == token,
+        createdAt=measurement_db.created_at.isoformat(),
+        name=measurement_db.name
+    )
+
+def map_simulation_job_db_to_simulation_job(job_db: SimulationJobDbModel) -> SimulationJob:
+    """
+    Maps a stored simulation job to the SimulationJob API model.
+    """
+    return SimulationJob(
+        jobId=str(job_db.id),
+        roomId=job_db.roomId,
+        quality=job_db.quality,
+        status=job_db.status,
+        error=job_db.error,
+        createdAt=job_db.created_at.isoformat()
+    )
@@ -1,83 +1,185 @@
 import asyncio
 import logging
+from functools import partial
 
-import numpy as np
 from bson import ObjectId
-
-from numpy.typing import NDArray
+from dotenv import dotenv_values
 
 from database.engine import DataContext
 from database.schemas.measurement_db import MeasurementDbModel
 from socketio import AsyncServer
-from typing import List, Dict
-
-from services.analysis_service import analyze_acoustic_parameters, create_in, decode_audio_data
+from socketio.exceptions import TimeoutError as AckTimeoutError
+from typing import Dict, List
+
+from models import AcousticParameters
+from services.analysis_service import Precision, Recording, analyze_recordings
+from services.executor_service import analysis_executor
+from services.impulse_response_service import store_impulse_responses
+from services.lobby_store import lobby_store
+from services.recording_service import RecordingBuffer, SPILL_DIR, SPILL_RECORDINGS, recording_budget, recording_size, remove_spilled, spill_recording
 from sio.models import Lobby, RecordData
 
-lobbies: Dict[str, Lobby] = {}
+# Lobbies and recordings are shared through lobby_store, the state below belongs to the sockets and tasks of this process
 measurement_tasks: dict[str, asyncio.Task] = {} # type: ignore
-measurement_queues: dict[str, asyncio.Queue[RecordData]] = {}
 id_map: dict[str, str] = {} # maps sid to user_id
+recording_buffers: dict[str, dict[str, RecordingBuffer | None]] = {} # maps lobby_id to the streamed recordings by sid, None for dropped streams
+
+config = dotenv_values(".env")
+MAX_RECORDING_SECONDS = float(config.get("MEASUREMENT_MAX_RECORDING_SECONDS") or 60)
+ACK_TIMEOUT = float(config.get("MEASUREMENT_ACK_TIMEOUT") or 2)
+PLAYBACK_TIMEOUT = float(config.get("MEASUREMENT_PLAYBACK_TIMEOUT") or 8)
+UPLOAD_TIMEOUT = float(config.get("MEASUREMENT_UPLOAD_TIMEOUT") or 60)
+ANALYSIS_PRECISION: Precision = "float32" if config.get("ANALYSIS_PRECISION") == "float32" else "float64"
+REVERB_TAIL = 1 # seconds recorded after the last sweep finished playing
 
 logger = logging.getLogger("uvicorn.info")
 
+def recording_payload(record: RecordData) -> Recording:
+    if record.sample_rate is None or isinstance(record.recording, str):
+        return record.recording
+    return record.recording, record.sample_rate
+
+def hold_recording(lobby_id: str, record: RecordData) -> Recording | None:
+    """Accounts a recording picked up by the controller against the memory budget.
+    Recordings beyond the budget are spilled to a temporary file, or rejected (None) if spilling is off"""
+    payload = recording_payload(record)
+    if recording_budget.reserve(lobby_id, recording_size(payload)):
+        return payload
+    if not SPILL_RECORDINGS:
+        logger.warning(f"Recording memory budget exceeded, rejecting recording of {record.sid} in lobby {lobby_id}: {recording_budget.report()}")
+        return None
+    logger.info(f"Recording memory budget exceeded, spilling recording of {record.sid} in lobby {lobby_id} to disk: {recording_budget.report()}")
+    return spill_recording(payload, SPILL_DIR)
+
+def release_recordings(lobby_id: str, recordings: List[Recording], _: object = None) -> None:
+    """Frees the budget and spill files of recordings. Also usable as done callback of their analysis task"""
+    for recording in recordings:
+        recording_budget.release(lobby_id, recording_size(recording))
+        remove_spilled(recording)
+
+async def call_client(sio: AsyncServer, event: str, sid: str, timeout: float) -> bool:
+    """Emits event to a single client and waits for its acknowledgement.
+    Returns False if the client does not answer in time, the caller then continues as if it had"""
+    try:
+        await sio.call(event, {}, to=sid, timeout=timeout)
+        return True
+    except AckTimeoutError:
+        logger.info(f"Client {sid} did not acknowledge {event} within {timeout}s")
+        return False
+
+async def play_sweeps(sio: AsyncServer, lobby: Lobby) -> list[float]:
+    """Lets the speakers play their sweeps in index order and returns when every sweep has finished.
+    Speakers play one after another, each as soon as the previous acknowledged the end of its playback,
+    or overlapping sweep_offset seconds apart. Returns the measured start of every sweep relative to the first one"""
+    loop = asyncio.get_running_loop()
+    starts: list[float] = []
+    playbacks: list[asyncio.Task[bool]] = []
+    for speaker in sorted(lobby.speakers, key=lambda s: s.index):
+        starts.append(loop.time())
+        playback = asyncio.create_task(call_client(sio, "play_sound", speaker.sid, PLAYBACK_TIMEOUT))
+        playbacks.append(playback)
+        if lobby.sweep_offset is None:
+            await playback
+        elif len(starts) < len(lobby.speakers):
+            await asyncio.sleep(lobby.sweep_offset)
+
+    await asyncio.gather(*playbacks)
+    return [start - starts[0] for start in starts]
+
+async def abort_measurement(sio: AsyncServer, lobby: Lobby, reason: str) -> None:
+    """Stops a running measurement, the lobby stays open so it can be started again"""
+    await sio.emit("measurement_fail", {"reason": reason}, to=lobby.lobby_id)
+    await lobby_store.set_running(lobby.lobby_id, False)
+    await lobby_store.clear_recordings(lobby.lobby_id)
+    recording_buffers.pop(lobby.lobby_id, None)
+    recording_budget.drop(lobby.lobby_id)
+    measurement_tasks.pop(lobby.lobby_id, None)
+
 async def measurement_controller(sio: AsyncServer, lobby: Lobby, ctx: DataContext) -> None:
     await sio.emit("start_measurement", {}, to=lobby.lobby_id)
-    measurement_queues[lobby.lobby_id] = asyncio.Queue()
-    await asyncio.sleep(1)
-    data_list: List[List[RecordData]] = []
-
-    for i in range(lobby.repetitions):
-        logger.info(f"measurement cycle {i} for lobby {lobby.lobby_id} started")
-        for mic in lobby.microphones:
-            await sio.emit("start_recording", {}, to=mic.sid)
-
-        await asyncio.sleep(1)
-        for speaker in lobby.speakers:
-            await sio.emit("play_sound", {}, to=speaker.sid)
-            await asyncio.sleep(6)
-
-        for mic in lobby.microphones:
-            await sio.emit("end_recording", {}, to=mic.sid)
-
-        record_data: List[RecordData] = []
-
-        logger.info(f"Lobby {lobby.lobby_id} waiting for recorded data...")
-        while len(record_data) < len(lobby.microphones):
-            data = await measurement_queues[lobby.lobby_id].get()
-
-            record_data.append(data)
-
-        logger.info(f"Lobby {lobby.lobby_id} received recorded data: {len(record_data)}")
-        data_list.append(record_data)
-        if i < (lobby.repetitions - 1):
-            await asyncio.sleep(lobby.delay)
-
-    await sio.emit("end_measurement", {}, to=lobby.lobby_id)
-    recorded_signals_cycles : List[List[NDArray[np.floating]]] = []
-    for cycle in data_list:
-        recorded_signals : List[NDArray[np.floating]] = []
-        for record in cycle:
-            audio_data, sample_rate = decode_audio_data(record.recording)
-            recorded_signals.append(audio_data)
-        recorded_signals_cycles.append(recorded_signals)
-    
-    # Temporary
-    sweep_signal = create_in(48000)
+    await lobby_store.clear_recordings(lobby.lobby_id)
+    # Each cycle is analyzed in the background while the next one is recorded
+    cycle_analyses: List[asyncio.Task[List[List[AcousticParameters]]]] = []
+    # Latest recording per microphone of the current cycle, until they are handed to its analysis
+    recordings: Dict[str, Recording] = {}
+
     try:
-        results = analyze_acoustic_parameters(sweep_signal, recorded_signals_cycles, sample_rate)
-    except Exception as e:
-        logger.info("Error while analyzing mic data")
-        logger.info(e)
-        return
+        for i in range(lobby.repetitions):
+            # A disconnect handled by another process ends the measurement through the store
+            if not await lobby_store.is_running(lobby.lobby_id):
+                measurement_tasks.pop(lobby.lobby_id, None)
+                return
+
+            logger.info(f"measurement cycle {i} for lobby {lobby.lobby_id} started")
+            # Leftovers of the previous cycle must not be taken for this cycle's recordings
+            await lobby_store.clear_recordings(lobby.lobby_id)
+            await asyncio.gather(*(call_client(sio, "start_recording", mic.sid, ACK_TIMEOUT) for mic in lobby.microphones))
+
+            speaker_offsets = await play_sweeps(sio, lobby)
+            await asyncio.sleep(REVERB_TAIL)
+
+            for mic in lobby.microphones:
+                await sio.emit("end_recording", {}, to=mic.sid)
+
+            # Microphones in index order, recordings from other sockets are ignored
+            mic_sids = [mic.sid for mic in sorted(lobby.microphones, key=lambda m: m.index)]
+
+            logger.info(f"Lobby {lobby.lobby_id} waiting for recorded data...")
+            while len(recordings) < len(mic_sids):
+                data = await lobby_store.get_recording(lobby.lobby_id, UPLOAD_TIMEOUT)
+                if data is None:
+                    logger.info(f"Lobby {lobby.lobby_id} timed out waiting for recorded data")
+                    await abort_measurement(sio, lobby, "Not every microphone sent its recording.")
+                    return
+                if data.sid not in mic_sids:
+                    continue
+
+                recording = hold_recording(lobby.lobby_id, data)
+                if recording is None:
+                    await abort_measurement(sio, lobby, "The server has no memory left for recordings.")
+                    return
+                if data.sid in recordings:
+                    release_recordings(lobby.lobby_id, [recordings[data.sid]])
+                recordings[data.sid] = recording
+
+            logger.info(f"Lobby {lobby.lobby_id} received recorded data: {len(recordings)}, holding {recording_budget.held(lobby.lobby_id)} bytes of recordings ({recording_budget.total} of {recording_budget.max_bytes} in total)")
+            cycle_recordings = [recordings[sid] for sid in mic_sids]
+            recordings = {}
+            analysis = asyncio.create_task(analysis_executor.run(
+                analyze_recordings,
+                [cycle_recordings],
+                speaker_offsets=speaker_offsets if len(speaker_offsets) > 1 else None,
+                precision=ANALYSIS_PRECISION,
+            ))
+            # The recordings are only needed until their analysis is done
+            analysis.add_done_callback(partial(release_recordings, lobby.lobby_id, cycle_recordings))
+            cycle_analyses.append(analysis)
+            if i < (lobby.repetitions - 1):
+                await asyncio.sleep(lobby.delay)
+
+        await sio.emit("end_measurement", {}, to=lobby.lobby_id)
+        try:
+            results: List[List[AcousticParameters]] = [
+                cycle_results[0] for cycle_results in await asyncio.gather(*cycle_analyses)
+            ]
+        except Exception as e:
+            logger.info("Error while analyzing mic data")
+            logger.info(e)
+            return
+    finally:
+        # Also runs when the controller is cancelled or aborts: analyses still running are stopped and the
+        # recordings of the current cycle released, recordings of finished cycles are released with their analysis
+        for analysis in cycle_analyses:
+            analysis.cancel()
+        release_recordings(lobby.lobby_id, list(recordings.values()))
 
-    await asyncio.sleep(2)
     logger.info(f"Lobby {lobby.lobby_id} measurement results")
 
     measurement = MeasurementDbModel(
         values=results,
         ownerToken=lobby.microphones[0].user_id,
         name="Measurement",
+        members=list(dict.fromkeys(user.user_id for user in [*lobby.microphones, *lobby.speakers])),
     )
 
     try:
@@ -89,12 +191,8 @@ async def measurement_controller(sio: AsyncServer, lobby: Lobby, ctx: DataContex
     except Exception as e:
         logger.error(e)
 
-    measurement = MeasurementDbModel(
-        values=results,
-        ownerToken=lobby.microphones[0].user_id,
-        name="Measurement",
-    )
-
+    # The clients got the impulse responses above, the document only references them
+    measurement.values = await store_impulse_responses(results, ctx)
     await ctx.measurements.save(measurement)
 
     for mic in lobby.microphones:
@@ -116,7 +214,8 @@ async def measurement_controller(sio: AsyncServer, lobby: Lobby, ctx: DataContex
 
 
     await sio.close_room(lobby.lobby_id)
-    lobbies.pop(lobby.lobby_id)
-    measurement_queues.pop(lobby.lobby_id)
+    await lobby_store.delete_lobby(lobby.lobby_id)
+    recording_buffers.pop(lobby.lobby_id, None)
+    recording_budget.drop(lobby.lobby_id)
     measurement_tasks.pop(lobby.lobby_id)
     logger.info(f"Lobby {lobby.lobby_id} ended measurement successfully")
\ No newline at end of file
@@ -0,0 +1,136 @@
+import base64
+import os
+import tempfile
+from pathlib import Path
+from typing import Literal
+
+import numpy as np
+from dotenv import dotenv_values
+
+from services.analysis_service import Recording
+
+SampleFormat = Literal["f32", "s16"]
+
+SAMPLE_WIDTHS: dict[SampleFormat, int] = {"f32": 4, "s16": 2}
+
+
+class RecordingBuffer:
+    """
+    Growing buffer for a recording that is streamed in chunks of raw little endian mono PCM.
+    Every chunk is decoded to float32 as soon as it arrives, so the finished recording needs no further decoding.
+    Chunks beyond max_seconds of audio are rejected with a ValueError.
+    """
+
+    def __init__(self, sample_rate: int, sample_format: SampleFormat = "f32", max_seconds: float = 60) -> None:
+        if sample_rate <= 0:
+            raise ValueError(f"Invalid sample rate {sample_rate}")
+
+        self.sample_rate = sample_rate
+        self.sample_format = sample_format
+        self.max_samples = int(max_seconds * sample_rate)
+        self._samples = bytearray()
+        self._pending = b""
+
+    def append(self, chunk: bytes) -> None:
+        # Chunks are not required to end on a sample boundary, the remainder is kept for the next one
+        data = self._pending + chunk
+        width = SAMPLE_WIDTHS[self.sample_format]
+        usable = len(data) - len(data) % width
+        self._pending = data[usable:]
+
+        if len(self) + usable // width > self.max_samples:
+            raise ValueError(f"Recording exceeds {self.max_samples} samples")
+
+        if self.sample_format == "s16":
+            samples = np.frombuffer(data[:usable], dtype="<i2").astype(np.float32) / 32768
+            self._samples += samples.astype("<f4").tobytes()
+        else:
+            self._samples += data[:usable]
+
+    def __len__(self) -> int:
+        return len(self._samples) // 4
+
+    def finish(self) -> tuple[bytes, int]:
+        """Returns the decoded recording as float32 PCM bytes together with its sample rate"""
+        return bytes(self._samples), self.sample_rate
+
+
+class RecordingBudget:
+    """
+    Accounts the bytes of recordings this process holds, per lobby, against a global budget.
+    Reservations that would exceed max_bytes are refused, the caller then spills or rejects the recording.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._held: dict[str, int] = {}
+
+    @property
+    def total(self) -> int:
+        return sum(self._held.values())
+
+    def held(self, lobby_id: str) -> int:
+        return self._held.get(lobby_id, 0)
+
+    def gauges(self) -> dict[str, int]:
+        """Bytes currently held per lobby"""
+        return dict(self._held)
+
+    def report(self) -> str:
+        """Total and per lobby usage, logged with every spilled or rejected recording"""
+        return f"{self.total} of {self.max_bytes} bytes held, per lobby {self.gauges()}"
+
+    def reserve(self, lobby_id: str, size: int) -> bool:
+        if self.total + size > self.max_bytes:
+            return False
+        self._held[lobby_id] = self.held(lobby_id) + size
+        return True
+
+    def release(self, lobby_id: str, size: int) -> None:
+        remaining = self.held(lobby_id) - size
+        if remaining > 0:
+            self._held[lobby_id] = remaining
+        else:
+            self._held.pop(lobby_id, None)
+
+    def drop(self, lobby_id: str) -> None:
+        self._held.pop(lobby_id, None)
+
+
+def recording_size(recording: Recording) -> int:
+    """Bytes a recording occupies in memory, spilled recordings occupy none"""
+    if isinstance(recording, tuple):
+        recording = recording[0]
+    return 0 if isinstance(recording, Path) else len(recording)
+
+
+def spill_recording(recording: Recording, directory: str | None = None) -> Recording:
+    """Writes a recording to a temporary file and returns a reference to it that analysis reads from"""
+    if isinstance(recording, tuple):
+        samples, sample_rate = recording
+        return (samples if isinstance(samples, Path) else write_spill_file(samples, directory)), sample_rate
+    if isinstance(recording, Path):
+        return recording
+    return write_spill_file(base64.b64decode(recording) if isinstance(recording, str) else recording, directory)
+
+
+def write_spill_file(data: bytes, directory: str | None) -> Path:
+    fd, name = tempfile.mkstemp(suffix=".rec", dir=directory)
+    with os.fdopen(fd, "wb") as file:
+        file.write(data)
+    return Path(name)
+
+
+def remove_spilled(recording: Recording) -> None:
+    path = recording[0] if isinstance(recording, tuple) else recording
+    if isinstance(path, Path):
+        path.unlink(missing_ok=True)
+
+
+config = dotenv_values(".env")
+
+# Recordings beyond the budget are written to SPILL_DIR (the system temp directory if empty) or rejected if spilling is off
+SPILL_RECORDINGS = config.get("MEASUREMENT_SPILL_RECORDINGS") != "false"
+SPILL_DIR = config.get("MEASUREMENT_SPILL_DIR") or None
+
+recording_budget = RecordingBudget(int(float(config.get("MEASUREMENT_MEMORY_BUDGET_MB") or 512) * 1024 * 1024))
@@ -0,0 +1,146 @@
+import pyroomacoustics as pra
+import numpy as np
+import logging
+from typing import Any, Literal
+from models import AcousticParameters
+from models.material import MaterialAbsorptionResult
+from services.analysis_service import get_filter_bank, calculate_acoustic_parameters
+
+logger = logging.getLogger("uvicorn.info")
+
+SimulationQuality = Literal["draft", "standard", "high"]
+
+SPEED_OF_SOUND = 343.0
+
+
+def estimate_reverberation_time(room_dim: list[float], materials: dict[str, MaterialAbsorptionResult]) -> float:
+    """
+    Sabine estimate of the rt60 from room volume and area weighted mean absorption.
+    """
+    width, depth, height = room_dim
+    wall_areas = {
+        "east": depth * height,
+        "west": depth * height,
+        "north": width * height,
+        "south": width * height,
+        "ceiling": width * depth,
+        "floor": width * depth,
+    }
+    surface = sum(wall_areas.values())
+    absorption = sum(
+        area * float(np.mean(materials[wall].coeffs)) for wall, area in wall_areas.items() if wall in materials
+    )
+    mean_absorption = max(absorption / surface, 0.01)
+    return 0.161 * width * depth * height / (surface * mean_absorption)
+
+
+def choose_simulation_parameters(
+    quality: SimulationQuality,
+    room_dim: list[float],
+    materials: dict[str, MaterialAbsorptionResult],
+) -> dict[str, Any]:
+    """
+    Picks image source order, ray tracing, sample rate and rir length from the quality profile and the room.
+    draft: low order image sources and ray tracing for the tail at 16kHz with a short rir, fast enough for interactive editing.
+    Without ray tracing the few image sources would decay far quicker than the room does.
+    standard: image sources up to order 10, ray tracing for the late tail of reverberant rooms
+    and of rooms too large for order 10 to reach 100ms.
+    high: hybrid image sources for the early part and ray tracing with air absorption for the tail.
+    """
+    width, depth, height = room_dim
+    volume = width * depth * height
+    surface = 2 * (width * depth + width * height + depth * height)
+    mean_free_path = 4 * volume / surface
+    rt60 = estimate_reverberation_time(room_dim, materials)
+
+    def order_for(duration: float, lowest: int, highest: int) -> int:
+        # Number of reflections a ray travels through on average in the given time
+        return int(np.clip(round(SPEED_OF_SOUND * duration / mean_free_path), lowest, highest))
+
+    if quality == "draft":
+        sample_rate, max_order, ray_tracing = 16000, order_for(0.05, 1, 3), True
+        rir_seconds = float(np.clip(rt60, 0.2, 1.0))
+    elif quality == "high":
+        sample_rate, max_order, ray_tracing = 48000, order_for(0.08, 3, 8), True
+        rir_seconds = float(np.clip(2 * rt60, 0.5, 6.0))
+    else:
+        sample_rate, max_order = 48000, order_for(0.1, 3, 10)
+        # Below order 10 the image sources stop short of 100ms, however damped the room is, ray tracing fills the tail
+        ray_tracing = rt60 > 1.0 or max_order < 10
+        rir_seconds = float(np.clip(1.5 * rt60, 0.3, 3.0))
+
+    return {
+        "quality": quality,
+        "sample_rate": sample_rate,
+        "max_order": max_order,
+        "ray_tracing": ray_tracing,
+        "air_absorption": quality == "high",
+        "rir_length": int(rir_seconds * sample_rate),
+    }
+
+
+def run_room_simulation(
+    room_dim: list[float],
+    materials: dict[str, MaterialAbsorptionResult],
+    speakers: list[list[float]],
+    microphones: list[list[float]],
+    sample_rate: int = 48000,
+    max_order: int = 10,
+    ray_tracing: bool = False,
+    air_absorption: bool = False,
+    rir_length: int | None = None,
+    quality: SimulationQuality | None = None,
+) -> list[list[AcousticParameters]]:
+    """
+    Simulates the room with the image source method, optionally combined with ray tracing for the late tail,
+    and analyzes every mic/speaker rir cut to rir_length samples.
+    Takes the output of choose_simulation_parameters as keyword arguments.
+    Blocking, self contained so it can run in a worker process.
+    """
+    room = pra.ShoeBox(
+        room_dim,
+        fs=sample_rate,
+        materials={
+            wall: pra.Material(
+                energy_absorption={
+                    "coeffs": material.coeffs,
+                    "center_freqs": material.center_freqs,
+                }
+            )
+            for wall, material in materials.items()
+        },
+        max_order=max_order,
+        ray_tracing=ray_tracing,
+        air_absorption=air_absorption,
+    )
+
+    for source_pos in speakers:
+        room.add_source(source_pos)
+
+    mic_positions = np.array(
+        [
+            [m[0] for m in microphones],
+            [m[1] for m in microphones],
+            [m[2] for m in microphones],
+        ]
+    )
+
+    room.add_microphone_array(pra.MicrophoneArray(mic_positions, fs=sample_rate))
+
+    room.compute_rir()
+    if room.rir is None:
+        raise RuntimeError(
+            "The room could not be simulated, the setup may be invalid."
+        )
+    results = []
+    bank = get_filter_bank(sample_rate)
+    for mic_rirs in room.rir:
+        results_mic = []
+        for rir in mic_rirs:
+            if rir_length is not None:
+                rir = rir[:rir_length]
+            mic_results = calculate_acoustic_parameters(rir, sample_rate, bank.center_freqs, bank.filters)
+            results_mic.append(mic_results)
+        results.append(results_mic)
+
+    return results
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, List
+
+from dotenv import dotenv_values
+
+from database.engine import DataContext
+from database.schemas.simulation_cache_db import SimulationCacheDbModel
+from models import AcousticParameters
+from models.material import MaterialAbsorptionResult
+from models.scene import RoomScene
+from services.cache_service import LruCache
+from services.impulse_response_service import delete_impulse_responses, load_impulse_responses, store_impulse_responses
+
+logger = logging.getLogger("uvicorn.info")
+
+
+def compute_scene_hash(
+    room_scene: RoomScene,
+    materials: dict[str, MaterialAbsorptionResult],
+    parameters: dict[str, Any],
+) -> str:
+    """
+    Canonical hash over everything a simulation result depends on:
+    the scene geometry, the resolved material coefficients and the simulation parameters.
+    Room id and material names are left out, so identical scenes of different rooms share a hash.
+    """
+    canonical = {
+        "scene": room_scene.model_dump(include=set(RoomScene.model_fields) - {"materials"}),
+        "materials": {
+            wall: {"coeffs": material.coeffs, "center_freqs": material.center_freqs}
+            for wall, material in materials.items()
+        },
+        "parameters": parameters,
+    }
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class SimulationCache:
+    """
+    Two tier cache of simulation results keyed by scene hash.
+    Results are looked up in an in-process LRU first and in the simulation_cache collection second.
+    Both tiers only hold the parameters and the irId of every impulse response, the samples are loaded on every hit.
+    A scene hash always stands for the same result, so entries are never invalidated, they expire ttl seconds after they were put.
+    """
+
+    def __init__(self, maxsize: int, ttl: int) -> None:
+        self.ttl = ttl
+        self.memory: LruCache[str, List[List[AcousticParameters]]] = LruCache(maxsize, ttl)
+
+    async def create_indexes(self, db: DataContext) -> None:
+        """Creates the indexes that find and expire cached results, existing indexes are left as they are"""
+        await db.simulation_cache.get_collection().create_index("scene_hash")
+        await db.simulation_cache.get_collection().create_index("created_at", expireAfterSeconds=self.ttl)
+        await db.impulse_responses.get_collection().create_index("expires_at", expireAfterSeconds=0)
+
+    async def get(self, scene_hash: str, db: DataContext) -> List[List[AcousticParameters]] | None:
+        references = self.memory.get(scene_hash)
+        if references is not None:
+            values = await load_impulse_responses(references, db)
+            # Another worker may have replaced the entry and deleted the impulse responses this one references
+            if all(param.ir or param.irId is None for cycle in values for param in cycle):
+                return values
+            self.memory.pop(scene_hash)
+
+        cached = await db.simulation_cache.find_one_by({"scene_hash": scene_hash})
+        if cached is None:
+            return None
+
+        self.memory.put(scene_hash, cached.values)
+        return await load_impulse_responses(cached.values, db)
+
+    async def put(self, scene_hash: str, values: List[List[AcousticParameters]], db: DataContext) -> None:
+        entry = SimulationCacheDbModel(scene_hash=scene_hash, values=[])
+        # The impulse responses outlive the entry a little, so a lookup just before it expires can still load them
+        expires_at = entry.created_at + timedelta(seconds=self.ttl) + IMPULSE_RESPONSE_GRACE
+        entry.values = await store_impulse_responses(values, db, expires_at)
+        document = db.simulation_cache.to_document(entry)
+        document.pop("_id", None)
+        replaced = await db.simulation_cache.get_collection().find_one_and_update(
+            {"scene_hash": scene_hash}, {"$set": document}, upsert=True
+        )
+        self.memory.put(scene_hash, entry.values)
+        # A concurrent simulation of the same scene may have stored its result first
+        if replaced is not None:
+            await delete_impulse_responses(db.simulation_cache.to_model(replaced).values, db)
+
+
+IMPULSE_RESPONSE_GRACE = timedelta(hours=1)
+
+config = dotenv_values(".env")
+
+simulation_cache = SimulationCache(
+    maxsize=int(config.get("SIMULATION_CACHE_SIZE") or 32),
+    ttl=int(config.get("SIMULATION_CACHE_TTL") or 7 * 24 * 60 * 60),
+)
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable
+
+from bson import ObjectId
+
+from api.models.room_scene import RestRoomScene
+from api.models.simulation import SimulationJob
+from database.engine import DataContext
+from database.schemas.simulation_job_db import SimulationJobDbModel
+from services.mapper_service import map_simulation_job_db_to_simulation_job
+from services.room_acoustics_service import SimulationQuality
+from services.simulation_service import simulate_and_store_room
+
+# The tasks only live in the worker running them, status and owner are kept in the simulation_jobs collection
+simulation_tasks: dict[str, asyncio.Task] = {} # type: ignore
+# Called with the user token and the finished job, registered by the socket layer
+simulation_done_listeners: list[Callable[[str, dict[str, Any]], Awaitable[None]]] = []
+
+logger = logging.getLogger("uvicorn.info")
+
+# Jobs stay queryable for this long after their last status change, then the TTL index removes them
+JOB_RETENTION = timedelta(minutes=30)
+
+
+async def start_simulation_job(room_scene: RestRoomScene, token: str, ctx: DataContext, quality: SimulationQuality = "standard") -> SimulationJob:
+    """
+    Enqueues the simulation of a room and returns the job immediately.
+    The result is written to the room and announced to all simulation_done listeners.
+    """
+    job_db = SimulationJobDbModel(
+        roomId=room_scene.roomId,
+        ownerToken=token,
+        quality=quality,
+        expires_at=datetime.now() + JOB_RETENTION,
+    )
+    await ctx.simulation_jobs.save(job_db)
+
+    job = map_simulation_job_db_to_simulation_job(job_db)
+    simulation_tasks[job.jobId] = asyncio.create_task(run_simulation_job(job, room_scene, token, ctx))
+    logger.info(f"Queued simulation job {job.jobId} for room {job.roomId}")
+    return job
+
+
+async def find_simulation_job(job_id: str, token: str, ctx: DataContext) -> SimulationJob | None:
+    """
+    Returns the job if it was started with the given token, no matter which worker runs it.
+    """
+    if not ObjectId.is_valid(job_id):
+        return None
+    job_db = await ctx.simulation_jobs.find_one_by({"_id": ObjectId(job_id), "ownerToken": token})
+    return map_simulation_job_db_to_simulation_job(job_db) if job_db is not None else None
+
+
+async def update_simulation_job(job: SimulationJob, ctx: DataContext) -> None:
+    """
+    Writes the status of the job and keeps it for another retention time.
+    """
+    await ctx.simulation_jobs.get_collection().update_one(
+        {"_id": ObjectId(job.jobId)},
+        {"$set": {"status": job.status, "error": job.error, "expires_at": datetime.now() + JOB_RETENTION}},
+    )
+
+
+async def run_simulation_job(job: SimulationJob, room_scene: RestRoomScene, token: str, ctx: DataContext) -> None:
+    async def start() -> None:
+        job.status = "running"
+        await update_simulation_job(job, ctx)
+
+    try:
+        # The job stays queued while it waits for the simulation executor
+        await simulate_and_store_room(room_scene, ctx, job.quality, start)
+        job.status = "done"
+    except Exception as e:
+        logger.error(f"Simulation job {job.jobId} failed: {e}")
+        job.status = "failed"
+        job.error = str(e) or type(e).__name__
+    finally:
+        simulation_tasks.pop(job.jobId, None)
+
+    try:
+        await update_simulation_job(job, ctx)
+    except Exception as e:
+        logger.error(f"Status of simulation job {job.jobId} could not be stored: {e}")
+
+    for listener in simulation_done_listeners:
+        try:
+            await listener(token, job.model_dump())
+        except Exception as e:
+            logger.error(e)
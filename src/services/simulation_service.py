@@ -1,67 +1,93 @@
+from typing import Awaitable, Callable, List
+
 from api.models.room_scene import RestRoomScene
 from api.models.simulation import Simulation
 from database.engine import DataContext
-import pyroomacoustics as pra
-import numpy as np
 import logging
+from models import AcousticParameters
 from services import get_material
-from services.analysis_service import get_octave_band_filters, calculate_acoustic_parameters
+from services.auth_service import HttpObjectId
+from services.executor_service import simulation_executor
+from services.impulse_response_service import delete_impulse_responses, store_impulse_responses
+from services.room_acoustics_service import SimulationQuality, choose_simulation_parameters, run_room_simulation
+from services.simulation_cache_service import compute_scene_hash, simulation_cache
 
 logger = logging.getLogger("uvicorn.info")
 
 async def simulate_room(
-    room_scene: RestRoomScene, db: DataContext
+    room_scene: RestRoomScene, db: DataContext, quality: SimulationQuality = "standard"
 ) -> Simulation | None:
+    values, _ = await simulate_scene(room_scene, db, quality)
+    return Simulation(roomId=room_scene.roomId, values=values, quality=quality)
+
+
+async def simulate_scene(
+    room_scene: RestRoomScene,
+    db: DataContext,
+    quality: SimulationQuality = "standard",
+    on_start: Callable[[], Awaitable[None]] | None = None,
+) -> tuple[List[List[AcousticParameters]], str]:
+    """
+    Simulates the scene with the given quality profile and returns the results together with the scene hash.
+    The profile is part of the simulation parameters, so results of different profiles are cached apart.
+    Unchanged scenes are served from the simulation cache.
+    on_start is awaited once the simulation leaves the executor queue, it is not called for cached results.
+    """
     # Materialien für alle Wände laden
-    materials = {}
-    for wall in ["east", "west", "north", "south", "ceiling", "floor"]:
-        material_name = getattr(room_scene.materials, wall)
-        material_data = await get_material.get_material_absorption(material_name, db)
-        materials[wall] = pra.Material(
-            energy_absorption={
-                "coeffs": material_data.coeffs,
-                "center_freqs": material_data.center_freqs,
-            }
-        )
+    walls = ["east", "west", "north", "south", "ceiling", "floor"]
+    material_names = [getattr(room_scene.materials, wall) for wall in walls]
+    materials = dict(zip(walls, await get_material.get_materials(material_names, db)))
 
     room_dim = [
         room_scene.dimensions.width,
         room_scene.dimensions.depth,
         room_scene.dimensions.height,
     ]  # Breite, Tiefe, Höhe
-    sample_rate = 48000
-    room = pra.ShoeBox(
-        room_dim, fs=sample_rate, materials=materials, max_order=10
-    )  # Standardabsorption mit genauen Materialien ersetzen
+    parameters = choose_simulation_parameters(quality, room_dim, materials)
+    scene_hash = compute_scene_hash(room_scene, materials, parameters)
+    cached = await simulation_cache.get(scene_hash, db)
+    if cached is not None:
+        logger.info(f"Simulation of room {room_scene.roomId} served from cache")
+        return cached, scene_hash
 
-    for speaker in room_scene.speakers:
-        source_pos = [speaker.x, speaker.y, speaker.z]
-        room.add_source(source_pos)
+    speakers = [[s.x, s.y, s.z] for s in room_scene.speakers]
+    microphones = [[m.x, m.y, m.z] for m in room_scene.microphones]
 
-    mic_positions = np.array(
-        [
-            [m.x for m in room_scene.microphones],
-            [m.y for m in room_scene.microphones],
-            [m.z for m in room_scene.microphones],
-        ]
+    # Die Simulation blockiert für Sekunden und läuft deshalb im Prozesspool
+    results = await simulation_executor.run_and_notify(
+        on_start,
+        run_room_simulation, room_dim, materials, speakers, microphones, **parameters
     )
 
-    room.add_microphone_array(pra.MicrophoneArray(mic_positions, fs=sample_rate))
+    await simulation_cache.put(scene_hash, results, db)
+    return results, scene_hash
+
+
+async def simulate_and_store_room(
+    room_scene: RestRoomScene,
+    db: DataContext,
+    quality: SimulationQuality = "standard",
+    on_start: Callable[[], Awaitable[None]] | None = None,
+) -> Simulation:
+    """
+    Simulates the scene and writes the result, its scene hash and quality profile to the room.
+    The returned result carries the impulse responses together with the irId they are stored under.
+    """
+    values, scene_hash = await simulate_scene(room_scene, db, quality, on_start)
 
-    room.compute_rir()
-    if room.rir is None:
-        raise RuntimeError(
-            "Raum konnte nicht simmuliert werden – eventuell ist das Setup fehlerhaft."
-        )
-    results = []
-    center_freqs, filters = get_octave_band_filters(sample_rate)
-    for mic_index, mic_rirs in enumerate(room.rir):
-        results_mic = []
-        for source_index, rir in enumerate(mic_rirs):
-            mic_results = calculate_acoustic_parameters(rir, sample_rate, center_freqs, filters)
-            results_mic.append(mic_results)
-        results.append(results_mic)
-            # rir ist Impulsantwort die weiterverarbeitet werden muss
-            # Verarbeiten der Impulsantwort einfügen
+    room = await db.rooms.find_one_by_id(HttpObjectId(room_scene.roomId))
+    if not room:
+        raise LookupError("Room not found")
+    # The previous impulse responses are only deleted once the room no longer references them
+    previous = room.simulation
+    stored = await store_impulse_responses(values, db)
+    room.simulation = stored
+    room.simulation_hash = scene_hash
+    room.simulation_quality = quality
+    await db.rooms.save(room)
+    await delete_impulse_responses(previous, db)
 
-    return Simulation(roomId=room_scene.roomId,values=results)
+    return Simulation(roomId=room_scene.roomId, values=[
+        [stored_param.model_copy(update={"ir": param.ir}) for stored_param, param in zip(stored_cycle, cycle)]
+        for stored_cycle, cycle in zip(stored, values)
+    ], quality=quality)
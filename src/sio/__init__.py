@@ -1 +0,0 @@
-from .socketio_server import sio_app
@@ -5,18 +5,24 @@ from pydantic import BaseModel, ValidationError
 from socketio import AsyncServer
 from typing import cast
 
-from services.measurement_service import lobbies, measurement_tasks, id_map
+from services.lobby_store import lobby_store
+from services.measurement_service import id_map
 from sio.models import Lobby, LobbyClient, SocketSession
 
 logger = logging.getLogger("uvicorn.info")
 
+def remove_client(sid: str, lobby: Lobby) -> None:
+    """Removes the client from the microphones and speakers of the lobby"""
+    lobby.microphones = list(filter(lambda m: m.sid != sid, lobby.microphones))
+    lobby.speakers = list(filter(lambda s: s.sid != sid, lobby.speakers))
+
 def register_lobby_events(sio: AsyncServer) -> None:
 
     @sio.event # type: ignore
     async def create_lobby(sid: str, _: None) -> None:
         lobby_id = str(uuid.uuid4())
         client = LobbyClient(sid=sid, index=0, user_id=id_map[sid])
-        lobbies[lobby_id] = Lobby(host=sid, lobby_id=lobby_id, microphones=[client], speakers=[], repetitions=1, delay=0, distances={})
+        await lobby_store.save_lobby(Lobby(host=sid, lobby_id=lobby_id, microphones=[client], speakers=[], repetitions=1, delay=0, distances={}))
         await sio.save_session(sid, SocketSession(lobby=lobby_id, isHost=True))
         await sio.enter_room(sid, lobby_id)
         await sio.emit("create_lobby_res", {"lobbyId": lobby_id}, to=lobby_id)
@@ -34,35 +40,41 @@ def register_lobby_events(sio: AsyncServer) -> None:
             logger.error(e)
             return
 
-        if not data.lobbyId in lobbies:
-            await sio.emit("join_lobby_fail", {"reason": "Lobby not found"} ,to=sid)
+        if await lobby_store.is_running(data.lobbyId):
+            await sio.emit("join_lobby_fail", {"reason": "Lobby already running measurement"}, to=sid)
             return
 
-        if data.lobbyId in measurement_tasks:
-            await sio.emit("join_lobby_fail", {"reason": "Lobby already running measurement"}, to=sid)
+        user_id = id_map[sid]
+
+        def join(lobby: Lobby) -> None:
+            # Speakers are filled up to the number of microphones first
+            if len(lobby.speakers) < len(lobby.microphones):
+                lobby.speakers.append(LobbyClient(sid=sid, index=len(lobby.speakers), user_id=user_id))
+            else:
+                lobby.microphones.append(LobbyClient(sid=sid, index=len(lobby.microphones), user_id=user_id))
+
+        lobby = await lobby_store.update_lobby(data.lobbyId, join)
+        if lobby is None:
+            await sio.emit("join_lobby_fail", {"reason": "Lobby not found"} ,to=sid)
             return
 
         await sio.save_session(sid, SocketSession(lobby=data.lobbyId, isHost=False))
         await sio.enter_room(sid, data.lobbyId)
-        if len(lobbies[data.lobbyId].speakers) < len(lobbies[data.lobbyId].microphones):
-            index = len(lobbies[data.lobbyId].speakers)
-            client = LobbyClient(sid=sid, index=index, user_id=id_map[sid])
-            lobbies[data.lobbyId].speakers.append(client)
+        speaker = next((s for s in lobby.speakers if s.sid == sid), None)
+        if speaker is not None:
             await sio.emit("join_lobby_success", {
                 "deviceType": "speaker",
-                "index": index
+                "index": speaker.index
             },  to=sid)
         else:
-            index = len(lobbies[data.lobbyId].microphones)
-            client = LobbyClient(sid=sid, index=index, user_id=id_map[sid])
-            lobbies[data.lobbyId].microphones.append(client)
+            microphone = next(m for m in lobby.microphones if m.sid == sid)
             await sio.emit("join_lobby_success", {
                 "deviceType": "microphone",
-                "index": index,
+                "index": microphone.index,
             }, to=sid)
 
-        mics = list(map(lambda m: m.index, lobbies[data.lobbyId].microphones))
-        speakers = list(map(lambda s: s.index, lobbies[data.lobbyId].speakers))
+        mics = list(map(lambda m: m.index, lobby.microphones))
+        speakers = list(map(lambda s: s.index, lobby.speakers))
         logger.info(f"Client {sid} joined lobby {data.lobbyId}")
 
         await sio.emit("device_choices", {
@@ -89,18 +101,22 @@ def register_lobby_events(sio: AsyncServer) -> None:
         if not hasattr(session, "lobby"):
             return
 
-        if session.lobby in measurement_tasks:
+        if await lobby_store.is_running(session.lobby):
             await sio.emit("cancel_measurement", {"reason": "Lobby already running measurement"}, to=sid)
             return
 
-        lobby = lobbies[session.lobby]
-        lobby.microphones = list(filter(lambda m: m.sid != sid, lobby.microphones))
-        lobby.speakers = list(filter(lambda s: s.sid != sid, lobby.speakers))
+        client = LobbyClient(sid=sid, index=data.index, user_id=id_map[sid])
 
-        if data.device == "speaker":
-            lobby.speakers.append(LobbyClient(sid=sid, index=data.index, user_id=id_map[sid]))
-        else:
-            lobby.microphones.append(LobbyClient(sid=sid, index=data.index, user_id=id_map[sid]))
+        def choose(lobby: Lobby) -> None:
+            remove_client(sid, lobby)
+            if data.device == "speaker":
+                lobby.speakers.append(client)
+            else:
+                lobby.microphones.append(client)
+
+        lobby = await lobby_store.update_lobby(session.lobby, choose)
+        if lobby is None:
+            return
 
         mics = list(map(lambda m: m.index, lobby.microphones))
         speakers = list(map(lambda s: s.index, lobby.speakers))
@@ -1,22 +1,32 @@
 import logging
 
-from pydantic import BaseModel, ValidationError
+from pydantic import BaseModel, Field, ValidationError
 from socketio import AsyncServer
-from typing import cast, Dict
+from typing import cast, Dict, Optional
 import asyncio
 
 from database.engine import get_db
-from services.measurement_service import measurement_controller, lobbies, measurement_tasks, measurement_queues
-from sio.models import SocketSession, RecordData
+from services.lobby_store import lobby_store
+from services.measurement_service import measurement_controller, measurement_tasks, recording_buffers, MAX_RECORDING_SECONDS
+from services.recording_service import RecordingBuffer, SampleFormat, SAMPLE_WIDTHS, recording_budget
+from sio.models import Lobby, SocketSession, RecordData
 
 logger = logging.getLogger("uvicorn.info")
 
+async def is_recording_microphone(lobby_id: str, sid: str) -> bool:
+    """Whether the lobby runs a measurement and sid is one of its microphones"""
+    if not await lobby_store.is_running(lobby_id):
+        return False
+    lobby = await lobby_store.get_lobby(lobby_id)
+    return lobby is not None and any(mic.sid == sid for mic in lobby.microphones)
+
 def register_measurement_events(sio: AsyncServer) -> None:
 
     class StartMeasurementProps(BaseModel):
         repetitions: int
         delay: float
         distances: Dict[int, Dict[int, float]]
+        sweepOffset: Optional[float] = Field(default=None, gt=0)
 
     @sio.event # type: ignore
     async def start_measurement(sid: str, data: StartMeasurementProps) -> None:
@@ -27,36 +37,44 @@ def register_measurement_events(sio: AsyncServer) -> None:
             return
 
         session = cast(SocketSession, await sio.get_session(sid))
-        if not hasattr(session, "isHost") or not session.isHost or session.lobby in measurement_tasks.keys():
+        if not hasattr(session, "isHost") or not session.isHost or await lobby_store.is_running(session.lobby):
             return
 
-        lobbies[session.lobby].repetitions = data.repetitions
-        lobbies[session.lobby].delay = data.delay
-        lobbies[session.lobby].distances = data.distances
+        def configure(lobby: Lobby) -> None:
+            lobby.repetitions = data.repetitions
+            lobby.delay = data.delay
+            lobby.distances = data.distances
+            lobby.sweep_offset = data.sweepOffset
+
+        lobby = await lobby_store.update_lobby(session.lobby, configure)
+        if lobby is None:
+            return
 
-        mic_indices = {c.index for c in lobbies[session.lobby].microphones}
-        speaker_indices = {c.index for c in lobbies[session.lobby].speakers}
+        mic_indices = {c.index for c in lobby.microphones}
+        speaker_indices = {c.index for c in lobby.speakers}
 
         if not set(mic_indices) == (set(range(len(mic_indices)))) or not set(speaker_indices) == (set(range(len(speaker_indices)))):
             await sio.emit("start_measurement_fail", {"reason": "Some indices are not filled."}, to=session.lobby)
             return
 
-        if len(lobbies[session.lobby].speakers) == 0:
+        if len(lobby.speakers) == 0:
             await sio.emit("start_measurement_fail", {"reason": "Not enough speakers!"}, to=session.lobby)
             return
-        elif len(lobbies[session.lobby].microphones) == 0:
+        elif len(lobby.microphones) == 0:
             await sio.emit("start_measurement_fail", {"reason": "Not enough microphones!"}, to=session.lobby)
             return
 
+        await lobby_store.set_running(session.lobby, True)
         ctx = next(get_db())
-        task = asyncio.create_task(measurement_controller(sio, lobby=lobbies[session.lobby], ctx=ctx))
+        task = asyncio.create_task(measurement_controller(sio, lobby=lobby, ctx=ctx))
         measurement_tasks[session.lobby] = task
         logger.info(f"Started measurement for lobby {session.lobby}")
 
 
 
     class SendRecordEventData(BaseModel):
-        recording: str
+        # Audio file as binary attachment, base64 strings are still accepted from older clients
+        recording: str | bytes
 
     @sio.event # type: ignore
     async def send_record_data(sid: str, data: SendRecordEventData) -> None:
@@ -67,5 +85,77 @@ def register_measurement_events(sio: AsyncServer) -> None:
             return
 
         session = cast(SocketSession, await sio.get_session(sid))
-        await measurement_queues[session.lobby].put(RecordData(sid=sid, recording=data.recording))
-        logger.info(f"Microphone data from {sid} arrived for lobby {session.lobby}")
\ No newline at end of file
+        if not await is_recording_microphone(session.lobby, sid):
+            return
+
+        if not await lobby_store.put_recording(session.lobby, RecordData(sid=sid, recording=data.recording)):
+            logger.info(f"Rejected microphone data from {sid}, lobby {session.lobby} has no room for more pending recordings: {recording_budget.report()}")
+            await sio.emit("record_fail", {"reason": "The server has no room left for the recording"}, to=sid)
+            return
+        logger.info(f"Microphone data from {sid} arrived for lobby {session.lobby}")
+
+
+    class RecordChunkEventData(BaseModel):
+        # Raw little endian mono PCM, streamed while the microphone is recording
+        chunk: bytes
+        sampleRate: int
+        format: SampleFormat = "f32"
+
+    @sio.event # type: ignore
+    async def record_chunk(sid: str, data: RecordChunkEventData) -> None:
+        try:
+            data = RecordChunkEventData.model_validate(data)
+        except ValidationError as e:
+            logger.error(e)
+            return
+
+        session = cast(SocketSession, await sio.get_session(sid))
+        # Chunks are buffered in the process the microphone is connected to, only the finished recording is shared
+        buffers = recording_buffers.setdefault(session.lobby, {})
+        if sid in buffers:
+            # A dropped stream stays dropped until record_end, later chunks must not start a truncated recording
+            if buffers[sid] is None:
+                return
+        elif not await is_recording_microphone(session.lobby, sid):
+            return
+
+        # Chunks are held as float32, s16 chunks double in size
+        size = len(data.chunk) * 4 // SAMPLE_WIDTHS[data.format]
+        reserved = 0
+        try:
+            buffer = buffers.get(sid)
+            if buffer is None:
+                buffer = buffers[sid] = RecordingBuffer(data.sampleRate, data.format, MAX_RECORDING_SECONDS)
+            if not recording_budget.reserve(session.lobby, size):
+                raise ValueError("Recording memory budget exceeded")
+            reserved = size
+            buffer.append(data.chunk)
+        except ValueError as e:
+            logger.error(f"Dropping recording stream of {sid}: {e}, {recording_budget.report()}")
+            dropped = buffers.get(sid)
+            buffers[sid] = None
+            recording_budget.release(session.lobby, (len(dropped) * 4 if dropped is not None else 0) + reserved)
+            await sio.emit("record_fail", {"reason": str(e)}, to=sid)
+
+    @sio.event # type: ignore
+    async def record_end(sid: str) -> None:
+        session = cast(SocketSession, await sio.get_session(sid))
+        buffers = recording_buffers.get(session.lobby)
+        if buffers is None or sid not in buffers:
+            return
+
+        buffer = buffers.pop(sid)
+        if not buffers:
+            recording_buffers.pop(session.lobby, None)
+        if buffer is None:
+            # Nothing is sent for a dropped stream, the controller aborts once the recording does not arrive
+            logger.info(f"Streamed microphone data from {sid} ended after it was dropped")
+            return
+        samples, sample_rate = buffer.finish()
+        # The recording now belongs to the lobby store, which accounts for it while it is pending
+        recording_budget.release(session.lobby, len(samples))
+        if not await lobby_store.put_recording(session.lobby, RecordData(sid=sid, recording=samples, sample_rate=sample_rate)):
+            logger.info(f"Rejected streamed data from {sid}, lobby {session.lobby} has no room for more pending recordings: {recording_budget.report()}")
+            await sio.emit("record_fail", {"reason": "The server has no room left for the recording"}, to=sid)
+            return
+        logger.info(f"Streamed microphone data from {sid} finished for lobby {session.lobby}")
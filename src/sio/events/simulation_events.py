@@ -0,0 +1,17 @@
+import logging
+
+from socketio import AsyncServer
+from typing import Any
+
+from services.simulation_job_service import simulation_done_listeners
+
+logger = logging.getLogger("uvicorn.info")
+
+def register_simulation_events(sio: AsyncServer) -> None:
+
+    async def simulation_done(token: str, job: dict[str, Any]) -> None:
+        # Every socket is in a room named after its user, see connect
+        await sio.emit("simulation_done", job, to=token)
+        logger.info(f"Simulation job {job['jobId']} finished with status {job['status']}")
+
+    simulation_done_listeners.append(simulation_done)
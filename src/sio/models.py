@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 
 class LobbyClient(BaseModel):
@@ -16,6 +16,7 @@ class Lobby(BaseModel):
     repetitions: int
     delay: float
     distances: dict[int, dict[int, float]]
+    sweep_offset: Optional[float] = None  # seconds between staggered speaker sweeps, None plays the speakers one after another
 
 
 class SocketSession(BaseModel):
@@ -24,4 +25,5 @@ class SocketSession(BaseModel):
 
 class RecordData(BaseModel):
     sid: str
-    recording: str
\ No newline at end of file
+    recording: str | bytes  # binary socket.io attachment or legacy base64 string
+    sample_rate: Optional[int] = None  # set for streamed recordings, recording then holds float32 PCM samples
\ No newline at end of file
@@ -1,16 +1,25 @@
 import logging
+from functools import partial
 
 import socketio
 from bson import ObjectId
+from dotenv import dotenv_values
 
-from services.measurement_service import measurement_tasks, lobbies, measurement_queues, id_map
-from .events.lobby_events import register_lobby_events
+from services.lobby_store import lobby_store
+from services.measurement_service import measurement_tasks, recording_buffers, id_map
+from services.recording_service import recording_budget
+from .events.lobby_events import register_lobby_events, remove_client
 from .events.measurement_events import register_measurement_events
+from .events.simulation_events import register_simulation_events
 from typing import cast
 
 from .models import SocketSession
 
-sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*', max_http_buffer_size=5*1024*1024)
+# With redis, emits and rooms reach the clients of every server process
+redis_url = dotenv_values(".env").get("REDIS_URL")
+client_manager = socketio.AsyncRedisManager(redis_url) if redis_url else None
+
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*', max_http_buffer_size=5*1024*1024, client_manager=client_manager)
 app = socketio.ASGIApp(sio, static_files=None)
 
 logger = logging.getLogger("uvicorn.info")
@@ -28,6 +37,8 @@ async def connect(sid, environ, auth) -> None:
         await sio.disconnect(sid)
         return
     id_map[sid] = token
+    # Lets user wide events like simulation_done reach all sockets of the user
+    await sio.enter_room(sid, token)
     logger.info(f"Connected {sid} with user_id {token}")
 
 @sio.event # type: ignore
@@ -38,27 +49,26 @@ async def disconnect(sid, reason) -> None:
         del id_map[sid]
 
     if hasattr(session, 'lobby'):
-        if session.lobby in measurement_tasks.keys():
-            measurement_tasks[session.lobby].cancel()
-            measurement_tasks.pop(session.lobby)
+        if await lobby_store.is_running(session.lobby):
+            # The controller may run in another process, it stops once it sees the lobby is gone
+            if session.lobby in measurement_tasks:
+                measurement_tasks.pop(session.lobby).cancel()
+            recording_buffers.pop(session.lobby, None)
+            recording_budget.drop(session.lobby)
 
             await sio.emit("cancel_measurement", {"reason": "A client has disconnected"
             }, to=session.lobby)
-            lobbies.pop(session.lobby)
-            measurement_queues.pop(session.lobby)
+            await lobby_store.delete_lobby(session.lobby)
             await sio.close_room(session.lobby)
             logger.info(f"Interrupted measurement of lobby {session.lobby} because {sid} disconnected")
 
-        elif session.lobby in lobbies:
-            lobby = lobbies[session.lobby]
-            lobby.microphones = list(filter(lambda m: m.sid != sid, lobby.microphones))
-            lobby.speakers = list(filter(lambda s: s.sid != sid, lobby.speakers))
+        elif (lobby := await lobby_store.update_lobby(session.lobby, partial(remove_client, sid))) is not None:
 
             if session.isHost:
                 await sio.emit("cancel_measurement", {"reason": "The host has disconnected"
                                                       }, to=session.lobby)
                 await sio.close_room(session.lobby)
-                lobbies.pop(session.lobby)
+                await lobby_store.delete_lobby(session.lobby)
                 logger.info(f"Host {sid} disconnected from lobby {session.lobby}, lobby closed")
 
             mics = list(map(lambda m: m.index, lobby.microphones))
@@ -72,5 +82,6 @@ async def disconnect(sid, reason) -> None:
 
 register_lobby_events(sio)
 register_measurement_events(sio)
+register_simulation_events(sio)
 
 sio_app = app
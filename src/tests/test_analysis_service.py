@@ -0,0 +1,373 @@
+import base64
+import io
+import tracemalloc
+from typing import Callable, Sequence
+
+import numpy as np
+import soundfile as sf
+import pytest
+from numpy.typing import NDArray
+from scipy.signal import sosfilt
+from scipy.stats import linregress
+
+from models.bands import MATERIAL_BANDS, OCTAVE_BANDS
+from services.analysis_service import (
+    BLOCK_SIZE,
+    InverseFilter,
+    SweepSettings,
+    analyze_acoustic_parameters,
+    analyze_recordings,
+    calculate_acoustic_parameters,
+    calculate_band_parameters,
+    calculate_impulse_response_linear,
+    calculate_impulse_response_rfft,
+    calculate_transfer_function,
+    create_in,
+    decode_audio_data,
+    find_impulse_response_bounds,
+    get_filter_bank,
+    get_inverse_sweep_spectrum,
+    get_octave_band_filters,
+    separate_impulse_responses,
+    stack_recordings,
+)
+from scipy.fft import ifft
+
+
+def loop_impulse_response_bounds(ir: NDArray[np.floating], threshold: float) -> tuple[int, int] | None:
+    """Reference implementation: the original sample-by-sample scan"""
+    for i in range(len(ir) - 1, 0, -1):
+        if np.abs(ir[i]) > threshold:
+            end_idx = i
+            break
+    else:
+        return None
+
+    found_low = False
+    for i in range(end_idx - 1, 0, -1):
+        if np.abs(ir[i]) <= threshold:
+            found_low = True
+        elif found_low and np.abs(ir[i]) > threshold:
+            start_idx = i
+            break
+    else:
+        start_idx = 0
+
+    return start_idx, end_idx
+
+
+def test_impulse_response_bounds_match_loop_on_random_signals() -> None:
+    rng = np.random.default_rng(1234)
+    for _ in range(200):
+        length = int(rng.integers(1, 64))
+        ir = rng.normal(size=length) * (rng.random(length) > rng.random())
+        threshold = float(rng.random())
+        assert find_impulse_response_bounds(ir, threshold) == loop_impulse_response_bounds(ir, threshold)
+
+
+def test_impulse_response_bounds_match_loop_on_wrapped_response() -> None:
+    fs = 8000
+    t = np.arange(fs) / fs
+    decay = np.exp(-t * 30) * np.sin(2 * np.pi * 440 * t)
+    ir = np.roll(np.concatenate([decay, np.zeros(fs)]), fs + fs // 2)
+    threshold = 0.00005 * np.max(np.abs(ir))
+
+    bounds = find_impulse_response_bounds(ir, threshold)
+    assert bounds == loop_impulse_response_bounds(ir, threshold)
+
+
+def test_impulse_response_bounds_edge_cases() -> None:
+    assert find_impulse_response_bounds(np.zeros(10), 0.0) is None
+    assert find_impulse_response_bounds(np.array([1.0]), 0.5) is None
+    assert find_impulse_response_bounds(np.ones(10), 0.5) == (0, 9)
+
+
+def loop_acoustic_parameters(ir: NDArray[np.floating], fs: int, filters: Sequence[NDArray[np.floating]]) -> dict[str, list[float]]:
+    """Reference implementation: the original per band calculation"""
+    def rt60(ir_filtered: NDArray[np.floating]) -> float:
+        energy_decay = np.cumsum((ir_filtered**2)[::-1])[::-1]
+        energy_decay_db = 10 * np.log10(energy_decay / energy_decay[0] + 1e-12)
+        time_axis = np.arange(len(ir_filtered)) / fs
+        idx_5db = int(np.argmax(energy_decay_db <= -5))
+        for level, factor in ((-35, 2), (-25, 3)):
+            idx = int(np.argmax(energy_decay_db <= level))
+            if idx > idx_5db and energy_decay_db[idx] <= level and idx - idx_5db + 1 > 2:
+                slope = linregress(time_axis[idx_5db:idx + 1], energy_decay_db[idx_5db:idx + 1]).slope
+                if slope < 0:
+                    return float(-(-level - 5) / slope * factor)
+        return np.nan
+
+    def clarity(ir_squared: NDArray[np.floating], limit: float) -> float:
+        idx = min(int(limit * fs), len(ir_squared) - 1)
+        return float(10 * np.log10(np.sum(ir_squared[:idx]) / np.sum(ir_squared[idx:])))
+
+    total = np.sum(ir**2)
+    result: dict[str, list[float]] = {"rt60": [], "c50": [], "c80": [], "d50": [], "g": []}
+    for sos in filters:
+        ir_squared = sosfilt(sos, ir)**2
+        idx_50ms = min(int(0.05 * fs), len(ir_squared) - 1)
+        result["rt60"].append(rt60(np.sqrt(ir_squared)))
+        result["c50"].append(clarity(ir_squared, 0.05))
+        result["c80"].append(clarity(ir_squared, 0.08))
+        result["d50"].append(float(np.sum(ir_squared[:idx_50ms]) / np.sum(ir_squared) * 100))
+        result["g"].append(float(10 * np.log10(np.sum(ir_squared) / (total / len(filters)))))
+    return result
+
+
+def test_batched_acoustic_parameters_match_per_band_loop() -> None:
+    fs = 48000
+    rng = np.random.default_rng(42)
+    t = np.arange(fs) / fs
+    ir = rng.normal(size=fs) * np.exp(-t * 6.9 / 0.6)
+
+    center_freqs, filters = get_octave_band_filters(fs)
+    params = calculate_acoustic_parameters(ir, fs, center_freqs, filters)
+    expected = loop_acoustic_parameters(ir, fs, filters)
+
+    for name, values in expected.items():
+        np.testing.assert_allclose(getattr(params, name), values, rtol=1e-6, err_msg=name)
+    assert not np.any(np.isnan(params.rt60))
+    assert params.sampleRate == fs
+
+
+def test_band_analysis_peak_memory_stays_near_per_band_loop() -> None:
+    fs = 48000
+    rng = np.random.default_rng(3)
+    t = np.arange(5 * fs) / fs
+    ir = rng.normal(size=len(t)) * np.exp(-t * 6.9 / 1.5)
+    center_freqs, filters = get_octave_band_filters(fs)
+
+    def peak(run: Callable[[], object]) -> int:
+        tracemalloc.start()
+        try:
+            run()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    loop_peak = peak(lambda: loop_acoustic_parameters(ir, fs, filters))
+    batched_peak = peak(lambda: calculate_acoustic_parameters(ir, fs, center_freqs, filters))
+    # The batched result also holds the ir as a list (about 4 ir sizes), a full (bands x samples) stack would take 18
+    assert batched_peak < 2 * loop_peak
+
+
+def test_float32_halves_the_band_buffers() -> None:
+    fs = 48000
+    rng = np.random.default_rng(5)
+    t = np.arange(5 * fs) / fs
+    ir = rng.normal(size=len(t)) * np.exp(-t * 6.9 / 1.5)
+    _, filters = get_octave_band_filters(fs)
+
+    peaks = {}
+    for precision in ("float64", "float32"):
+        samples: NDArray[np.floating] = ir.astype(precision)
+        tracemalloc.start()
+        try:
+            calculate_band_parameters(samples, fs, filters)
+            peaks[precision] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    # Only the prefix sums of the decay fit stay in double precision
+    assert peaks["float32"] < 0.6 * peaks["float64"]
+
+
+def test_acoustic_parameters_of_silence_are_nan() -> None:
+    fs = 8000
+    center_freqs, filters = get_octave_band_filters(fs)
+    params = calculate_acoustic_parameters(np.zeros(fs), fs, center_freqs, filters)
+
+    assert np.all(np.isnan(params.rt60))
+    assert np.all(np.isnan(params.c50))
+    assert np.all(np.isnan(params.d50))
+    assert np.all(np.isnan(params.g))
+
+
+def test_sweep_and_inverse_spectrum_are_cached_read_only() -> None:
+    sweep = SweepSettings(duration=1.0)
+    assert create_in(44100, sweep) is create_in(44100, sweep)
+    assert len(create_in(44100, sweep)) == 44100
+    assert not create_in(44100, sweep).flags.writeable
+
+    spectrum = get_inverse_sweep_spectrum(44100, 44100, sweep)
+    assert spectrum is get_inverse_sweep_spectrum(44100, 44100, sweep)
+    assert not spectrum.flags.writeable
+
+    # Whole spectra take several MB each, only a handful is kept
+    for length in range(44000, 44010):
+        get_inverse_sweep_spectrum(44100, length, sweep)
+    assert get_inverse_sweep_spectrum.cache_info().currsize <= 4
+
+
+@pytest.mark.parametrize("sample_rate", [44100, 48000])
+@pytest.mark.parametrize("inverse", ["reciprocal", "farina"])
+def test_transfer_function_recovers_delayed_impulse(sample_rate: int, inverse: InverseFilter) -> None:
+    sweep = SweepSettings(duration=1.0)
+    delay = 123
+    recording = 0.5 * np.roll(create_in(sample_rate, sweep), delay)
+
+    ir = np.real(ifft(calculate_transfer_function(recording, sample_rate, sweep, inverse)))
+
+    assert int(np.argmax(np.abs(ir))) == delay
+    # The farina inverse is band limited to the sweep range, so the peak is slightly lower
+    assert ir[delay] == pytest.approx(0.5, rel=0.2)
+
+
+def test_rfft_deconvolution_recovers_delayed_impulse() -> None:
+    sample_rate = 8000
+    sweep = SweepSettings(duration=1.0, f1=3900)
+    delay = 321
+    recording = np.concatenate([np.zeros(delay), 0.5 * create_in(sample_rate, sweep)])
+
+    ir = calculate_impulse_response_rfft(recording, sample_rate, sweep, workers=2)
+
+    assert len(ir) == sample_rate
+    assert int(np.argmax(np.abs(ir))) == delay
+    assert np.abs(ir[delay]) > 10 * np.max(np.abs(np.delete(ir, range(delay - 8, delay + 9))))
+
+
+def test_deconvolution_modes_agree_on_acoustic_parameters() -> None:
+    sample_rate = 48000
+    rng = np.random.default_rng(7)
+    t = np.arange(sample_rate // 2) / sample_rate
+    room = rng.normal(size=len(t)) * np.exp(-t * 14)
+    recording = np.convolve(create_in(sample_rate), room)
+
+    fft_params = analyze_acoustic_parameters([[recording]], sample_rate, deconvolution="fft")[0][0]
+    rfft_params = analyze_acoustic_parameters([[recording]], sample_rate, deconvolution="rfft")[0][0]
+
+    np.testing.assert_allclose(rfft_params.rt60[4:14], fft_params.rt60[4:14], rtol=0.05)
+
+
+def test_binary_and_base64_recordings_decode_alike() -> None:
+    stereo = np.stack([np.linspace(-1, 1, 480), np.zeros(480)], axis=1)
+    buffer = io.BytesIO()
+    sf.write(buffer, stereo, 48000, format="WAV", subtype="FLOAT")
+    wav = buffer.getvalue()
+
+    binary_audio, binary_rate = decode_audio_data(wav)
+    text_audio, text_rate = decode_audio_data(base64.b64encode(wav).decode())
+
+    assert binary_rate == text_rate == 48000
+    np.testing.assert_array_equal(binary_audio, text_audio)
+    np.testing.assert_allclose(binary_audio, stereo.mean(axis=1), atol=1e-7)
+
+
+def test_multichannel_audio_is_downmixed_block_by_block() -> None:
+    rng = np.random.default_rng(11)
+    audio = rng.uniform(-0.3, 0.3, size=(BLOCK_SIZE + 1000, 3))
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, 16000, format="WAV", subtype="FLOAT")
+
+    for precision in ("float64", "float32"):
+        mono, sample_rate = decode_audio_data(buffer.getvalue(), precision)
+        assert sample_rate == 16000 and mono.dtype == precision and len(mono) == len(audio)
+        np.testing.assert_allclose(mono, np.mean(audio.astype(np.float32), axis=1), rtol=1e-6, atol=1e-7)
+
+
+def test_staggered_sweeps_separate_per_speaker() -> None:
+    fs = 8000
+    sweep = SweepSettings(duration=1.0, f0=50, f1=3000)
+    offset = 4000
+    delays = [300, 300 + offset + 150, 300 + 2 * offset - 200]
+    gains = [1.0, 0.5, 0.25]
+    recording = np.zeros(delays[-1] + len(create_in(fs, sweep)) + fs)
+    for delay, gain in zip(delays, gains):
+        recording[delay:delay + len(create_in(fs, sweep))] += gain * create_in(fs, sweep)
+
+    ir = calculate_impulse_response_linear(recording, fs, sweep)
+    speaker_irs = separate_impulse_responses(ir, [0, offset, 2 * offset], pre_delay=8)
+
+    assert len(speaker_irs) == 3
+    for speaker_ir, gain in zip(speaker_irs, gains):
+        assert int(np.argmax(np.abs(speaker_ir))) == 8
+        assert np.max(np.abs(speaker_ir)) == pytest.approx(gain, rel=0.1)
+
+
+def test_sequential_speakers_give_mic_by_speaker_results() -> None:
+    fs = 8000
+    sweep = SweepSettings(duration=1.0, f0=50, f1=3000)
+    sweep_signal = create_in(fs, sweep)
+    interval = 1.5
+    recordings: list[NDArray[np.floating]] = []
+    for mic_delay, length in [(200, 5 * fs), (260, 5 * fs - 500)]:
+        recording = np.zeros(length)
+        for speaker in range(3):
+            start = mic_delay + int(speaker * interval * fs)
+            recording[start:start + len(sweep_signal)] += sweep_signal
+        recordings.append(recording)
+
+    batch = calculate_impulse_response_linear(stack_recordings(recordings), fs, sweep)
+    single = calculate_impulse_response_linear(recordings[1], fs, sweep)
+    np.testing.assert_allclose(batch[1, :len(single)], single, atol=1e-9)
+
+    results = analyze_acoustic_parameters([recordings], fs, sweep, speaker_offsets=[0, interval, 2 * interval])
+    assert len(results) == 1 and len(results[0]) == 6
+    assert [(params.micIndex, params.speakerIndex) for params in results[0]] == [
+        (mic, speaker) for mic in range(2) for speaker in range(3)
+    ]
+
+
+def test_quiet_first_speaker_does_not_shift_the_others() -> None:
+    fs = 8000
+    sweep = SweepSettings(duration=1.0, f0=50, f1=3000)
+    sweep_signal = create_in(fs, sweep)
+    offset = 6000
+    # The room echoes the loud speaker 1 one window early at 15% of its level, louder than the whole sweep of speaker 0
+    delays = [400, 400 + offset, 400 + 2 * offset]
+    gains = [0.05, 1.0, 0.5]
+    recording = np.zeros(delays[-1] + len(sweep_signal) + fs)
+    for delay, gain in zip(delays, gains):
+        recording[delay:delay + len(sweep_signal)] += gain * sweep_signal
+    recording[delays[1] - offset + 2000:delays[1] - offset + 2000 + len(sweep_signal)] += 0.15 * sweep_signal
+
+    ir = calculate_impulse_response_linear(recording, fs, sweep)
+    speaker_irs = separate_impulse_responses(ir, [0, offset, 2 * offset], pre_delay=8)
+
+    for speaker_ir, gain in zip(speaker_irs[1:], gains[1:]):
+        assert int(np.argmax(np.abs(speaker_ir))) == 8
+        assert np.max(np.abs(speaker_ir)) == pytest.approx(gain, rel=0.1)
+
+
+def test_float32_analysis_stays_close_to_float64() -> None:
+    fs = 16000
+    sweep = SweepSettings(duration=2.0, f0=20, f1=7000)
+    rng = np.random.default_rng(7)
+    t = np.arange(int(0.8 * fs)) / fs
+    room_ir = rng.standard_normal(len(t)) * np.exp(-6.9 * t / 0.5)
+    room_ir[0] = 4
+    recorded = np.convolve(create_in(fs, sweep), room_ir)[:len(create_in(fs, sweep)) + fs]
+    stereo = np.stack([recorded, recorded], axis=1) / np.max(np.abs(recorded))
+
+    buffer = io.BytesIO()
+    sf.write(buffer, stereo, fs, format="WAV", subtype="FLOAT")
+    wav = buffer.getvalue()
+
+    audio, _ = decode_audio_data(wav, "float32")
+    assert audio.dtype == np.float32 and audio.flags.c_contiguous
+
+    for deconvolution in ("fft", "rfft"):
+        reference = analyze_recordings([[wav]], sweep, deconvolution, precision="float64")[0][0]
+        single = analyze_recordings([[wav]], sweep, deconvolution, precision="float32")[0][0]
+
+        assert not np.isnan(reference.rt60).any()
+        # Measured deviations stay below 1e-5 dB and 1e-4 relative
+        np.testing.assert_allclose(single.rt60, reference.rt60, rtol=1e-4)
+        np.testing.assert_allclose(single.c50, reference.c50, atol=1e-4)
+        np.testing.assert_allclose(single.c80, reference.c80, atol=1e-4)
+        np.testing.assert_allclose(single.d50, reference.d50, rtol=1e-4)
+        np.testing.assert_allclose(single.g, reference.g, atol=1e-4)
+
+
+def test_filter_banks_are_cached_per_band_set() -> None:
+    assert get_filter_bank(48000) is get_filter_bank(48000)
+    assert get_octave_band_filters(48000)[1] is get_filter_bank(48000).filters
+
+    material = get_filter_bank(48000, MATERIAL_BANDS, fraction=1)
+    assert material is not get_filter_bank(48000)
+    assert material.center_freqs.tolist() == list(MATERIAL_BANDS)
+    assert len(material.filters) == 6
+
+    # 5000 Hz reaches past nyquist at 8 kHz, 4000 Hz does not fit as an octave at 16 kHz
+    assert get_filter_bank(8000).center_freqs.max() == 3150
+    assert get_filter_bank(16000, OCTAVE_BANDS, fraction=1).center_freqs.max() == 4000
@@ -0,0 +1,93 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Any, cast
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+from database.engine import DataContext
+from database.schemas.user_db import UserDbModel
+from services.auth_service import get_current_user, get_token_header, invalidate_token, token_cache
+
+
+class StubUsers:
+    """Stand-in for the user repository that counts the lookups"""
+
+    def __init__(self, *users: UserDbModel) -> None:
+        self.users = {user.id: user for user in users}
+        self.lookups = 0
+
+    async def find_one_by_id(self, user_id: Any) -> UserDbModel | None:
+        self.lookups += 1
+        return self.users.get(user_id)
+
+
+def make_db(*users: UserDbModel) -> tuple[StubUsers, DataContext]:
+    stub = StubUsers(*users)
+    return stub, cast(DataContext, SimpleNamespace(users=stub))
+
+
+def bearer(token: str) -> HTTPAuthorizationCredentials:
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+
+def test_validated_token_is_not_looked_up_again() -> None:
+    async def run() -> None:
+        user = UserDbModel(id=ObjectId())
+        users, db = make_db(user)
+        token = str(user.id)
+
+        assert await get_token_header(bearer(token), db) == token
+        assert await get_token_header(bearer(token), db) == token
+        assert users.lookups == 1
+
+        # Endpoints that need the user always get it from the database
+        assert await get_current_user(bearer(token), db) == user
+        assert users.lookups == 2
+
+    asyncio.run(run())
+
+
+def test_failed_lookup_drops_the_cached_token() -> None:
+    async def run() -> None:
+        token = str(ObjectId())
+        token_cache.put(token, True)
+        users, db = make_db()
+
+        with pytest.raises(HTTPException) as error:
+            await get_current_user(bearer(token), db)
+        assert error.value.status_code == 401
+        assert token not in token_cache
+
+        with pytest.raises(HTTPException):
+            await get_token_header(bearer(token), db)
+        assert users.lookups == 2
+
+    asyncio.run(run())
+
+
+def test_invalid_token_is_unauthorized() -> None:
+    _, db = make_db()
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(get_token_header(bearer("not an id"), db))
+    assert error.value.status_code == 401
+
+
+def test_token_of_a_migrated_user_is_refused() -> None:
+    async def run() -> None:
+        user = UserDbModel(id=ObjectId())
+        users, db = make_db(user)
+        token = str(user.id)
+        await get_token_header(bearer(token), db)
+
+        # What migrate_user does once the old user is deleted
+        users.users.clear()
+        invalidate_token(token)
+
+        with pytest.raises(HTTPException) as error:
+            await get_token_header(bearer(token), db)
+        assert error.value.status_code == 401
+
+    asyncio.run(run())
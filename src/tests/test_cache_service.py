@@ -0,0 +1,26 @@
+import time
+
+from services.cache_service import LruCache
+
+
+def test_least_recently_used_entry_is_evicted() -> None:
+    cache: LruCache[str, int] = LruCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+
+    cache.put("c", 3)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_entries_expire_after_ttl() -> None:
+    cache: LruCache[str, int] = LruCache(maxsize=2, ttl=0.01)
+    cache.put("a", 1)
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+    assert "a" not in cache
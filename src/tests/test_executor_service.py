@@ -0,0 +1,105 @@
+import asyncio
+import threading
+from typing import Awaitable, Callable
+
+import pytest
+
+from services.executor_service import ExecutorBusyError, JobExecutor
+
+
+def test_job_runs_off_loop() -> None:
+    async def scenario() -> None:
+        executor = JobExecutor("thread", max_workers=1)
+        assert await executor.run(threading.get_ident) != threading.get_ident()
+        assert await executor.run(sum, [1, 2, 3]) == 6
+        executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_job_errors_are_raised_by_run() -> None:
+    async def scenario() -> None:
+        executor = JobExecutor("thread", max_workers=1)
+        with pytest.raises(ValueError):
+            await executor.run(int, "not a number")
+        executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_run_waits_while_saturated() -> None:
+    async def scenario() -> None:
+        executor = JobExecutor("thread", max_workers=1, max_pending=1)
+        release = threading.Event()
+        first = asyncio.create_task(executor.run(release.wait))
+        await asyncio.sleep(0.05)
+        assert executor.saturated
+
+        second = asyncio.create_task(executor.run(lambda: "done"))
+        await asyncio.sleep(0.05)
+        assert not second.done()
+
+        release.set()
+        await first
+        assert await second == "done"
+        executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_jobs_beyond_queue_limit_are_rejected() -> None:
+    async def scenario() -> None:
+        executor = JobExecutor("thread", max_workers=1, max_pending=1, max_queued=1)
+        release = threading.Event()
+        running = asyncio.create_task(executor.run(release.wait))
+        await asyncio.sleep(0.05)
+        queued = asyncio.create_task(executor.run(lambda: "queued"))
+        await asyncio.sleep(0.05)
+
+        with pytest.raises(ExecutorBusyError):
+            await executor.run(lambda: "rejected")
+
+        release.set()
+        assert await running
+        assert await queued == "queued"
+        executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_run_times_out() -> None:
+    async def scenario() -> None:
+        executor = JobExecutor("thread", max_workers=1, timeout=0.05)
+        release = threading.Event()
+        with pytest.raises(TimeoutError):
+            await executor.run(release.wait)
+        release.set()
+        executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_start_is_notified_once_the_job_has_a_slot() -> None:
+    async def scenario() -> None:
+        executor = JobExecutor("thread", max_workers=1, max_pending=1)
+        release = threading.Event()
+        started: list[str] = []
+
+        def notify(name: str) -> Callable[[], Awaitable[None]]:
+            async def start() -> None:
+                started.append(name)
+            return start
+
+        running = asyncio.create_task(executor.run_and_notify(notify("running"), release.wait))
+        await asyncio.sleep(0.05)
+        queued = asyncio.create_task(executor.run_and_notify(notify("queued"), lambda: "queued"))
+        await asyncio.sleep(0.05)
+        assert started == ["running"]
+
+        release.set()
+        await running
+        assert await queued == "queued"
+        assert started == ["running", "queued"]
+        executor.shutdown()
+
+    asyncio.run(scenario())
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+from types import SimpleNamespace
+from typing import Any, List, cast
+
+import pytest
+
+from database.engine import DataContext
+from database.schemas.material_db import MaterialDbModel
+from services.get_material import MaterialIndex
+
+
+class StubMaterials:
+    """Stand-in for the material repository that counts how often the collection is loaded"""
+
+    def __init__(self, descriptions: List[str]) -> None:
+        self.descriptions = descriptions
+        self.loads = 0
+
+    async def find_by(self, query: dict[str, Any]) -> List[MaterialDbModel]:
+        self.loads += 1
+        await asyncio.sleep(0)
+        return [
+            MaterialDbModel(description=description, f125=0.1 * i, f250=0.2, f500=0.3, f1000=0.4, f2000=0.5, f4000=0.6)
+            for i, description in enumerate(self.descriptions)
+        ]
+
+
+DESCRIPTIONS = ["Concrete", "Concrete block, painted", "Carpet on concrete", "Heavy curtain", "Wood panel"]
+
+
+def make_index(descriptions: List[str] = DESCRIPTIONS, ttl: float = 600) -> tuple[MaterialIndex, StubMaterials, DataContext]:
+    materials = StubMaterials(descriptions)
+    return MaterialIndex(ttl), materials, cast(DataContext, SimpleNamespace(materials=materials))
+
+
+def loaded_index(descriptions: List[str] = DESCRIPTIONS) -> MaterialIndex:
+    index, _, db = make_index(descriptions)
+    asyncio.run(index.ensure_loaded(db))
+    return index
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("Concrete", "Concrete"),
+    ("  CONCRETE ", "Concrete"),
+    ("concrete block", "Concrete block, painted"),
+    ("curtain", "Heavy curtain"),
+])
+def test_lookup(name: str, expected: str) -> None:
+    material = loaded_index().lookup(name)
+    assert material is not None
+    assert material.name == expected
+
+
+def test_fuzzy_match_is_logged(caplog: pytest.LogCaptureFixture) -> None:
+    index = loaded_index()
+    with caplog.at_level(logging.WARNING, logger="uvicorn.info"):
+        material = index.lookup("wood pannel")
+        assert material is not None and material.name == "Wood panel"
+        assert "'wood pannel' not found, using the similarly named 'Wood panel'" in caplog.text
+
+        caplog.clear()
+        index.lookup("wood")
+        assert not caplog.records
+
+
+def test_shortest_of_several_matches_wins() -> None:
+    index = loaded_index(["Carpet on concrete", "Carpet", "Carpet, thick"])
+    for name in ("carp", "pet"):
+        material = index.lookup(name)
+        assert material is not None
+        assert material.name == "Carpet"
+
+
+def test_unknown_material_is_not_found() -> None:
+    assert loaded_index().lookup("glass") is None
+
+
+def test_coefficients_follow_the_material_bands() -> None:
+    material = loaded_index().lookup("carpet on concrete")
+    assert material is not None
+    assert material.coeffs == pytest.approx([0.2, 0.2, 0.3, 0.4, 0.5, 0.6])
+    assert len(material.center_freqs) == len(material.coeffs)
+
+
+def test_index_is_loaded_once_until_the_ttl_has_passed() -> None:
+    async def run() -> None:
+        index, materials, db = make_index(ttl=0.05)
+
+        await asyncio.gather(*(index.ensure_loaded(db) for _ in range(5)))
+        await index.ensure_loaded(db)
+        assert materials.loads == 1
+
+        time.sleep(0.06)
+        materials.descriptions = ["Glass"]
+        await index.ensure_loaded(db)
+        assert materials.loads == 2
+        assert index.lookup("glass") is not None
+        assert index.lookup("concrete") is None
+
+        index.invalidate()
+        await index.ensure_loaded(db)
+        assert materials.loads == 3
+
+    asyncio.run(run())
@@ -0,0 +1,19 @@
+import numpy as np
+
+from database.schemas.impulse_response_db import ImpulseResponseDbModel
+
+
+def test_impulse_response_round_trips_as_float32() -> None:
+    rng = np.random.default_rng(0)
+    ir = (np.exp(-np.arange(48000) / 4800) * rng.standard_normal(48000)).tolist()
+
+    impulse_response = ImpulseResponseDbModel.from_samples(ir, 48000)
+
+    assert impulse_response.length == len(ir)
+    assert impulse_response.sample_rate == 48000
+    assert len(impulse_response.samples) < len(ir) * 4
+    np.testing.assert_allclose(impulse_response.to_samples(), ir, rtol=1e-6, atol=1e-12)
+
+
+def test_empty_impulse_response() -> None:
+    assert ImpulseResponseDbModel.from_samples([]).to_samples() == []
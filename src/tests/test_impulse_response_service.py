@@ -0,0 +1,161 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Any, List, cast
+
+from bson import ObjectId
+
+from database.engine import DataContext
+from database.schemas.impulse_response_db import ImpulseResponseDbModel
+from database.schemas.measurement_db import MeasurementDbModel
+from database.schemas.room_db import RoomDbModel
+from models import AcousticParameters
+from models.scene import Dimensions, Materials, RoomScene
+from services.impulse_response_service import (
+    has_inline_impulse_responses,
+    load_impulse_responses,
+    migrate_measurement,
+    migrate_room,
+    store_impulse_responses,
+)
+
+
+class FakeImpulseResponses:
+    """Stand-in for the impulse response repository, keeps the documents in a dict"""
+
+    def __init__(self) -> None:
+        self.documents: dict[ObjectId, ImpulseResponseDbModel] = {}
+        self.queries = 0
+
+    async def save_many(self, models: List[ImpulseResponseDbModel]) -> None:
+        for model in models:
+            model.id = ObjectId()
+            self.documents[model.id] = model
+
+    async def find_by(self, query: dict[str, Any]) -> List[ImpulseResponseDbModel]:
+        self.queries += 1
+        return [self.documents[ir_id] for ir_id in query["_id"]["$in"] if ir_id in self.documents]
+
+    def get_collection(self) -> "FakeImpulseResponses":
+        return self
+
+    async def delete_many(self, query: dict[str, Any]) -> None:
+        for ir_id in query["_id"]["$in"]:
+            self.documents.pop(ir_id, None)
+
+
+class FakeDocuments:
+    """
+    Stand-in for the measurement and room repositories holding a single document.
+    The conditional update of the migration only matches while the stored document still has inline impulse responses.
+    """
+
+    def __init__(self, document: Any, field: str) -> None:
+        self.document = document
+        self.field = field
+
+    @staticmethod
+    def to_document(model: Any) -> dict[str, Any]:
+        data: dict[str, Any] = model.model_dump()
+        data["_id"] = data.pop("id")
+        return data
+
+    def get_collection(self) -> "FakeDocuments":
+        return self
+
+    async def update_one(self, query: dict[str, Any], update: dict[str, Any]) -> SimpleNamespace:
+        assert query["_id"] == self.document.id and self.field in query
+        values = getattr(self.document, self.field)
+        if not has_inline_impulse_responses(values or []):
+            return SimpleNamespace(matched_count=0)
+        self.document = type(self.document).model_validate({"id": self.document.id, **update["$set"]})
+        return SimpleNamespace(matched_count=1)
+
+    async def find_one_by_id(self, document_id: ObjectId) -> Any:
+        return self.document if document_id == self.document.id else None
+
+
+def make_db(measurement: MeasurementDbModel | None = None, room: RoomDbModel | None = None) -> Any:
+    return SimpleNamespace(
+        impulse_responses=FakeImpulseResponses(),
+        measurements=FakeDocuments(measurement, "values"),
+        rooms=FakeDocuments(room, "simulation"),
+    )
+
+
+def make_param(ir: List[float], ir_id: str | None = None, sample_rate: int | None = None) -> AcousticParameters:
+    return AcousticParameters(rt60=[0.5], c50=[1.0], c80=[2.0], g=[3.0], d50=[0.5], ir=ir, irId=ir_id, sampleRate=sample_rate)
+
+
+def make_scene() -> RoomScene:
+    walls = dict.fromkeys(["east", "west", "north", "south", "ceiling", "floor"], "Concrete")
+    return RoomScene(
+        dimensions=Dimensions(width=4, height=3, depth=5), materials=Materials(**walls), furniture=[], microphones=[], speakers=[]
+    )
+
+
+def test_store_references_every_impulse_response() -> None:
+    async def run() -> None:
+        db = make_db()
+        loaded = make_param([0.5], str(ObjectId()))
+        values = [[make_param([1.0, 0.25]), make_param([])], [loaded]]
+
+        stored = await store_impulse_responses(values, cast(DataContext, db))
+
+        assert len(db.impulse_responses.documents) == 2
+        assert all(param.ir == [] for cycle in stored for param in cycle)
+        assert stored[0][1].irId is None
+        # Loaded values get impulse responses of their own
+        assert stored[1][0].irId not in (None, loaded.irId)
+        assert values[0][0].ir == [1.0, 0.25]
+
+    asyncio.run(run())
+
+
+def test_load_fills_in_impulse_responses_with_one_query() -> None:
+    async def run() -> None:
+        db = make_db()
+        values = [[make_param([1.0, 0.25], sample_rate=16000), make_param([])], [make_param([0.5])]]
+        stored = await store_impulse_responses(values, cast(DataContext, db))
+        assert db.impulse_responses.documents[ObjectId(stored[0][0].irId)].sample_rate == 16000
+
+        loaded = await load_impulse_responses(stored, cast(DataContext, db))
+
+        assert [[param.ir for param in cycle] for cycle in loaded] == [[[1.0, 0.25], []], [[0.5]]]
+        assert [[param.irId for param in cycle] for cycle in loaded] == [[param.irId for param in cycle] for cycle in stored]
+        assert db.impulse_responses.queries == 1
+
+    asyncio.run(run())
+
+
+def test_migrate_measurement_moves_inline_impulse_responses() -> None:
+    async def run() -> None:
+        measurement = MeasurementDbModel(id=ObjectId(), name="m", ownerToken="u", values=[[make_param([1.0, 0.5])]])
+        db = make_db(measurement=measurement)
+
+        migrated = await migrate_measurement(measurement, cast(DataContext, db))
+
+        assert not has_inline_impulse_responses(migrated.values)
+        assert db.measurements.document.values == migrated.values
+        assert list(db.impulse_responses.documents) == [ObjectId(migrated.values[0][0].irId)]
+        # Migrated documents are left alone
+        assert await migrate_measurement(migrated, cast(DataContext, db)) is migrated
+        assert len(db.impulse_responses.documents) == 1
+
+    asyncio.run(run())
+
+
+def test_losing_migration_drops_its_impulse_responses() -> None:
+    async def run() -> None:
+        room = RoomDbModel(id=ObjectId(), name="r", ownerToken="u", room=make_scene(), simulation=[[make_param([1.0, 0.5])]])
+        db = make_db(room=room)
+
+        winner = await migrate_room(room, cast(DataContext, db))
+        # Another request read the room before the first migration was written
+        loser = await migrate_room(room, cast(DataContext, db))
+
+        assert loser.simulation == winner.simulation
+        assert db.rooms.document.simulation == winner.simulation
+        assert winner.simulation is not None
+        assert list(db.impulse_responses.documents) == [ObjectId(winner.simulation[0][0].irId)]
+
+    asyncio.run(run())
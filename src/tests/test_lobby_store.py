@@ -0,0 +1,284 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+import pytest
+
+from services.lobby_store import InMemoryLobbyStore, LobbyStore, RedisLobbyStore, decode_record, encode_record
+from services.recording_service import RecordingBudget
+from sio.models import Lobby, LobbyClient, RecordData
+
+
+class WatchError(Exception):
+    pass
+
+
+class LocalPipeline:
+    """Stand-in for a redis pipeline, a watched key that was written before execute fails the transaction"""
+
+    def __init__(self, redis: "LocalRedis", watches: tuple[str, ...]) -> None:
+        self.redis = redis
+        self.versions = {key: redis.versions.get(key, 0) for key in watches}
+        self.queued: list[Callable[[], Awaitable[Any]]] = []
+
+    async def get(self, name: str) -> bytes | None:
+        # Lets concurrent transactions interleave between reading and writing
+        await asyncio.sleep(0)
+        return self.redis.values.get(name)
+
+    def multi(self) -> None:
+        pass
+
+    def set(self, name: str, value: bytes, ex: int | None = None) -> Any:
+        self.queued.append(lambda: self.redis.set(name, value, ex))
+
+    def hget(self, name: str, key: str) -> Any:
+        self.queued.append(lambda: self.redis.hget(name, key))
+
+    def hdel(self, name: str, *keys: str) -> Any:
+        self.queued.append(lambda: self.redis.hdel(name, *keys))
+
+    async def execute(self) -> list[Any]:
+        if any(self.redis.versions.get(key, 0) != version for key, version in self.versions.items()):
+            raise WatchError()
+        return [await command() for command in self.queued]
+
+
+class LocalRedis:
+    """Stand-in for the redis commands the store uses, keeps everything in this process"""
+
+    def __init__(self) -> None:
+        self.values: dict[str, bytes] = {}
+        self.hashes: dict[str, dict[str, bytes]] = {}
+        self.lists: dict[str, list[bytes]] = {}
+        self.versions: dict[str, int] = {}
+
+    async def get(self, name: str) -> bytes | None:
+        return self.values.get(name)
+
+    async def set(self, name: str, value: bytes, ex: int | None = None) -> Any:
+        self.values[name] = value
+        self.versions[name] = self.versions.get(name, 0) + 1
+
+    async def delete(self, *names: str) -> Any:
+        for name in names:
+            self.values.pop(name, None)
+            self.hashes.pop(name, None)
+            self.lists.pop(name, None)
+            self.versions[name] = self.versions.get(name, 0) + 1
+
+    async def transaction(
+        self, func: Callable[[Any], Awaitable[Any]], *watches: str, value_from_callable: bool = False
+    ) -> Any:
+        while True:
+            pipe = LocalPipeline(self, watches)
+            value = await func(pipe)
+            try:
+                results = await pipe.execute()
+            except WatchError:
+                continue
+            return value if value_from_callable else results
+
+    async def hget(self, name: str, key: str) -> bytes | None:
+        return self.hashes.get(name, {}).get(key)
+
+    async def hset(self, name: str, key: str, value: bytes) -> int:
+        fields = self.hashes.setdefault(name, {})
+        added = key not in fields
+        fields[key] = value
+        return int(added)
+
+    async def hdel(self, name: str, *keys: str) -> int:
+        fields = self.hashes.get(name, {})
+        return sum(fields.pop(key, None) is not None for key in keys)
+
+    async def rpush(self, name: str, *values: bytes) -> int:
+        self.lists.setdefault(name, []).extend(values)
+        return len(self.lists[name])
+
+    async def lrem(self, name: str, count: int, value: bytes) -> int:
+        # Only the count=-1 form the store uses: removes the last occurrence
+        values = self.lists.get(name, [])
+        if value not in values:
+            return 0
+        del values[len(values) - 1 - values[::-1].index(value)]
+        return 1
+
+    async def blpop(self, keys: list[str], timeout: float) -> tuple[bytes, bytes] | None:
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            for key in keys:
+                if self.lists.get(key):
+                    return key.encode(), self.lists[key].pop(0)
+            if asyncio.get_running_loop().time() >= deadline:
+                return None
+            await asyncio.sleep(0.01)
+
+
+def make_store(kind: str, max_pending: int = 16, budget: RecordingBudget | None = None) -> LobbyStore:
+    return InMemoryLobbyStore(max_pending, budget) if kind == "memory" else RedisLobbyStore(LocalRedis(), max_pending)
+
+
+def make_lobby() -> Lobby:
+    client = LobbyClient(sid="a", index=0, user_id="u")
+    return Lobby(host="a", lobby_id="l", microphones=[client], speakers=[], repetitions=2, delay=0.5, distances={0: {1: 2.5}})
+
+
+@pytest.mark.parametrize("kind", ["memory", "redis"])
+def test_lobbies_are_copies_until_saved(kind: str) -> None:
+    async def run() -> None:
+        store = make_store(kind)
+        await store.save_lobby(make_lobby())
+
+        lobby = await store.get_lobby("l")
+        assert lobby == make_lobby()
+        assert lobby is not None
+        lobby.speakers.append(LobbyClient(sid="b", index=0, user_id="v"))
+        assert await store.get_lobby("l") == make_lobby()
+
+        await store.save_lobby(lobby)
+        assert await store.get_lobby("l") == lobby
+
+        await store.set_running("l", True)
+        assert await store.is_running("l")
+        await store.delete_lobby("l")
+        assert await store.get_lobby("l") is None
+        assert not await store.is_running("l")
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("kind", ["memory", "redis"])
+def test_recordings_pass_through_in_order(kind: str) -> None:
+    async def run() -> None:
+        store = make_store(kind)
+        records = [
+            RecordData(sid="a", recording=b"\x00\xff\x10"),
+            RecordData(sid="b", recording="UklGRg=="),
+            RecordData(sid="c", recording=b"\x00\x00\x80?", sample_rate=48000),
+        ]
+        for record in records:
+            await store.put_recording("l", record)
+
+        assert [await store.get_recording("l", 1) for _ in records] == records
+        assert await store.get_recording("l", 0.05) is None
+
+        await store.put_recording("l", records[0])
+        await store.clear_recordings("l")
+        assert await store.get_recording("l", 0.05) is None
+
+    asyncio.run(run())
+
+
+def test_redis_keeps_binary_recordings_as_they_are() -> None:
+    async def run() -> None:
+        redis = LocalRedis()
+        store = RedisLobbyStore(redis)
+        recording = bytes(range(256)) * 4
+        await store.put_recording("l", RecordData(sid="a", recording=recording, sample_rate=48000))
+
+        stored = redis.hashes["lobby:l:recordings"]["a"]
+        assert stored.endswith(recording) and len(stored) < len(recording) + 64
+        assert await store.get_recording("l", 1) == RecordData(sid="a", recording=recording, sample_rate=48000)
+
+    asyncio.run(run())
+
+
+def test_records_round_trip_through_their_encoding() -> None:
+    for record in (
+        RecordData(sid="a\nb", recording=b"\n\x00\n"),
+        RecordData(sid="a", recording="UklGRg=="),
+        RecordData(sid="a", recording=b""),
+    ):
+        assert decode_record(encode_record(record)) == record
+
+
+def test_deleted_lobby_leaves_no_state_behind() -> None:
+    async def run() -> None:
+        store = InMemoryLobbyStore()
+        await store.put_recording("l", RecordData(sid="a", recording=b"\x00"))
+        await store.get_recording("l", 1)
+        await store.delete_lobby("l")
+
+        assert not store._recordings and not store._arrived
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("kind", ["memory", "redis"])
+def test_full_channel_refuses_recordings(kind: str) -> None:
+    async def run() -> None:
+        store = make_store(kind, max_pending=2)
+        records = [RecordData(sid=sid, recording=b"\x00") for sid in "abc"]
+
+        assert [await store.put_recording("l", record) for record in records] == [True, True, False]
+        assert [await store.get_recording("l", 1) for _ in range(2)] == records[:2]
+        assert await store.put_recording("l", records[2])
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("kind", ["memory", "redis"])
+def test_newer_recording_replaces_the_pending_one_of_its_socket(kind: str) -> None:
+    async def run() -> None:
+        store = make_store(kind, max_pending=2)
+        first, second, resent = (
+            RecordData(sid="a", recording=b"\x00"),
+            RecordData(sid="b", recording=b"\x01"),
+            RecordData(sid="a", recording=b"\x02\x03"),
+        )
+
+        assert await store.put_recording("l", first)
+        assert await store.put_recording("l", second)
+        # The channel is full, but the socket already has a slot
+        assert await store.put_recording("l", resent)
+
+        assert [await store.get_recording("l", 1) for _ in range(2)] == [resent, second]
+        assert await store.get_recording("l", 0.05) is None
+
+    asyncio.run(run())
+
+
+def test_pending_recordings_count_against_the_budget() -> None:
+    async def run() -> None:
+        budget = RecordingBudget(4)
+        store = make_store("memory", budget=budget)
+
+        assert await store.put_recording("l", RecordData(sid="a", recording=b"\x00\x01\x02"))
+        assert budget.held("l") == 3
+        assert not await store.put_recording("l", RecordData(sid="b", recording=b"\x00\x01"))
+        # A refused replacement keeps the pending recording and its reservation
+        assert not await store.put_recording("l", RecordData(sid="a", recording=b"\x00" * 5))
+        assert budget.held("l") == 3
+        assert await store.put_recording("l", RecordData(sid="a", recording=b"\x00"))
+        assert budget.held("l") == 1
+
+        assert await store.get_recording("l", 1) == RecordData(sid="a", recording=b"\x00")
+        assert budget.held("l") == 0
+
+        await store.put_recording("l", RecordData(sid="b", recording=b"\x00\x01"))
+        await store.delete_lobby("l")
+        assert budget.total == 0
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("kind", ["memory", "redis"])
+def test_concurrent_updates_are_not_lost(kind: str) -> None:
+    async def run() -> None:
+        store = make_store(kind)
+        await store.save_lobby(make_lobby())
+
+        def join(sid: str) -> Callable[[Lobby], None]:
+            def update(lobby: Lobby) -> None:
+                lobby.microphones.append(LobbyClient(sid=sid, index=len(lobby.microphones), user_id=sid))
+            return update
+
+        await asyncio.gather(*(store.update_lobby("l", join(sid)) for sid in "bcd"))
+
+        lobby = await store.get_lobby("l")
+        assert lobby is not None
+        assert sorted(mic.sid for mic in lobby.microphones) == ["a", "b", "c", "d"]
+        assert sorted(mic.index for mic in lobby.microphones) == [0, 1, 2, 3]
+        assert await store.update_lobby("missing", join("e")) is None
+
+    asyncio.run(run())
@@ -0,0 +1,35 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from pydantic_mongo.errors import PaginationError
+from pydantic_mongo.pagination import encode_pagination_cursor
+
+from database.pagination import keyset_query, page_cursor
+
+
+def test_first_page_uses_query_unchanged() -> None:
+    assert keyset_query({"members": "a"}) == {"members": "a"}
+
+
+def test_cursor_continues_after_ties_on_updated_at() -> None:
+    updated_at = datetime(2024, 5, 1, 12, 30)
+    document_id = ObjectId()
+
+    query = keyset_query({"members": "a"}, page_cursor(updated_at, document_id))
+
+    assert query == {
+        "$and": [
+            {"members": "a"},
+            {"$or": [
+                {"updated_at": {"$lt": updated_at}},
+                {"updated_at": updated_at, "_id": {"$lt": document_id}},
+            ]},
+        ]
+    }
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", encode_pagination_cursor([1, 2]), encode_pagination_cursor([])])
+def test_invalid_cursor_is_rejected(cursor: str) -> None:
+    with pytest.raises(PaginationError):
+        keyset_query({"members": "a"}, cursor)
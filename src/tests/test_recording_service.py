@@ -0,0 +1,67 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from services.analysis_service import decode_audio_data
+from services.recording_service import RecordingBudget, RecordingBuffer, recording_size, remove_spilled, spill_recording
+
+
+def test_s16_chunks_are_decoded_across_sample_boundaries() -> None:
+    samples = np.array([0, 16384, -32768, 32767, -16384], dtype="<i2")
+    raw = samples.tobytes()
+    buffer = RecordingBuffer(48000, "s16")
+    for start in range(0, len(raw), 3):
+        buffer.append(raw[start:start + 3])
+
+    audio, sample_rate = decode_audio_data(buffer.finish())
+
+    assert sample_rate == 48000
+    np.testing.assert_allclose(audio, samples / 32768)
+
+
+def test_f32_stream_matches_input() -> None:
+    signal = np.sin(np.linspace(0, 10, 1000)).astype("<f4")
+    buffer = RecordingBuffer(44100)
+    for chunk in np.array_split(signal, 7):
+        buffer.append(chunk.tobytes())
+
+    audio, sample_rate = decode_audio_data(buffer.finish())
+
+    assert len(buffer) == 1000 and sample_rate == 44100
+    np.testing.assert_array_equal(audio, signal)
+
+
+def test_stream_longer_than_limit_is_rejected() -> None:
+    buffer = RecordingBuffer(100, max_seconds=1)
+    buffer.append(np.zeros(100, dtype="<f4").tobytes())
+    with pytest.raises(ValueError):
+        buffer.append(np.zeros(1, dtype="<f4").tobytes())
+
+
+def test_budget_refuses_beyond_limit_and_tracks_lobbies() -> None:
+    budget = RecordingBudget(100)
+    assert budget.reserve("a", 60)
+    assert not budget.reserve("b", 50)
+    assert budget.reserve("b", 40)
+    assert budget.gauges() == {"a": 60, "b": 40}
+    assert budget.report() == "100 of 100 bytes held, per lobby {'a': 60, 'b': 40}"
+
+    budget.release("a", 60)
+    budget.drop("b")
+    assert budget.total == 0 and budget.gauges() == {}
+
+
+def test_spilled_recordings_decode_like_in_memory_ones() -> None:
+    signal = np.linspace(-1, 1, 64).astype("<f4")
+    recording = (signal.tobytes(), 16000)
+
+    spilled = spill_recording(recording)
+    try:
+        assert recording_size(spilled) == 0
+        audio, sample_rate = decode_audio_data(spilled)
+        assert sample_rate == 16000
+        np.testing.assert_array_equal(audio, signal)
+    finally:
+        remove_spilled(spilled)
+    assert isinstance(spilled, tuple) and isinstance(spilled[0], Path) and not spilled[0].exists()
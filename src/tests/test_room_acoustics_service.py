@@ -0,0 +1,68 @@
+import time
+
+import numpy as np
+
+from models.material import MaterialAbsorptionResult
+from services.room_acoustics_service import (
+    choose_simulation_parameters,
+    estimate_reverberation_time,
+    run_room_simulation,
+)
+
+WALLS = ["east", "west", "north", "south", "ceiling", "floor"]
+
+
+def uniform_materials(absorption: float) -> dict[str, MaterialAbsorptionResult]:
+    material = MaterialAbsorptionResult(
+        name="test", coeffs=[absorption] * 6, center_freqs=[125, 250, 500, 1000, 2000, 4000]
+    )
+    return {wall: material for wall in WALLS}
+
+
+def test_reverberation_time_follows_sabine() -> None:
+    rt60 = estimate_reverberation_time([10, 10, 10], uniform_materials(0.2))
+    assert rt60 == 0.161 * 1000 / (600 * 0.2)
+
+
+def test_profiles_trade_cost_for_accuracy() -> None:
+    room_dim = [5.0, 4.0, 3.0]
+    materials = uniform_materials(0.2)
+    draft = choose_simulation_parameters("draft", room_dim, materials)
+    standard = choose_simulation_parameters("standard", room_dim, materials)
+    high = choose_simulation_parameters("high", room_dim, materials)
+
+    assert draft["max_order"] <= 3 and draft["ray_tracing"]
+    assert draft["sample_rate"] < standard["sample_rate"]
+    assert draft["rir_length"] / draft["sample_rate"] <= standard["rir_length"] / standard["sample_rate"]
+    assert standard["max_order"] == 10
+    assert not standard["ray_tracing"]
+    assert high["ray_tracing"] and high["air_absorption"]
+
+
+def test_reverberant_hall_uses_ray_tracing_for_standard() -> None:
+    parameters = choose_simulation_parameters("standard", [30.0, 20.0, 10.0], uniform_materials(0.05))
+    assert parameters["ray_tracing"]
+    assert parameters["max_order"] == 3
+
+
+def test_large_damped_hall_uses_ray_tracing_for_standard() -> None:
+    parameters = choose_simulation_parameters("standard", [30.0, 20.0, 10.0], uniform_materials(0.5))
+    assert parameters["max_order"] < 10
+    assert parameters["ray_tracing"]
+
+
+def test_draft_simulation_runs_quickly() -> None:
+    room_dim = [5.0, 4.0, 3.0]
+    materials = uniform_materials(0.2)
+    parameters = choose_simulation_parameters("draft", room_dim, materials)
+
+    start = time.monotonic()
+    results = run_room_simulation(room_dim, materials, [[1.0, 1.0, 1.0]], [[3.0, 2.0, 1.5], [4.0, 3.0, 1.0]], **parameters)
+
+    assert time.monotonic() - start < 5
+    assert len(results) == 2 and len(results[0]) == 1
+    assert len(results[0][0].ir) <= parameters["rir_length"]
+    assert results[0][0].sampleRate == parameters["sample_rate"] == 16000
+    # The tail of the ray tracer keeps the reverberation close to what the room has
+    rt60 = float(np.nanmedian(results[0][0].rt60))
+    assert abs(rt60 - estimate_reverberation_time(room_dim, materials)) < 0.25 * rt60
@@ -0,0 +1,141 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Any, cast
+
+from bson import ObjectId
+
+from api.models.room_scene import RestRoomScene
+from database.engine import DataContext
+from database.schemas.impulse_response_db import ImpulseResponseDbModel
+from database.schemas.simulation_cache_db import SimulationCacheDbModel, SimulationCacheRepository
+from models import AcousticParameters
+from models.material import MaterialAbsorptionResult
+from models.scene import Dimensions, Furniture, Materials, Vector2, Vector3
+from services.simulation_cache_service import SimulationCache, compute_scene_hash
+
+WALLS = ["east", "west", "north", "south", "ceiling", "floor"]
+PARAMETERS: dict[str, Any] = {"quality": "standard", "fs": 16000, "max_order": 3, "ray_tracing": False}
+
+
+def make_scene(room_id: str = "a", material: str = "Concrete", **changes: Any) -> RestRoomScene:
+    scene = RestRoomScene(
+        roomId=room_id,
+        dimensions=Dimensions(width=4, height=3, depth=5),
+        materials=Materials(**dict.fromkeys(WALLS, material)),
+        furniture=[Furniture(height=1, points=[Vector2(x=0, y=0), Vector2(x=1, y=0), Vector2(x=1, y=1)])],
+        microphones=[Vector3(x=1, y=1, z=1.2)],
+        speakers=[Vector3(x=3, y=4, z=1.5)],
+    )
+    return scene.model_copy(update=changes)
+
+
+def make_materials(name: str = "Concrete", coeffs: list[float] | None = None) -> dict[str, MaterialAbsorptionResult]:
+    material = MaterialAbsorptionResult(name=name, coeffs=coeffs or [0.01, 0.02, 0.02], center_freqs=[125, 250, 500])
+    return dict.fromkeys(WALLS, material)
+
+
+def test_hash_ignores_room_and_material_names() -> None:
+    scene_hash = compute_scene_hash(make_scene(), make_materials(), PARAMETERS)
+
+    assert compute_scene_hash(make_scene(room_id="b"), make_materials(), PARAMETERS) == scene_hash
+    assert compute_scene_hash(make_scene(material="Beton"), make_materials("Beton"), PARAMETERS) == scene_hash
+    assert compute_scene_hash(make_scene(), make_materials(), dict(reversed(PARAMETERS.items()))) == scene_hash
+
+
+def test_hash_changes_with_what_the_result_depends_on() -> None:
+    scene_hash = compute_scene_hash(make_scene(), make_materials(), PARAMETERS)
+    changed = [
+        compute_scene_hash(make_scene(dimensions=Dimensions(width=4, height=3, depth=6)), make_materials(), PARAMETERS),
+        compute_scene_hash(make_scene(microphones=[Vector3(x=1, y=2, z=1.2)]), make_materials(), PARAMETERS),
+        compute_scene_hash(make_scene(speakers=[]), make_materials(), PARAMETERS),
+        compute_scene_hash(make_scene(furniture=[]), make_materials(), PARAMETERS),
+        compute_scene_hash(make_scene(), make_materials(coeffs=[0.5, 0.5, 0.5]), PARAMETERS),
+        compute_scene_hash(make_scene(), make_materials(), {**PARAMETERS, "max_order": 10}),
+        compute_scene_hash(make_scene(), make_materials(), {**PARAMETERS, "quality": "draft"}),
+    ]
+
+    assert scene_hash not in changed
+    assert len(set(changed)) == len(changed)
+
+
+class FakeImpulseResponses:
+    def __init__(self) -> None:
+        self.documents: dict[ObjectId, ImpulseResponseDbModel] = {}
+
+    async def save_many(self, models: list[ImpulseResponseDbModel]) -> None:
+        for model in models:
+            model.id = ObjectId()
+            self.documents[model.id] = model
+
+    async def find_by(self, query: dict[str, Any]) -> list[ImpulseResponseDbModel]:
+        return [self.documents[ir_id] for ir_id in query["_id"]["$in"] if ir_id in self.documents]
+
+    def get_collection(self) -> "FakeImpulseResponses":
+        return self
+
+    async def delete_many(self, query: dict[str, Any]) -> None:
+        for ir_id in query["_id"]["$in"]:
+            self.documents.pop(ir_id, None)
+
+
+class FakeCacheEntries:
+    """Stand-in for the simulation_cache repository holding the entries by scene hash"""
+
+    def __init__(self) -> None:
+        self.documents: dict[str, dict[str, Any]] = {}
+        self.lookups = 0
+
+    to_document = staticmethod(SimulationCacheRepository.to_document)
+
+    def to_model(self, document: dict[str, Any]) -> SimulationCacheDbModel:
+        return SimulationCacheDbModel.model_validate(document)
+
+    def get_collection(self) -> "FakeCacheEntries":
+        return self
+
+    async def find_one_and_update(self, query: dict[str, Any], update: dict[str, Any], upsert: bool) -> dict[str, Any] | None:
+        replaced = self.documents.get(query["scene_hash"])
+        self.documents[query["scene_hash"]] = update["$set"]
+        return replaced
+
+    async def find_one_by(self, query: dict[str, Any]) -> SimulationCacheDbModel | None:
+        self.lookups += 1
+        document = self.documents.get(query["scene_hash"])
+        return self.to_model(document) if document is not None else None
+
+
+def make_values(*irs: list[float]) -> list[list[AcousticParameters]]:
+    return [[AcousticParameters(rt60=[0.5], c50=[1.0], c80=[2.0], g=[3.0], d50=[0.5], ir=ir, sampleRate=16000) for ir in irs]]
+
+
+def test_memory_tier_only_keeps_references() -> None:
+    async def run() -> None:
+        db = SimpleNamespace(simulation_cache=FakeCacheEntries(), impulse_responses=FakeImpulseResponses())
+        cache = SimulationCache(maxsize=4, ttl=60)
+
+        await cache.put("scene", make_values([1.0, 0.5], [0.25]), cast(DataContext, db))
+
+        references = cache.memory.get("scene")
+        assert references is not None
+        assert all(param.ir == [] and param.irId is not None for cycle in references for param in cycle)
+        values = await cache.get("scene", cast(DataContext, db))
+        assert values is not None and [param.ir for param in values[0]] == [[1.0, 0.5], [0.25]]
+        assert db.simulation_cache.lookups == 0
+
+    asyncio.run(run())
+
+
+def test_replaced_entry_is_reloaded_from_the_collection() -> None:
+    async def run() -> None:
+        db = SimpleNamespace(simulation_cache=FakeCacheEntries(), impulse_responses=FakeImpulseResponses())
+        first, second = SimulationCache(maxsize=4, ttl=60), SimulationCache(maxsize=4, ttl=60)
+
+        # Two workers simulated the same scene, the second put deletes the impulse responses of the first
+        await first.put("scene", make_values([1.0]), cast(DataContext, db))
+        await second.put("scene", make_values([0.5]), cast(DataContext, db))
+
+        values = await first.get("scene", cast(DataContext, db))
+        assert values is not None and values[0][0].ir == [0.5]
+        assert db.simulation_cache.lookups == 1
+
+    asyncio.run(run())
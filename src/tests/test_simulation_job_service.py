@@ -0,0 +1,94 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, cast
+
+import pytest
+from bson import ObjectId
+
+from api.models.room_scene import RestRoomScene
+from database.engine import DataContext
+from database.schemas.simulation_job_db import SimulationJobDbModel
+from models.scene import Dimensions, Materials
+from services import simulation_job_service
+from services.simulation_job_service import find_simulation_job, simulation_tasks, start_simulation_job
+
+
+class FakeJobs:
+    """Stand-in for the simulation job repository, the documents are shared like the collection of every server worker"""
+
+    def __init__(self) -> None:
+        self.documents: dict[ObjectId, dict[str, Any]] = {}
+
+    async def save(self, model: SimulationJobDbModel) -> None:
+        model.id = ObjectId()
+        self.documents[model.id] = model.model_dump(exclude={"id"})
+
+    async def find_one_by(self, query: dict[str, Any]) -> SimulationJobDbModel | None:
+        document = self.documents.get(query["_id"])
+        if document is None or document["ownerToken"] != query["ownerToken"]:
+            return None
+        return SimulationJobDbModel(id=query["_id"], **document)
+
+    def get_collection(self) -> "FakeJobs":
+        return self
+
+    async def update_one(self, query: dict[str, Any], update: dict[str, Any]) -> None:
+        self.documents[query["_id"]].update(update["$set"])
+
+
+def make_scene() -> RestRoomScene:
+    walls = dict.fromkeys(["east", "west", "north", "south", "ceiling", "floor"], "Concrete")
+    return RestRoomScene(
+        roomId="room", dimensions=Dimensions(width=4, height=3, depth=5), materials=Materials(**walls),
+        furniture=[], microphones=[], speakers=[],
+    )
+
+
+def test_job_status_is_read_from_the_shared_store(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def run() -> None:
+        jobs = FakeJobs()
+        db = cast(DataContext, SimpleNamespace(simulation_jobs=jobs))
+        release = asyncio.Event()
+        statuses: list[str] = []
+
+        async def simulate(room_scene: RestRoomScene, ctx: DataContext, quality: str, on_start: Callable[[], Awaitable[None]]) -> None:
+            await on_start()
+            statuses.append(jobs.documents[ObjectId(job.jobId)]["status"])
+            await release.wait()
+
+        monkeypatch.setattr(simulation_job_service, "simulate_and_store_room", simulate)
+        job = await start_simulation_job(make_scene(), "owner", db, "draft")
+
+        found = await find_simulation_job(job.jobId, "owner", db)
+        assert found is not None and found.status == "queued" and found.quality == "draft"
+        assert await find_simulation_job(job.jobId, "other", db) is None
+        assert await find_simulation_job("not an id", "owner", db) is None
+
+        await asyncio.sleep(0)
+        release.set()
+        await simulation_tasks[job.jobId]
+
+        found = await find_simulation_job(job.jobId, "owner", db)
+        assert statuses == ["running"]
+        assert found is not None and found.status == "done"
+        assert jobs.documents[ObjectId(job.jobId)]["expires_at"] > datetime.now()
+
+    asyncio.run(run())
+
+
+def test_failed_job_keeps_its_error(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def run() -> None:
+        db = cast(DataContext, SimpleNamespace(simulation_jobs=FakeJobs()))
+
+        async def simulate(*args: Any) -> None:
+            raise LookupError("Room not found")
+
+        monkeypatch.setattr(simulation_job_service, "simulate_and_store_room", simulate)
+        job = await start_simulation_job(make_scene(), "owner", db)
+        await simulation_tasks[job.jobId]
+
+        found = await find_simulation_job(job.jobId, "owner", db)
+        assert found is not None and found.status == "failed" and found.error == "Room not found"
+
+    asyncio.run(run())
@@ -0,0 +1,102 @@
+import asyncio
+from datetime import datetime
+from typing import Any, AsyncIterator, List, cast
+
+from bson import ObjectId
+
+from database.schemas.measurement_db import MeasurementRepository, MeasurementSummaryDbModel
+from database.schemas.room_db import ROOM_SUMMARY_PROJECTION, RoomRepository, RoomSummaryDbModel
+from services.mapper_service import map_measurement_summary_db_to_rest_measurement_summary, map_room_summary_db_to_room
+
+
+class FakeCursor:
+    def __init__(self, documents: List[dict[str, Any]]) -> None:
+        self.documents = documents
+
+    def limit(self, limit: int) -> "FakeCursor":
+        return FakeCursor(self.documents[:limit] if limit else self.documents)
+
+    def sort(self, sort: Any) -> "FakeCursor":
+        return self
+
+    async def __aiter__(self) -> AsyncIterator[dict[str, Any]]:
+        for document in self.documents:
+            yield document
+
+
+class FakeCollection:
+    """
+    Stand-in for a collection that applies projections the way MongoDB does for the forms the repositories use:
+    inclusion, exclusion and the has_simulation comparison with null.
+    """
+
+    def __init__(self, documents: List[dict[str, Any]]) -> None:
+        self.documents = documents
+        self.projections: List[dict[str, Any]] = []
+
+    def find(self, query: dict[str, Any], projection: dict[str, Any], sort: Any = None, limit: int = 0) -> FakeCursor:
+        self.projections.append(projection)
+        matching = [document for document in self.documents if query["members"] in document["members"]]
+        return FakeCursor([self.project(document, projection) for document in matching]).limit(limit)
+
+    @staticmethod
+    def project(document: dict[str, Any], projection: dict[str, Any]) -> dict[str, Any]:
+        if all(value == 0 for value in projection.values()):
+            return {key: value for key, value in document.items() if key not in projection}
+
+        projected = {"_id": document["_id"]}
+        for key, value in projection.items():
+            if value == 1:
+                projected[key] = document[key]
+            else:
+                assert value == {"$gt": ["$simulation", None]}
+                projected[key] = document.get("simulation") is not None
+        return projected
+
+
+def make_document(**fields: Any) -> dict[str, Any]:
+    now = datetime(2024, 5, 1, 12, 30)
+    return {"_id": ObjectId(), "name": "a", "ownerToken": "u", "members": ["u"], "created_at": now, "updated_at": now, **fields}
+
+
+def test_room_summaries_leave_out_scene_and_simulation() -> None:
+    async def run() -> None:
+        documents = [
+            make_document(room={"dimensions": {}}, simulation=[[{"rt60": [0.5]}]]),
+            make_document(room={"dimensions": {}}, simulation=None),
+            make_document(room={"dimensions": {}}),
+        ]
+        collection = FakeCollection(documents)
+        repository = RoomRepository(cast(Any, {"rooms": collection}))
+
+        summaries = await repository.find_summary_page("u", 10)
+
+        assert [summary.has_simulation for summary in summaries] == [True, False, False]
+        assert [summary.id for summary in summaries] == [document["_id"] for document in documents]
+        rooms = [map_room_summary_db_to_room(summary, "u") for summary in summaries]
+        assert [room.hasSimulation for room in rooms] == [True, False, False]
+        assert all(room.isOwner for room in rooms)
+
+    asyncio.run(run())
+
+
+def test_room_summary_projection_covers_the_summary_model() -> None:
+    assert set(ROOM_SUMMARY_PROJECTION) == set(RoomSummaryDbModel.model_fields) - {"id"}
+
+
+def test_measurement_summaries_leave_out_values() -> None:
+    async def run() -> None:
+        document = make_document(values=[[{"rt60": [0.5], "ir": [1.0] * 100}]])
+        collection = FakeCollection([document, make_document(members=["v"])])
+        repository = MeasurementRepository(cast(Any, {"measurements": collection}))
+
+        summaries = await repository.find_summary_page("u", 10)
+
+        assert collection.projections == [{"values": 0, "members": 0}]
+        assert summaries == [MeasurementSummaryDbModel(
+            id=document["_id"], name="a", ownerToken="u", created_at=document["created_at"], updated_at=document["updated_at"]
+        )]
+        summary = map_measurement_summary_db_to_rest_measurement_summary(summaries[0], "v")
+        assert summary.id == str(document["_id"]) and not summary.isOwner
+
+    asyncio.run(run())
@@ -0,0 +1,138 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Any, List, cast
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from api.endpoints.user_routes import migrate_members, migrate_user
+from api.models.post_models import PostUserIds
+from database.engine import DataContext
+from database.schemas.user_db import UserDbModel
+from services.auth_service import token_cache
+
+
+def evaluate(expression: Any, document: dict[str, Any]) -> Any:
+    """Evaluates the aggregation expressions migrate_members uses against a document"""
+    if isinstance(expression, str) and expression.startswith("$"):
+        return document.get(expression[1:])
+    if isinstance(expression, dict):
+        (operator, arguments), = expression.items()
+        values = [evaluate(argument, document) for argument in arguments]
+        if operator == "$setUnion":
+            return list(dict.fromkeys(value for array in values for value in array))
+        assert operator == "$setDifference"
+        return [value for value in dict.fromkeys(values[0]) if value not in values[1]]
+    return expression
+
+
+def matches(document: dict[str, Any], query: dict[str, Any]) -> bool:
+    for key, condition in query.items():
+        value = document.get(key)
+        if isinstance(condition, dict):
+            if value not in condition["$in"]:
+                return False
+        elif isinstance(value, list):
+            if condition not in value:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeCollection:
+    """Stand-in for the update operators and queries the migration uses"""
+
+    def __init__(self, documents: List[dict[str, Any]]) -> None:
+        self.documents = documents
+
+    def apply(self, document: dict[str, Any], update: Any) -> None:
+        if isinstance(update, list):
+            for stage in update:
+                document.update({key: evaluate(value, document) for key, value in stage["$set"].items()})
+            return
+        for key, value in update.get("$addToSet", {}).items():
+            document[key] = list(dict.fromkeys([*document.get(key, []), *value["$each"]]))
+        document.update(update.get("$set", {}))
+
+    async def update_one(self, query: dict[str, Any], update: Any) -> SimpleNamespace:
+        matching = [document for document in self.documents if matches(document, query)][:1]
+        for document in matching:
+            self.apply(document, update)
+        return SimpleNamespace(matched_count=len(matching))
+
+    async def update_many(self, query: dict[str, Any], update: Any) -> SimpleNamespace:
+        matching = [document for document in self.documents if matches(document, query)]
+        for document in matching:
+            self.apply(document, update)
+        return SimpleNamespace(matched_count=len(matching))
+
+
+class FakeRepository:
+    def __init__(self, documents: List[dict[str, Any]], fail_deletes: int = 0) -> None:
+        self.collection = FakeCollection(documents)
+        self.fail_deletes = fail_deletes
+
+    def get_collection(self) -> FakeCollection:
+        return self.collection
+
+    async def delete(self, model: UserDbModel) -> None:
+        if self.fail_deletes:
+            self.fail_deletes -= 1
+            raise ConnectionError("connection lost")
+        self.collection.documents = [document for document in self.collection.documents if document["_id"] != model.id]
+
+
+def test_members_replace_the_old_user_once() -> None:
+    pipeline = migrate_members("old", "new")
+
+    for members, expected in [
+        (["old"], ["new"]),
+        (["old", "x"], ["x", "new"]),
+        (["new", "old", "x"], ["new", "x"]),
+        (["new"], ["new"]),
+    ]:
+        document = {"members": members}
+        FakeCollection([document]).apply(document, pipeline)
+        assert sorted(document["members"]) == sorted(expected)
+
+
+def test_interrupted_migration_completes_when_repeated() -> None:
+    async def run() -> None:
+        old_id, new_id = ObjectId(), ObjectId()
+        old, new = str(old_id), str(new_id)
+        own, imported, shared, foreign = ObjectId(), ObjectId(), ObjectId(), ObjectId()
+        rooms: List[dict[str, Any]] = [
+            {"_id": own, "ownerToken": old, "members": [old]},
+            {"_id": imported, "ownerToken": "other", "members": ["other", old]},
+            {"_id": shared, "ownerToken": old, "members": [old, new]},
+            # Owned by the old user but not in its history, e.g. removed from it
+            {"_id": foreign, "ownerToken": old, "members": []},
+        ]
+        old_user = UserDbModel(id=old_id, rooms=[str(own), str(imported), str(shared)], measurements=[])
+        users = FakeRepository([
+            {"_id": old_id, "rooms": old_user.rooms, "measurements": []},
+            {"_id": new_id, "rooms": [str(shared)], "measurements": []},
+        ], fail_deletes=1)
+        db = SimpleNamespace(users=users, rooms=FakeRepository(rooms), measurements=FakeRepository([]))
+        token_cache.put(old, True)
+
+        with pytest.raises(ConnectionError):
+            await migrate_user(PostUserIds(token=new), old_user, cast(DataContext, db))
+        await migrate_user(PostUserIds(token=new), old_user, cast(DataContext, db))
+
+        assert [user["_id"] for user in users.collection.documents] == [new_id]
+        assert users.collection.documents[0]["rooms"] == [str(shared), str(own), str(imported)]
+        assert [room["ownerToken"] for room in rooms] == [new, "other", new, old]
+        assert [sorted(room["members"]) for room in rooms] == [[new], sorted(["other", new]), [new], []]
+        assert old not in token_cache
+
+    asyncio.run(run())
+
+
+def test_migrating_to_itself_is_refused() -> None:
+    user = UserDbModel(id=ObjectId())
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(migrate_user(PostUserIds(token=str(user.id)), user, cast(DataContext, SimpleNamespace())))
+    assert error.value.status_code == 400